@@ -5,7 +5,8 @@ from datetime import timedelta
 import requests
 from django.conf import settings
 from django.db import models
-from django.template import Context, Template
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.utils.translation import gettext_lazy as _
@@ -14,6 +15,7 @@ from fernet_fields import EncryptedTextField
 from twilio.rest import Client
 
 from misc.fields import EncryptedJSONField
+from misc.template_cache import render_template
 from organization.models import Notification
 from organization.utils import send_email_with_notification
 
@@ -86,10 +88,7 @@ class Integration(models.Model):
         if hasattr(self, "new_hire") and self.new_hire is not None:
             text = self.new_hire.personalize(text, self.extra_args | params)
             return text
-        t = Template(text)
-        context = Context(self.extra_args | params)
-        text = t.render(context)
-        return text
+        return render_template(text, self.extra_args | params)
 
     @property
     def has_oauth(self):
@@ -198,3 +197,12 @@ class Integration(models.Model):
         return IntegrationConfigForm(instance=self, data=data)
 
     objects = IntegrationManager()
+
+
+@receiver([post_save, post_delete], sender=Integration)
+def clear_shared_slack_client(sender, instance, **kwargs):
+    # Pick up a new (or removed) Slack token straight away in this process
+    if instance.integration == 0:
+        from slack_bot.utils import clear_slack_client
+
+        clear_slack_client()
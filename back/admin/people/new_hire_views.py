@@ -5,7 +5,6 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.messages.views import SuccessMessageMixin
-from django.db.models import Case, F, IntegerField, When
 from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
@@ -22,6 +21,7 @@ from admin.admin_tasks.models import AdminTask
 from admin.integrations.models import Integration
 from admin.notes.models import Note
 from admin.sequences.models import Condition, Sequence
+from admin.sequences.simulation import SequenceSimulation
 from admin.templates.utils import get_templates_model, get_user_field
 from organization.models import Notification, Organization, WelcomeMessage
 from slack_bot.slack_resource import SlackResource
@@ -120,26 +120,12 @@ class NewHireAddView(
             created_for=new_hire,
         )
 
-        # Update user amount completed
-        new_hire.update_progress()
-
         # Check if there are items that will not be triggered since date passed
-        conditions = Condition.objects.none()
-        for seq in sequences:
-            if new_hire.workday == 0:
-                # User has not started yet, so we only need the items before they new
-                # hire started that passed
-                conditions |= seq.conditions.filter(
-                    condition_type=2, days__lte=new_hire.days_before_starting
-                )
-            else:
-                # user has already started, check both before start day and after for
-                # conditions that are not triggered
-                conditions |= seq.conditions.filter(
-                    condition_type=2
-                ) | seq.conditions.filter(condition_type=0, days__lte=new_hire.workday)
+        conditions = SequenceSimulation.for_new_hire(
+            new_hire, sequences=sequences
+        ).missed
 
-        if conditions.count():
+        if len(conditions):
             return render(
                 self.request,
                 "not_triggered_conditions.html",
@@ -202,26 +188,11 @@ class NewHireAddSequenceView(
         )
 
         # Check if there are items that will not be triggered since date passed
-        conditions = Condition.objects.none()
-        for seq in sequences:
-            if new_hire.workday == 0:
-                # User has not started yet, so we only need the items before they new
-                # hire started that passed
-                conditions |= seq.conditions.filter(
-                    condition_type=2, days__lte=new_hire.days_before_starting
-                )
-            else:
-                # user has already started, check both before start day and after for
-                # conditions that are not triggered
-                conditions |= seq.conditions.filter(
-                    condition_type=2
-                ) | seq.conditions.filter(condition_type=0, days__lte=new_hire.workday)
-
-        if conditions.count():
-            # Prefetch records to avoid a massive amount of queries
-            conditions = Condition.objects.prefetched().filter(
-                id__in=conditions.values_list("pk", flat=True)
-            )
+        conditions = SequenceSimulation.for_new_hire(
+            new_hire, sequences=sequences
+        ).missed
+
+        if len(conditions):
             return render(
                 self.request,
                 "not_triggered_conditions.html",
@@ -253,9 +224,6 @@ class NewHireTriggerConditionView(
         new_hire = get_object_or_404(get_user_model(), id=pk)
         condition.process_condition(new_hire, skip_notification=True)
 
-        # Update user amount completed
-        new_hire.update_progress()
-
         context = self.get_context_data(**kwargs)
         return self.render_to_response(context)
 
@@ -293,27 +261,8 @@ class NewHireSequenceView(
         context["title"] = new_hire.full_name
         context["subtitle"] = _("new hire")
 
-        conditions = new_hire.conditions.prefetched()
-
-        # condition items
-        context["conditions"] = (
-            (
-                conditions.filter(
-                    condition_type=2, days__lte=new_hire.days_before_starting
-                )
-                | conditions.filter(condition_type=0, days__gte=new_hire.workday)
-                | conditions.filter(condition_type=1)
-            )
-            .annotate(
-                days_order=Case(
-                    When(condition_type=2, then=F("days") * -1),
-                    When(condition_type=1, then=99999),
-                    default=F("days"),
-                    output_field=IntegerField(),
-                )
-            )
-            .order_by("days_order")
-        )
+        # condition items, in the order they will be triggered
+        context["conditions"] = SequenceSimulation.for_new_hire(new_hire).upcoming
 
         context["notifications"] = Notification.objects.filter(
             created_for=new_hire
@@ -446,9 +395,10 @@ class NewHireProgressView(LoginRequiredMixin, ManagerPermMixin, DetailView):
         new_hire = self.object
         context["title"] = new_hire.full_name
         context["subtitle"] = _("new hire")
+        # The rating is stored on the item, so no need to load the answers
         context["resources"] = ResourceUser.objects.filter(
             user=new_hire, resource__course=True
-        )
+        ).select_related("resource")
         context["todos"] = ToDoUser.objects.filter(user=new_hire)
         return context
 
@@ -507,15 +457,25 @@ class NewHireReopenTaskView(LoginRequiredMixin, ManagerPermMixin, FormView):
         template_user_model = apps.get_model("users", template_type)
 
         template_user_obj = template_user_model.objects.get(pk=pk)
-        if template_type == "todouser":
-            template_user_obj.completed = False
-            template_user_obj.form = []
-        else:
-            template_user_obj.completed_course = False
-            template_user_obj.step = 0
-            template_user_obj.answers.clear()
+        # Update user amount completed
+        with get_user_model().objects.track_progress(
+            [template_user_obj.user],
+            to_do_ids=[template_user_obj.to_do_id]
+            if template_type == "todouser"
+            else [],
+            resource_ids=[template_user_obj.resource_id]
+            if template_type == "resourceuser"
+            else [],
+        ):
+            if template_type == "todouser":
+                template_user_obj.completed = False
+                template_user_obj.form = []
+            else:
+                template_user_obj.completed_course = False
+                template_user_obj.step = 0
+                template_user_obj.answers.clear()
 
-        template_user_obj.save()
+            template_user_obj.save()
 
         translation.activate(template_user_obj.user.language)
         if template_user_obj.user.has_slack_account:
@@ -542,9 +502,6 @@ class NewHireReopenTaskView(LoginRequiredMixin, ManagerPermMixin, FormView):
         translation.activate(self.request.user.language)
         messages.success(self.request, _("Item has been reopened"))
 
-        # Update user amount completed
-        template_user_obj.user.update_progress()
-
         return redirect("people:new_hire_progress", pk=template_user_obj.user.id)
 
 
@@ -558,9 +515,15 @@ class NewHireCourseAnswersView(LoginRequiredMixin, ManagerPermMixin, DetailView)
         new_hire = self.object
         context["title"] = new_hire.full_name
         context["subtitle"] = _("new hire")
-        context["resource_user"] = get_object_or_404(
+        resource_user = get_object_or_404(
             ResourceUser, user=new_hire, pk=self.kwargs.get("resource_user", -1)
         )
+        context["resource_user"] = resource_user
+        # Load all answers in one go, instead of per question
+        context["answers_by_chapter"] = {
+            course_answer.chapter_id: course_answer
+            for course_answer in resource_user.answers.all()
+        }
         return context
 
 
@@ -671,14 +634,18 @@ class NewHireToggleTaskView(LoginRequiredMixin, ManagerPermMixin, TemplateView):
             raise Http404
 
         template = get_object_or_404(templates_model, id=template_id, template=True)
-        user_items = getattr(user, get_user_field(type))
-        if user_items.filter(id=template.id).exists():
-            user_items.remove(template)
-        else:
-            user_items.add(template)
-
+        user_field = get_user_field(type)
+        user_items = getattr(user, user_field)
         # Update user amount completed
-        user.update_progress()
+        with get_user_model().objects.track_progress(
+            [user],
+            to_do_ids=[template.id] if user_field == "to_do" else [],
+            resource_ids=[template.id] if user_field == "resources" else [],
+        ):
+            if user_items.filter(id=template.id).exists():
+                user_items.remove(template)
+            else:
+                user_items.add(template)
 
         context = self.get_context_data(
             **{
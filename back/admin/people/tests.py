@@ -115,6 +115,7 @@ def test_create_new_hire_with_sequences(
 
 
 @pytest.mark.django_db
+@freeze_time("2022-05-13 12:00:00")
 def test_create_new_hire_with_sequences_before_starting(
     client,
     django_user_model,
@@ -129,8 +130,8 @@ def test_create_new_hire_with_sequences_before_starting(
     to_do2 = to_do_factory()
     to_do3 = to_do_factory()
     sequence = sequence_factory()
-    # before starting
-    condition1 = condition_timed_factory(sequence=sequence, days=1, condition_type=2)
+    # before starting, a day before today
+    condition1 = condition_timed_factory(sequence=sequence, days=8, condition_type=2)
     condition2 = condition_to_do_factory(sequence=sequence)
     # after starting
     condition3 = condition_timed_factory(sequence=sequence, days=1)
@@ -162,6 +163,7 @@ def test_create_new_hire_with_sequences_before_starting(
 
 
 @pytest.mark.django_db
+@freeze_time("2022-05-13 12:00:00")
 def test_create_new_hire_add_sequence_with_manual_trigger_condition(
     client,
     django_user_model,
@@ -211,7 +213,7 @@ def test_create_new_hire_add_sequence_with_manual_trigger_condition(
 
 
 @pytest.mark.django_db
-@freeze_time("2022-05-13 08:00:00")
+@freeze_time("2022-05-13 12:00:00")
 def test_create_new_hire_add_sequence_with_manual_trigger_condition_before_starting(
     client,
     django_user_model,
@@ -1985,7 +1987,7 @@ def test_employee_toggle_resources(
 ):
     client.force_login(django_user_model.objects.create(role=1))
 
-    resource1 = resource_factory()
+    resource1 = resource_factory(course=True)
     employee1 = employee_factory()
 
     url = reverse("people:toggle_resource", args=[employee1.id, resource1.id])
@@ -1993,9 +1995,13 @@ def test_employee_toggle_resources(
 
     assert "Added" in response.content.decode()
     assert employee1.resources.filter(id=resource1.id).exists()
+    employee1.refresh_from_db()
+    assert employee1.total_tasks == 1
 
     # Now remove the item
     response = client.post(url, follow=True)
 
     assert "Add" in response.content.decode()
     assert not employee1.resources.filter(id=resource1.id).exists()
+    employee1.refresh_from_db()
+    assert employee1.total_tasks == 0
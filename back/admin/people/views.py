@@ -13,6 +13,7 @@ from django.views.generic.list import ListView
 
 from admin.integrations.models import Integration
 from admin.resources.models import Resource
+from slack_bot.models import SlackUser
 from slack_bot.utils import Slack, actions, button, paragraph
 from users.emails import email_new_admin_cred
 from users.mixins import (
@@ -115,10 +116,13 @@ class ColleagueToggleResourceView(LoginRequiredMixin, ManagerPermMixin, View):
         context = {}
         user = get_object_or_404(get_user_model(), id=pk)
         resource = get_object_or_404(Resource, id=template_id, template=True)
-        if user.resources.filter(id=resource.id).exists():
-            user.resources.remove(resource)
-        else:
-            user.resources.add(resource)
+        with get_user_model().objects.track_progress(
+            [user], resource_ids=[resource.id]
+        ):
+            if user.resources.filter(id=resource.id).exists():
+                user.resources.remove(resource)
+            else:
+                user.resources.add(resource)
         context["id"] = id
         context["template"] = resource
         context["object"] = user
@@ -128,6 +132,7 @@ class ColleagueToggleResourceView(LoginRequiredMixin, ManagerPermMixin, View):
 class ColleagueSyncSlack(LoginRequiredMixin, ManagerPermMixin, View):
     def get(self, request, *args, **kwargs):
         slack_users = Slack().get_all_users()
+        SlackUser.objects.update_from_slack(slack_users)
 
         for user in slack_users:
             # Skip all bots, fake users, and people with missing profile or missing
@@ -196,13 +201,13 @@ class ColleagueGiveSlackAccessView(LoginRequiredMixin, ManagerPermMixin, View):
             return render(request, self.template_name, context)
 
         # If we can't find the person, then drop the request and let user know
-        response = Slack().find_by_email(user.email)
-        if not response:
+        slack_id = SlackUser.objects.find_id_by_email(user.email)
+        if slack_id is None:
             context["button_name"] = _("Could not find user")
             return render(request, self.template_name, context)
 
         # Connect slack user and send initial message
-        user.slack_user_id = response["user"]["id"]
+        user.slack_user_id = slack_id
         user.save()
         translation.activate(user.language)
         blocks = [
@@ -222,7 +227,7 @@ class ColleagueGiveSlackAccessView(LoginRequiredMixin, ManagerPermMixin, View):
             ),
         ]
 
-        res = Slack().send_message(blocks=blocks, channel=response["user"]["id"])
+        res = Slack().send_message(blocks=blocks, channel=slack_id)
         user.slack_channel_id = res["channel"]
         user.save()
 
@@ -11,7 +11,7 @@ from django.utils.translation import gettext_lazy as _
 
 from misc.fields import ContentJSONField
 from misc.mixins import ContentMixin
-from organization.models import BaseItem
+from organization.models import BaseItem, DuplicateManager
 
 CHAPTER_TYPE = ((0, _("page")), (1, _("folder")), (2, _("questions")))
 
@@ -23,7 +23,33 @@ class Category(models.Model):
         return self.name
 
 
-class ResourceManager(models.Manager):
+class ResourceManager(DuplicateManager):
+    def bulk_duplicate(self, items, change_name=False):
+        # Copy the resources and all their chapters. Chapters are created at once,
+        # after which the parent chapters get pointed to the new ones.
+        old_ids = [resource.id for resource in items]
+        resources = super().bulk_duplicate(items, change_name=change_name)
+        new_resources = dict(zip(old_ids, resources))
+
+        chapters = list(Chapter.objects.filter(resource__in=old_ids))
+        old_chapter_ids = [chapter.id for chapter in chapters]
+        old_parent_ids = [chapter.parent_chapter_id for chapter in chapters]
+        for chapter in chapters:
+            chapter.pk = None
+            chapter._state.adding = True
+            chapter.resource = new_resources[chapter.resource_id]
+            chapter.parent_chapter = None
+        Chapter.objects.bulk_create(chapters)
+
+        new_chapters = dict(zip(old_chapter_ids, chapters))
+        child_chapters = []
+        for chapter, old_parent_id in zip(chapters, old_parent_ids):
+            if old_parent_id is not None:
+                chapter.parent_chapter = new_chapters.get(old_parent_id)
+                child_chapters.append(chapter)
+        Chapter.objects.bulk_update(child_chapters, ["parent_chapter"])
+        return resources
+
     def search(self, u, query):
         query = SearchQuery(query)
         vector = (
@@ -79,34 +105,7 @@ class Resource(BaseItem):
         return "added_resource"
 
     def duplicate(self, change_name=True):
-        old_resource = Resource.objects.get(pk=self.pk)
-        self.pk = None
-        if change_name:
-            self.name = _("%(name)s (duplicate)") % {"name": self.name}
-        self.save()
-
-        # old vs new ids for referencing parent_chapters
-        chapter_ids = []
-
-        for chapter in old_resource.chapters.all().order_by("parent_chapter"):
-            new_chapter = chapter.duplicate()
-            new_chapter.resource = self
-            new_chapter.save()
-            if new_chapter.parent_chapter is not None:
-                new_parent_chapter = next(
-                    (
-                        x["new"]
-                        for x in chapter_ids
-                        if x["old"] == chapter.parent_chapter.id
-                    ),
-                    None,
-                )
-                new_chapter.parent_chapter = new_parent_chapter
-                new_chapter.save()
-
-            chapter_ids.append({"old": chapter.id, "new": new_chapter.id})
-
-        return self
+        return Resource.objects.bulk_duplicate([self], change_name=change_name)[0]
 
     @property
     def update_url(self):
@@ -184,3 +183,17 @@ class Chapter(ContentMixin, models.Model):
 class CourseAnswer(models.Model):
     chapter = models.ForeignKey(Chapter, on_delete=models.CASCADE)
     answers = models.JSONField(default=list)
+
+    def get_score(self):
+        """
+        Grade the given answers against the answers of the chapter.
+
+        :return tuple: amount of questions, amount of correct answers
+        """
+        questions = self.chapter.content["blocks"]
+        amount_of_correct_answers = sum(
+            1
+            for idx, question in enumerate(questions)
+            if self.answers.get(f"item-{idx}") == question.get("answer")
+        )
+        return len(questions), amount_of_correct_answers
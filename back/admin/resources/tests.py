@@ -252,6 +252,10 @@ def test_duplicate_chapter(resource_with_level_deep_chapters_factory):
     for chapter in dupe.chapters.all():
         original_chapter = original_resource.chapters.get(name=chapter.name)
         assert original_chapter.id != chapter.id
+        # Parent chapters point to the new ones
+        if original_chapter.parent_chapter is not None:
+            assert chapter.parent_chapter.resource == dupe
+            assert chapter.parent_chapter.name == original_chapter.parent_chapter.name
 
     # Delete first resource
     original_resource.delete()
@@ -21,65 +21,35 @@ def send_sequence_message(new_hire, admin, message, subject):
     )
 
 
-def send_sequence_update_message(all_notifications, new_hire):
-    # used to send updates to new hires based on things that got assigned to them
+def send_sequence_update_message(item_ids, new_hire):
+    """
+    Used to send updates to new hires based on things that got assigned to them
+
+    :param item_ids dict: ids of the added items per notification type
+    :param new_hire User: the new hire that should get the email
+    """
     org = Organization.object.get()
     subject = _("Here is an update!")
     blocks = []
 
-    notifications = all_notifications.filter(notification_type="added_todo")
-    if notifications.exists():
-        blocks.append(
-            {
-                "type": "paragraph",
-                "data": {
-                    "text": _("Todo item")
-                    if notifications.count() == 1
-                    else _("Todo items")
-                },
-            }
-        )
-        text = ""
-        for to_do in ToDo.objects.filter(
-            id__in=notifications.values_list("item_id", flat=True)
-        ):
-            text += f"- {to_do.name} <br />"
-        blocks.append({"type": "quote", "data": {"text": text}})
-
-    notifications = all_notifications.filter(notification_type="added_resource")
-    if notifications.exists():
-        blocks.append(
-            {
-                "type": "paragraph",
-                "data": {
-                    "text": _("Resource")
-                    if notifications.count() == 1
-                    else _("Resources")
-                },
-            }
-        )
-        text = ""
-        for i in Resource.objects.filter(
-            id__in=notifications.values_list("item_id", flat=True)
-        ):
-            text += f"- {i.name} <br />"
-        blocks.append({"type": "quote", "data": {"text": text}})
+    for notification_type, model, title, title_plural in [
+        ("added_todo", ToDo, _("Todo item"), _("Todo items")),
+        ("added_resource", Resource, _("Resource"), _("Resources")),
+        ("added_badge", Badge, _("Badge"), _("Badges")),
+    ]:
+        ids = item_ids.get(notification_type, [])
+        if not len(ids):
+            continue
 
-    notifications = all_notifications.filter(notification_type="added_badge")
-    if notifications.exists():
         blocks.append(
             {
                 "type": "paragraph",
-                "data": {
-                    "text": _("Badge") if notifications.count() == 1 else _("Badges")
-                },
+                "data": {"text": title if len(ids) == 1 else title_plural},
             }
         )
         text = ""
-        for i in Badge.objects.filter(
-            id__in=notifications.values_list("item_id", flat=True)
-        ):
-            text += f"- {i.name} <br />"
+        for item in model.objects.filter(id__in=ids).only("name"):
+            text += f"- {item.name} <br />"
         blocks.append({"type": "quote", "data": {"text": text}})
 
     html_message = org.create_email({"org": org, "content": blocks, "user": new_hire})
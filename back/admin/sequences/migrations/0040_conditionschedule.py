@@ -0,0 +1,117 @@
+# Generated by Django 3.2.14 on 2026-10-17 06:25
+
+from datetime import datetime, timedelta
+
+import django.db.models.deletion
+import pytz
+from django.conf import settings
+from django.db import migrations, models
+
+
+def get_fire_at(condition_type, days, time, start_day, tz_name):
+    # Copy of `get_condition_fire_at` at the time of writing this migration
+    if start_day is None or days < 1:
+        return None
+
+    if condition_type == 2:
+        fire_date = start_day - timedelta(days=days)
+    elif condition_type == 0:
+        fire_date = start_day
+        workday = 1
+        while workday != days:
+            fire_date += timedelta(days=1)
+            if fire_date.weekday() not in [5, 6]:
+                workday += 1
+        if fire_date.weekday() in [5, 6]:
+            return None
+    else:
+        return None
+
+    local_tz = pytz.timezone(tz_name)
+    return local_tz.localize(datetime.combine(fire_date, time)).astimezone(pytz.utc)
+
+
+def create_condition_schedules(apps, schema_editor):
+    User = apps.get_model("users", "User")
+    Organization = apps.get_model("organization", "Organization")
+    ConditionSchedule = apps.get_model("sequences", "ConditionSchedule")
+
+    org = Organization.object.first()
+    org_timezone = org.timezone if org is not None else "UTC"
+
+    schedules = []
+    for user_condition in User.conditions.through.objects.filter(
+        user__role=0, condition__condition_type__in=[0, 2]
+    ).values(
+        "user_id",
+        "condition_id",
+        "user__start_day",
+        "user__timezone",
+        "condition__condition_type",
+        "condition__days",
+        "condition__time",
+    ):
+        fire_at = get_fire_at(
+            user_condition["condition__condition_type"],
+            user_condition["condition__days"],
+            user_condition["condition__time"],
+            user_condition["user__start_day"],
+            user_condition["user__timezone"] or org_timezone,
+        )
+        if fire_at is not None:
+            schedules.append(
+                ConditionSchedule(
+                    user_id=user_condition["user_id"],
+                    condition_id=user_condition["condition_id"],
+                    fire_at=fire_at,
+                )
+            )
+    ConditionSchedule.objects.bulk_create(schedules, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("organization", "0023_alter_organization_timezone"),
+        ("users", "0026_alter_user_timezone"),
+        ("sequences", "0039_alter_pendingadmintask_assigned_to"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConditionSchedule",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fire_at", models.DateTimeField(db_index=True)),
+                (
+                    "condition",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="schedules",
+                        to="sequences.condition",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="condition_schedules",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "condition")},
+            },
+        ),
+        migrations.RunPython(create_condition_schedules, migrations.RunPython.noop),
+    ]
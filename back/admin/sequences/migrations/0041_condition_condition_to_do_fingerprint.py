@@ -0,0 +1,46 @@
+# Generated by Django 3.2.14 on 2026-10-17 06:42
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def set_condition_to_do_fingerprints(apps, schema_editor):
+    Condition = apps.get_model("sequences", "Condition")
+
+    to_dos = {}
+    for condition_id, to_do_id in Condition.condition_to_do.through.objects.values_list(
+        "condition_id", "todo_id"
+    ):
+        to_dos.setdefault(condition_id, []).append(to_do_id)
+
+    conditions = list(Condition.objects.filter(id__in=to_dos.keys()).only("id"))
+    for condition in conditions:
+        # Same as `get_condition_to_do_fingerprint` at the time of writing this
+        to_do_ids = ",".join(str(to_do_id) for to_do_id in sorted(to_dos[condition.id]))
+        condition.condition_to_do_fingerprint = hashlib.sha256(
+            to_do_ids.encode()
+        ).hexdigest()
+    Condition.objects.bulk_update(
+        conditions, ["condition_to_do_fingerprint"], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sequences", "0040_conditionschedule"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="condition",
+            name="condition_to_do_fingerprint",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=64
+            ),
+        ),
+        migrations.RunPython(
+            set_condition_to_do_fingerprints, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-17 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sequences", "0041_condition_condition_to_do_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conditionschedule",
+            name="fired",
+            field=models.BooleanField(default=False),
+        ),
+    ]
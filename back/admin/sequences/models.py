@@ -1,6 +1,14 @@
+import hashlib
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+import pytz
 from django.conf import settings
-from django.db import models
-from django.db.models import Prefetch
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -16,7 +24,7 @@ from admin.resources.models import Resource
 from admin.to_do.models import ToDo
 from misc.fields import ContentJSONField, EncryptedJSONField
 from misc.mixins import ContentMixin
-from organization.models import Notification
+from organization.models import DuplicateManager, Notification, Organization
 from slack_bot.utils import Slack
 
 from .emails import send_sequence_message
@@ -29,10 +37,164 @@ PEOPLE_CHOICES = (
 )
 
 
+class SequenceManager(models.Manager):
+    def assign_to_users(self, sequences, users):
+        """
+        Add sequences to a group of users (i.e. a cohort starting on the same day) at
+        once. Gives the same result as calling `assign_to_user` for every sequence and
+        user, but with a fixed amount of queries: new conditions are created in one go
+        and every many to many table gets one insert.
+
+        :param sequences list: sequences that should be added (in order)
+        :param users list: users that should get the sequences
+        """
+        sequences = list(sequences)
+        users = list(users)
+        if not len(sequences) or not len(users):
+            return
+
+        sequence_order = {
+            sequence.id: index for index, sequence in enumerate(sequences)
+        }
+        sequence_conditions = sorted(
+            Condition.objects.filter(sequence__in=sequences).order_by("id"),
+            key=lambda condition: sequence_order[condition.sequence_id],
+        )
+        condition_items = Condition.objects.m2m_item_ids(
+            [condition.id for condition in sequence_conditions]
+        )
+
+        # Conditions the users already have, these get the new items if they match
+        UserConditions = get_user_model().conditions.through
+        user_conditions = (
+            UserConditions.objects.filter(
+                user__in=users, condition__condition_type__in=[0, 1, 2]
+            )
+            .order_by("condition_id")
+            .values_list(
+                "user_id",
+                "condition_id",
+                "condition__condition_type",
+                "condition__days",
+                "condition__condition_to_do_fingerprint",
+            )
+        )
+
+        def get_match_key(condition_type, days, condition_to_do_fingerprint):
+            # Timed conditions match on type and amount of days, to do based conditions
+            # on the exact set of to do items
+            if condition_type in [0, 2]:
+                return (condition_type, days)
+            return (condition_type, condition_to_do_fingerprint)
+
+        matches_per_user = {user.id: {} for user in users}
+        for user_id, condition_id, condition_type, days, fingerprint in user_conditions:
+            matches_per_user[user_id].setdefault(
+                get_match_key(condition_type, days, fingerprint), condition_id
+            )
+
+        new_conditions = []
+        # Items per field that should be linked to either the id of an existing
+        # condition or a new (not yet saved) condition
+        new_items = {field.name: [] for field in Condition._meta.many_to_many}
+        unconditional = []
+        for user in users:
+            matches = matches_per_user[user.id]
+            for sequence_condition in sequence_conditions:
+                if sequence_condition.condition_type == 3:
+                    # Condition (always just one) that will be assigned directly
+                    unconditional.append((sequence_condition, user))
+                    continue
+
+                key = get_match_key(
+                    sequence_condition.condition_type,
+                    sequence_condition.days,
+                    sequence_condition.condition_to_do_fingerprint,
+                )
+                user_condition = matches.get(key)
+                if user_condition is None:
+                    # Duplicating condition and adding to user
+                    user_condition = Condition(
+                        condition_type=sequence_condition.condition_type,
+                        days=sequence_condition.days,
+                        time=sequence_condition.time,
+                        condition_to_do_fingerprint=(
+                            sequence_condition.condition_to_do_fingerprint
+                        ),
+                    )
+                    new_conditions.append((user, user_condition))
+                    matches[key] = user_condition
+                    fields = new_items.keys()
+                else:
+                    # We only want to add assigned items to existing ones, not triggers
+                    fields = [
+                        field for field in new_items if field != "condition_to_do"
+                    ]
+
+                for field in fields:
+                    new_items[field] += [
+                        (user_condition, item_id)
+                        for item_id in condition_items[field].get(
+                            sequence_condition.id, []
+                        )
+                    ]
+
+        def get_condition_id(condition):
+            return condition if isinstance(condition, int) else condition.id
+
+        with get_user_model().objects.track_progress(
+            users,
+            to_do_ids={item_id for _, item_id in new_items["to_do"]},
+            resource_ids={item_id for _, item_id in new_items["resources"]},
+        ):
+            Condition.objects.bulk_create(
+                [condition for _, condition in new_conditions]
+            )
+
+            for field in Condition._meta.many_to_many:
+                through = field.remote_field.through
+                # Existing items will be ignored, same as `.add()`
+                through.objects.bulk_create(
+                    [
+                        through(
+                            **{
+                                field.m2m_column_name(): condition_id,
+                                field.m2m_reverse_name(): item_id,
+                            }
+                        )
+                        for condition_id, item_id in {
+                            (get_condition_id(condition), item_id)
+                            for condition, item_id in new_items[field.name]
+                        }
+                    ],
+                    ignore_conflicts=True,
+                )
+
+            if len(new_conditions):
+                UserConditions.objects.bulk_create(
+                    [
+                        UserConditions(user_id=user.id, condition_id=condition.id)
+                        for user, condition in new_conditions
+                    ],
+                    ignore_conflicts=True,
+                )
+
+        if len(new_conditions):
+            # Signals are not sent for bulk inserts
+            ConditionSchedule.objects.rebuild(
+                users=users, conditions=[condition for _, condition in new_conditions]
+            )
+
+        for sequence_condition, user in unconditional:
+            sequence_condition.process_condition(user)
+
+
 class Sequence(models.Model):
     name = models.CharField(verbose_name=_("Name"), max_length=240)
     auto_add = models.BooleanField(default=False)
 
+    objects = SequenceManager()
+
     def __str__(self):
         return self.name
 
@@ -49,82 +211,17 @@ class Sequence(models.Model):
         self.name = _("%(name)s (duplicate)") % {"name": self.name}
         self.auto_add = False
         self.save()
-        for condition in old_sequence.conditions.all():
-            new_condition = condition.duplicate()
-            self.conditions.add(new_condition)
+        conditions = list(old_sequence.conditions.all())
+        for condition in conditions:
+            condition.sequence = self
+        Condition.objects.bulk_duplicate(conditions)
         return self
 
     def assign_to_user(self, user):
-        user_condition = None
-
-        # adding conditions
-        for sequence_condition in self.conditions.all():
-            # Check what kind of condition it is
-            if sequence_condition.condition_type in [0, 2]:
-                # Get the timed based condition or return None if not exist
-                user_condition = user.conditions.filter(
-                    condition_type=sequence_condition.condition_type,
-                    days=sequence_condition.days,
-                ).first()
-
-            elif sequence_condition.condition_type == 1:
-                # For to_do items, filter all condition items to find if one matches
-                # Both the amount and the todos itself need to match exactly
-                conditions = user.conditions.filter(condition_type=1)
-                original_condition_to_do_ids = (
-                    sequence_condition.condition_to_do.all().values_list(
-                        "id", flat=True
-                    )
-                )
-
-                for condition in conditions:
-                    # Quickly check if the amount of items match - if not match, drop
-                    if condition.condition_to_do.all().count() != len(
-                        original_condition_to_do_ids
-                    ):
-                        continue
-
-                    found_to_do_items = condition.condition_to_do.filter(
-                        id__in=original_condition_to_do_ids
-                    ).count()
-
-                    if found_to_do_items == len(original_condition_to_do_ids):
-                        # We found our match. Amount matches AND the todos match
-                        user_condition = condition
-                        break
-            else:
-                # Condition (always just one) that will be assigned directly (type == 3)
-                # Just run the condition with the new hire
-                sequence_condition.process_condition(user)
-                continue
-
-            # Let's add the condition to the new hire. Either through adding it to the
-            # exising one or creating a new one
-            if user_condition is not None:
-                # adding items to existing condition
-                user_condition.include_other_condition(sequence_condition)
-            else:
-                # duplicating condition and adding to user
-                # Force getting it, as we are about to duplicate it and set the pk to
-                # None
-                old_condition = Condition.objects.get(id=sequence_condition.id)
-
-                sequence_condition.pk = None
-                sequence_condition.sequence = None
-                sequence_condition.save()
+        Sequence.objects.assign_to_users([self], [user])
 
-                # Add condition to_dos
-                for condition_to_do in old_condition.condition_to_do.all():
-                    sequence_condition.condition_to_do.add(condition_to_do)
 
-                # Add all the things that get triggered
-                sequence_condition.include_other_condition(old_condition)
-
-                # Add newly created condition back to user
-                user.conditions.add(sequence_condition)
-
-
-class ExternalMessageManager(models.Manager):
+class ExternalMessageManager(DuplicateManager):
     def for_new_hire(self):
         return self.get_queryset().filter(person_type=0)
 
@@ -324,6 +421,8 @@ class PendingAdminTask(models.Model):
         verbose_name=_("Priority"), choices=PRIORITY_CHOICES, default=2
     )
 
+    objects = DuplicateManager()
+
     def get_user(self, new_hire):
         if self.person_type == 0:
             return new_hire
@@ -378,6 +477,8 @@ class IntegrationConfig(models.Model):
     integration = models.ForeignKey(Integration, on_delete=models.CASCADE, null=True)
     additional_data = EncryptedJSONField(default=dict)
 
+    objects = DuplicateManager()
+
     @property
     def name(self):
         return self.integration.name
@@ -393,6 +494,114 @@ class IntegrationConfig(models.Model):
 
 
 class ConditionPrefetchManager(models.Manager):
+    def bulk_duplicate(self, conditions):
+        """
+        Copy conditions and everything that is attached to them. Items that are not
+        templates are unique to the condition, so those get copied as well. Each
+        model gets one insert and so does every many to many table.
+
+        :param conditions list: conditions that should be copied, these become the
+            copies (like with `duplicate()`)
+        :return list: the copies, in the same order
+        """
+        old_ids = [condition.id for condition in conditions]
+        condition_items = self.m2m_item_ids(old_ids)
+        for condition in conditions:
+            condition.pk = None
+            condition._state.adding = True
+        self.bulk_create(conditions)
+        new_ids = dict(zip(old_ids, [condition.id for condition in conditions]))
+
+        for field in self.model._meta.many_to_many:
+            links = [
+                (new_ids[condition_id], item_id)
+                for condition_id, item_ids in condition_items[field.name].items()
+                for item_id in item_ids
+            ]
+            if not len(links):
+                continue
+
+            model = field.related_model
+            items_to_copy = model.objects.filter(id__in=[item for _, item in links])
+            if field.name not in [
+                "admin_tasks",
+                "external_messages",
+                "integration_configs",
+            ]:
+                # Templates are shared, only custom items need to be copied
+                items_to_copy = items_to_copy.filter(template=False)
+            items_to_copy = items_to_copy.in_bulk()
+
+            # Every condition gets its own copy, even if they shared the item
+            copies = [
+                model(
+                    **{
+                        model_field.attname: getattr(
+                            items_to_copy[item_id], model_field.attname
+                        )
+                        for model_field in model._meta.concrete_fields
+                    }
+                )
+                for _, item_id in links
+                if item_id in items_to_copy
+            ]
+            copies = iter(model.objects.bulk_duplicate(copies))
+
+            through = field.remote_field.through
+            through.objects.bulk_create(
+                [
+                    through(
+                        **{
+                            field.m2m_column_name(): condition_id,
+                            field.m2m_reverse_name(): next(copies).id
+                            if item_id in items_to_copy
+                            else item_id,
+                        }
+                    )
+                    for condition_id, item_id in links
+                ]
+            )
+
+        # Custom trigger items got copied, so these will be different
+        self.update_condition_to_do_fingerprints(list(new_ids.values()))
+        return conditions
+
+    def update_condition_to_do_fingerprints(self, condition_ids):
+        to_dos = self.m2m_item_ids(condition_ids, fields=["condition_to_do"])[
+            "condition_to_do"
+        ]
+        conditions = list(self.get_queryset().filter(id__in=condition_ids).only("id"))
+        for condition in conditions:
+            condition.condition_to_do_fingerprint = get_condition_to_do_fingerprint(
+                to_dos.get(condition.id, [])
+            )
+        self.bulk_update(conditions, ["condition_to_do_fingerprint"])
+
+    def m2m_item_ids(self, condition_ids, fields=None):
+        """
+        Get the ids of the items linked to the conditions, with one query per field.
+
+        :param condition_ids list: ids of the conditions
+        :param fields list: names of the many to many fields, defaults to all of them
+        :return dict: {field_name: {condition_id: [item_id, ...]}}
+        """
+        items = {}
+        for field in self.model._meta.many_to_many:
+            if fields is not None and field.name not in fields:
+                continue
+            items[field.name] = {}
+            if not len(condition_ids):
+                continue
+            for condition_id, item_id in (
+                field.remote_field.through.objects.filter(
+                    **{f"{field.m2m_field_name()}__in": condition_ids}
+                )
+                .order_by(field.m2m_reverse_name())
+                .values_list(field.m2m_column_name(), field.m2m_reverse_name())
+            ):
+                items[field.name].setdefault(condition_id, []).append(item_id)
+        return items
+
     def prefetched(self):
         return self.get_queryset().prefetch_related(
             Prefetch("introductions", queryset=Introduction.objects.all()),
@@ -447,6 +656,11 @@ class Condition(models.Model):
         verbose_name=_("Trigger after these to do items have been completed:"),
         related_name="condition_to_do",
     )
+    # Hash of the (sorted) ids of the condition_to_do items. Conditions with the same
+    # trigger have the same fingerprint. Kept up-to-date through signals.
+    condition_to_do_fingerprint = models.CharField(
+        max_length=64, blank=True, db_index=True, editable=False
+    )
     to_do = models.ManyToManyField(ToDo)
     badges = models.ManyToManyField(Badge)
     resources = models.ManyToManyField(Resource)
@@ -459,6 +673,29 @@ class Condition(models.Model):
 
     objects = ConditionPrefetchManager()
 
+    def save(self, *args, **kwargs):
+        is_new = self.pk is None
+        super(Condition, self).save(*args, **kwargs)
+        # Days/time might have changed, so new hires that have this condition need
+        # a new fire time
+        if not is_new:
+            ConditionSchedule.objects.rebuild(conditions=[self])
+
+    def track_progress(self, model_item):
+        # Items of a condition that the new hire will get count towards their
+        # progress. Conditions of sequences aren't linked to any user.
+        if self.sequence_id is not None:
+            return nullcontext()
+        if isinstance(model_item, ToDo):
+            item_ids = {"to_do_ids": [model_item.id]}
+        elif isinstance(model_item, Resource):
+            item_ids = {"resource_ids": [model_item.id]}
+        else:
+            return nullcontext()
+        return get_user_model().objects.track_progress(
+            get_user_model().objects.filter(conditions=self), **item_ids
+        )
+
     def remove_item(self, model_item):
         # If any of the external messages, then get the root one
         if type(model_item)._meta.model_name in [
@@ -468,105 +705,253 @@ class Condition(models.Model):
         ]:
             model_item = ExternalMessage.objects.get(pk=model_item.id)
         # model_item is a template item. I.e. a ToDo object.
-        for field in self._meta.many_to_many:
-            # We only want to remove assigned items, not triggers
-            if field.name == "condition_to_do":
-                continue
-            if (
-                field.related_model._meta.model_name
-                == type(model_item)._meta.model_name
-            ):
-                getattr(self, field.name).remove(model_item)
+        with self.track_progress(model_item):
+            for field in self._meta.many_to_many:
+                # We only want to remove assigned items, not triggers
+                if field.name == "condition_to_do":
+                    continue
+                if (
+                    field.related_model._meta.model_name
+                    == type(model_item)._meta.model_name
+                ):
+                    getattr(self, field.name).remove(model_item)
 
     def add_item(self, model_item):
         # model_item is a template item. I.e. a ToDo object.
-        for field in self._meta.many_to_many:
-            # We only want to add assigned items, not triggers
-            if field.name == "condition_to_do":
-                continue
-            if (
-                field.related_model._meta.model_name
-                == type(model_item)._meta.model_name
-            ):
-                getattr(self, field.name).add(model_item)
-
-    def include_other_condition(self, condition):
-        # this will put another condition into this one
-        for field in self._meta.many_to_many:
-            # We only want to add assigned items, not triggers
-            if field.name == "condition_to_do":
-                continue
-
-            condition_field = getattr(condition, field.name)
-            for item in condition_field.all():
-                getattr(self, field.name).add(item)
+        with self.track_progress(model_item):
+            for field in self._meta.many_to_many:
+                # We only want to add assigned items, not triggers
+                if field.name == "condition_to_do":
+                    continue
+                if (
+                    field.related_model._meta.model_name
+                    == type(model_item)._meta.model_name
+                ):
+                    getattr(self, field.name).add(model_item)
 
     def duplicate(self):
-        old_condition = Condition.objects.get(id=self.id)
-        self.pk = None
-        self.save()
         # This function is not being used except for duplicating sequences
         # It can't be triggered standalone (for now)
-        for field in old_condition._meta.many_to_many:
+        return Condition.objects.bulk_duplicate([Condition.objects.get(id=self.id)])[0]
 
-            if field.name not in [
-                "admin_tasks",
-                "external_messages",
-                "integration_configs",
-            ]:
-                # Duplicate old ones
-                items = []
-                old_custom_templates = getattr(old_condition, field.name).filter(
-                    template=False
+    def process_condition(self, user, skip_notification=False):
+        # None of the items get added if anything fails along the way
+        with transaction.atomic():
+            # Loop over all m2m fields and add the ones that can be easily added.
+            # `add()` skips items the user already has and inserts the rest at once.
+            items_per_field = {
+                field: list(getattr(self, field).all().only("id", "name"))
+                for field in [
+                    "to_do",
+                    "resources",
+                    "badges",
+                    "appointments",
+                    "introductions",
+                    "preboarding",
+                ]
+            }
+            notifications = []
+            with get_user_model().objects.track_progress(
+                [user],
+                to_do_ids=[item.id for item in items_per_field["to_do"]],
+                resource_ids=[item.id for item in items_per_field["resources"]],
+            ):
+                for field, items in items_per_field.items():
+                    if not len(items):
+                        continue
+                    getattr(user, field).add(*items)
+
+                    notifications += [
+                        Notification(
+                            notification_type=item.notification_add_type,
+                            extra_text=item.name,
+                            created_for=user,
+                            item_id=item.id,
+                            notified_user=skip_notification,
+                        )
+                        for item in items
+                    ]
+            Notification.objects.bulk_create(notifications)
+
+        # For the ones that aren't a quick copy/paste, follow back to their model
+        # and execute them. It will also add an item to the notification model
+        # there. These send emails and messages and call external services, which
+        # can't be rolled back, so they are kept out of the transaction.
+        for item in self.admin_tasks.all():
+            item.execute(user)
+        for item in self.external_messages.all():
+            item.execute(user)
+        for item in self.integration_configs.filter(
+            integration__isnull=False
+        ).select_related("integration"):
+            item.integration.execute(user, item.additional_data)
+
+
+def get_condition_to_do_fingerprint(to_do_ids):
+    """
+    Canonical representation of a set of trigger to do items. Empty when there are
+    none.
+
+    :param to_do_ids list: ids of the to do items
+    """
+    if not len(to_do_ids):
+        return ""
+    to_do_ids = ",".join(str(to_do_id) for to_do_id in sorted(set(to_do_ids)))
+    return hashlib.sha256(to_do_ids.encode()).hexdigest()
+
+
+def get_condition_fire_at(
+    condition_type, days, time, start_day, tz_name, business_days=None
+):
+    """
+    Calculates the exact (UTC) moment a timed condition should be triggered for a
+    new hire. Returns None if it will never be triggered.
+
+    :param condition_type int: 0 (after start) or 2 (before start)
+    :param days int: amount of (work)days before/after the start day
+    :param time time: local time the condition should be triggered
+    :param start_day date: start day of the new hire
+    :param tz_name str: timezone of the new hire
+    :param business_days BusinessDayCalendar: calendar with the holidays, defaults to
+        the one of the organization
+    """
+    if start_day is None or days < 1:
+        return None
+
+    if condition_type == 2:
+        fire_date = start_day - timedelta(days=days)
+    elif condition_type == 0:
+        if business_days is None:
+            business_days = Organization.object.get_cached().business_days
+        # The start day itself is workday 1
+        fire_date = business_days.workday_to_date(start_day, days)
+        # Conditions never trigger in weekends or on holidays (i.e. when starting on
+        # a Saturday)
+        if not business_days.is_business_day(fire_date):
+            return None
+    else:
+        return None
+
+    local_tz = pytz.timezone(tz_name)
+    return local_tz.localize(datetime.combine(fire_date, time)).astimezone(pytz.utc)
+
+
+class ConditionScheduleManager(models.Manager):
+    def rebuild(self, users=None, conditions=None):
+        """
+        Recalculate the fire times of the timed conditions for the given users and/or
+        conditions. Conditions that already fired are left alone, so they won't fire
+        a second time.
+        """
+        user_conditions = get_user_model().conditions.through.objects.filter(
+            ~Exists(
+                self.get_queryset().filter(
+                    user_id=OuterRef("user_id"),
+                    condition_id=OuterRef("condition_id"),
+                    fired=True,
                 )
-                for old in old_custom_templates:
-                    dup = old.duplicate(change_name=False)
-                    items.append(dup)
-
-                # Only using set() for template items. The other ones need to be
-                # duplicated as they are unique to the condition
-                old_templates = getattr(old_condition, field.name).filter(template=True)
-                getattr(self, field.name).add(*old_templates, *items)
-
-            else:
-                # For items that do not have templates, just duplicate them
-                items = []
-                old_custom_templates = getattr(old_condition, field.name).all()
-                for old in old_custom_templates:
-                    dup = old.duplicate(change_name=False)
-                    items.append(dup)
-                getattr(self, field.name).add(*items)
-
-        # returning the new item
-        return self
+            ),
+            condition__condition_type__in=[0, 2],
+        )
+        schedules = self.get_queryset().filter(fired=False)
+        if users is not None:
+            user_conditions = user_conditions.filter(user__in=users)
+            schedules = schedules.filter(user__in=users)
+        if conditions is not None:
+            user_conditions = user_conditions.filter(condition__in=conditions)
+            schedules = schedules.filter(condition__in=conditions)
+
+        schedules.delete()
+
+        user_conditions = list(
+            user_conditions.values(
+                "user_id",
+                "condition_id",
+                "user__start_day",
+                "user__timezone",
+                "condition__condition_type",
+                "condition__days",
+                "condition__time",
+            )
+        )
+        if not len(user_conditions):
+            return
+
+        org = Organization.object.get_cached()
+        new_schedules = []
+        for user_condition in user_conditions:
+            fire_at = get_condition_fire_at(
+                user_condition["condition__condition_type"],
+                user_condition["condition__days"],
+                user_condition["condition__time"],
+                user_condition["user__start_day"],
+                user_condition["user__timezone"] or org.timezone,
+                business_days=org.business_days,
+            )
+            if fire_at is not None:
+                new_schedules.append(
+                    ConditionSchedule(
+                        user_id=user_condition["user_id"],
+                        condition_id=user_condition["condition_id"],
+                        fire_at=fire_at,
+                    )
+                )
+        self.bulk_create(new_schedules)
 
-    def process_condition(self, user, skip_notification=False):
-        # Loop over all m2m fields and add the ones that can be easily added
-        for field in [
-            "to_do",
-            "resources",
-            "badges",
-            "appointments",
-            "introductions",
-            "preboarding",
-        ]:
-            for item in getattr(self, field).all():
-                getattr(user, field).add(item)
+    def due(self, start, end):
+        # Everything that should be triggered after `start` up to (and including)
+        # `end`. Only for users that are still new hires.
+        return self.get_queryset().filter(
+            fire_at__gt=start, fire_at__lte=end, fired=False, user__role=0
+        )
 
-                Notification.objects.create(
-                    notification_type=item.notification_add_type,
-                    extra_text=item.name,
-                    created_for=user,
-                    item_id=item.id,
-                    notified_user=skip_notification,
-                )
 
-        # For the ones that aren't a quick copy/paste, follow back to their model and
-        # execute them. It will also add an item to the notification model there.
-        for field in ["admin_tasks", "external_messages", "integration_configs"]:
-            for item in getattr(self, field).all():
-                # Only for integration configs
-                if getattr(item, "integration", None) is not None:
-                    item.integration.execute(user, item.additional_data)
-                else:
-                    item.execute(user)
+class ConditionSchedule(models.Model):
+    # Materialized moment that a timed condition (before/after starting) will be
+    # triggered for a new hire. Kept up-to-date when the condition is added to/removed
+    # from the new hire or when the start day/timezone/days/time change.
+    # Once triggered, it's kept (and not changed anymore) as `fired`.
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="condition_schedules",
+    )
+    condition = models.ForeignKey(
+        Condition, on_delete=models.CASCADE, related_name="schedules"
+    )
+    fire_at = models.DateTimeField(db_index=True)
+    fired = models.BooleanField(default=False)
+
+    objects = ConditionScheduleManager()
+
+    class Meta:
+        unique_together = ("user", "condition")
+
+
+@receiver(m2m_changed, sender=Condition.condition_to_do.through)
+def update_condition_to_do_fingerprint(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    # `instance` is a to do item when it's changed from the other side
+    if reverse and action == "pre_clear":
+        # We won't be able to find the conditions anymore after clearing
+        instance._cleared_condition_ids = list(
+            instance.condition_to_do.values_list("id", flat=True)
+        )
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+
+    if not reverse:
+        condition_ids = [instance.id]
+    elif action == "post_clear":
+        condition_ids = instance._cleared_condition_ids
+    else:
+        condition_ids = list(pk_set)
+    Condition.objects.update_condition_to_do_fingerprints(condition_ids)
+
+
+@receiver(pre_delete, sender=ToDo)
+def remove_to_do_from_conditions(sender, instance, **kwargs):
+    # Deleting rows of the through table doesn't send a signal, so clear them
+    # ourselves to update the fingerprints
+    instance.condition_to_do.clear()
@@ -0,0 +1,141 @@
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from admin.sequences.models import Condition, get_condition_fire_at
+from organization.models import Organization, get_timezone
+
+# Fields with items that end up with (or are executed for) the new hire
+ITEM_FIELDS = [
+    "to_do",
+    "resources",
+    "badges",
+    "appointments",
+    "introductions",
+    "preboarding",
+    "admin_tasks",
+    "integration_configs",
+]
+
+
+class SequenceSimulation:
+    """
+    Works out when the conditions of sequences will be triggered for a new hire,
+    without assigning or changing anything.
+
+    Every condition gets a `fire_at` attribute: the local moment (in the timezone of
+    the new hire) it will be triggered. That's `None` for conditions that don't
+    depend on a date (unconditional and to do based ones) and for timed conditions
+    that will never be triggered (e.g. on a weekend).
+    """
+
+    def __init__(
+        self, conditions, start_day, timezone_name, now=None, business_days=None
+    ):
+        """
+        :param conditions list: conditions, use `Condition.objects.prefetched()` to
+            avoid queries when counting the items
+        :param start_day date: start day of the new hire
+        :param timezone_name str: timezone of the new hire
+        :param now datetime: (aware) moment to compare against, defaults to now
+        :param business_days BusinessDayCalendar: defaults to the one of the
+            organization
+        """
+        self.start_day = start_day
+        self.timezone_name = timezone_name
+        self.now = now if now is not None else timezone.now()
+
+        if business_days is None:
+            business_days = Organization.object.get_cached().business_days
+
+        local_tz = get_timezone(timezone_name)
+        self.conditions = list(conditions)
+        for condition in self.conditions:
+            fire_at = get_condition_fire_at(
+                condition.condition_type,
+                condition.days,
+                condition.time,
+                start_day,
+                timezone_name,
+                business_days=business_days,
+            )
+            condition.fire_at = (
+                fire_at.astimezone(local_tz) if fire_at is not None else None
+            )
+
+    @classmethod
+    def for_sequences(cls, sequences, start_day, timezone_name, now=None):
+        conditions = (
+            Condition.objects.prefetched().filter(sequence__in=sequences).order_by("id")
+        )
+        return cls(conditions, start_day, timezone_name, now=now)
+
+    @classmethod
+    def for_new_hire(cls, new_hire, sequences=None, now=None):
+        # Without sequences, it will use the conditions the new hire already has
+        timezone_name = new_hire.timezone or Organization.object.get_cached().timezone
+        if sequences is not None:
+            return cls.for_sequences(
+                sequences, new_hire.start_day, timezone_name, now=now
+            )
+        conditions = new_hire.conditions.prefetched().order_by("id")
+        return cls(conditions, new_hire.start_day, timezone_name, now=now)
+
+    def is_missed(self, condition):
+        # Timed conditions that are in the past, or will never come, won't be
+        # triggered anymore
+        if condition.condition_type not in [0, 2]:
+            return False
+        return condition.fire_at is None or condition.fire_at <= self.now
+
+    @cached_property
+    def timeline(self):
+        """
+        All conditions in the order they will be triggered: the unconditional ones
+        first, then the timed ones and then the ones waiting for to do items.
+        """
+        unconditional = [c for c in self.conditions if c.condition_type == 3]
+        timed = sorted(
+            [c for c in self.conditions if c.condition_type in [0, 2]],
+            key=lambda c: (c.fire_at is None, c.fire_at or self.now, c.id),
+        )
+        to_do_based = [c for c in self.conditions if c.condition_type == 1]
+        return unconditional + timed + to_do_based
+
+    @cached_property
+    def missed(self):
+        return [condition for condition in self.timeline if self.is_missed(condition)]
+
+    @cached_property
+    def upcoming(self):
+        return [
+            condition
+            for condition in self.timeline
+            if not self.is_missed(condition) and condition.condition_type != 3
+        ]
+
+    @cached_property
+    def item_counts(self):
+        """
+        Amount of items per field that will be added, excluding missed conditions.
+        Items that are in multiple conditions are only counted once, the same as
+        when they are added to the new hire.
+        """
+        item_ids = {field: set() for field in ITEM_FIELDS + ["external_messages"]}
+        for condition in self.timeline:
+            if self.is_missed(condition):
+                continue
+            for field in ITEM_FIELDS:
+                item_ids[field].update(
+                    item.id for item in getattr(condition, field).all()
+                )
+            if hasattr(condition, "external_new_hire"):
+                # Prefetched and split up
+                external_messages = (
+                    condition.external_new_hire + condition.external_admin
+                )
+            else:
+                external_messages = condition.external_messages.all()
+            item_ids["external_messages"].update(
+                message.id for message in external_messages
+            )
+        return {field: len(ids) for field, ids in item_ids.items()}
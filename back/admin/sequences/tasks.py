@@ -1,6 +1,9 @@
 from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from django_q.tasks import async_task
@@ -8,7 +11,7 @@ from django_q.tasks import async_task
 from admin.badges.models import Badge
 from admin.introductions.models import Introduction
 from admin.sequences.emails import send_sequence_update_message
-from admin.sequences.models import Condition
+from admin.sequences.models import Condition, ConditionSchedule
 from organization.models import Notification, Organization
 from slack_bot.slack_intro import SlackIntro
 from slack_bot.slack_resource import SlackResource
@@ -17,6 +20,10 @@ from slack_bot.utils import Slack, paragraph
 from users.models import ResourceUser, ToDoUser
 
 
+def get_process_condition_key(condition_id, user_id):
+    return f"process_condition_{condition_id}_{user_id}"
+
+
 def process_condition(condition_id, user_id, send_email=True):
     """
     Processing triggered condition
@@ -25,7 +32,15 @@ def process_condition(condition_id, user_id, send_email=True):
     :param user_id int: the user that it got triggered for
     :param send_email bool: should send update email (not for portal)
     """
+    try:
+        _process_condition(condition_id, user_id, send_email)
+    finally:
+        # It's done, allow it to be triggered again (i.e. when the to do item gets
+        # reopened and completed again)
+        cache.delete(get_process_condition_key(condition_id, user_id))
 
+
+def _process_condition(condition_id, user_id, send_email):
     condition = Condition.objects.get(id=condition_id)
     user = get_user_model().objects.get(id=user_id)
     condition.process_condition(user)
@@ -42,41 +57,65 @@ def process_condition(condition_id, user_id, send_email=True):
         notified_user=False,
     )
 
-    if not notifications.exists():
+    # Ids of the items that got added, per notification type
+    item_ids = {}
+    for notification_type, item_id in notifications.values_list(
+        "notification_type", "item_id"
+    ):
+        item_ids.setdefault(notification_type, []).append(item_id)
+
+    if not len(item_ids):
         return
 
     if user.has_slack_account:
+        # Load all items in one go per type, the blocks are in the same order as the
+        # notifications
+        to_do_users = {
+            to_do_user.to_do_id: to_do_user
+            for to_do_user in ToDoUser.objects.filter(
+                user=user, to_do__id__in=item_ids.get("added_todo", [])
+            ).select_related("to_do")
+        }
         to_do_blocks = [
-            SlackToDo(
-                ToDoUser.objects.get(to_do__id=notif.item_id, user=user), user
-            ).get_block()
-            for notif in notifications.filter(notification_type="added_todo")
+            SlackToDo(to_do_users[to_do_id], user).get_block()
+            for to_do_id in item_ids.get("added_todo", [])
+            if to_do_id in to_do_users
         ]
 
+        resource_users = {
+            resource_user.resource_id: resource_user
+            for resource_user in ResourceUser.objects.filter(
+                user=user, resource__id__in=item_ids.get("added_resource", [])
+            ).select_related("resource")
+        }
         resource_blocks = [
-            SlackResource(
-                ResourceUser.objects.get(user=user, resource__id=notif.item_id), user
-            ).get_block()
-            for notif in notifications.filter(notification_type="added_resource")
+            SlackResource(resource_users[resource_id], user).get_block()
+            for resource_id in item_ids.get("added_resource", [])
+            if resource_id in resource_users
         ]
 
+        badges = Badge.objects.in_bulk(item_ids.get("added_badge", []))
         badge_blocks = []
-        for notif in notifications.filter(notification_type="added_badge"):
+        for badge_id in item_ids.get("added_badge", []):
+            if badge_id not in badges:
+                continue
             badge_blocks.append(
                 paragraph(
                     _("*Congrats, you unlocked: %(item_name)s *")
                     % {
-                        "item_name": user.personalize(
-                            Badge.objects.get(id=notif.item_id).name
-                        ),
+                        "item_name": user.personalize(badges[badge_id].name),
                     },
                 ),
             )
-            badge_blocks += Badge.objects.get(id=notif.item_id).to_slack_block(user)
+            badge_blocks += badges[badge_id].to_slack_block(user)
 
+        intros = Introduction.objects.select_related(
+            "intro_person__profile_image"
+        ).in_bulk(item_ids.get("added_introduction", []))
         intro_blocks = [
-            SlackIntro(Introduction.objects.get(id=notif.item_id), user).format_block()
-            for notif in notifications.filter(notification_type="added_introduction")
+            SlackIntro(intros[intro_id], user).format_block()
+            for intro_id in item_ids.get("added_introduction", [])
+            if intro_id in intros
         ]
 
         if len(to_do_blocks):
@@ -114,13 +153,38 @@ def process_condition(condition_id, user_id, send_email=True):
                 channel=user.slack_user_id,
             )
     elif send_email:
-        send_sequence_update_message(notifications, user)
+        send_sequence_update_message(item_ids, user)
 
     # Update notifications to not notify user again
     notifications.update(notified_user=True)
 
-    # Update user amount completed
-    user.update_progress()
+
+def queue_process_condition(condition_id, user_id, send_email=True):
+    """
+    Process a triggered condition in the background. The same condition is only
+    queued once for a user until it has been processed, also when it gets triggered
+    twice at the same time (i.e. two trigger items completed at once).
+
+    :param condition_id int: the condition that got triggered
+    :param user_id int: the user that it got triggered for
+    :param send_email bool: should send update email (not for portal)
+    :return bool: True if it got queued
+    """
+    idempotency_key = get_process_condition_key(condition_id, user_id)
+    # Atomic, only the first one gets to add it
+    if not cache.add(
+        idempotency_key, True, settings.PROCESS_CONDITION_IDEMPOTENCY_SECONDS
+    ):
+        return False
+
+    async_task(
+        process_condition,
+        condition_id,
+        user_id,
+        send_email,
+        task_name=f"Process condition: {condition_id} for user {user_id}",
+    )
+    return True
 
 
 def timed_triggers():
@@ -146,41 +210,75 @@ def timed_triggers():
         minute=last_updated.minute - off_by_minutes, second=0, microsecond=0
     )
 
-    # Generally this loop will only go through once. In the case of an outage, it will
-    # walk through all the 5 minutes that it needs to catch up on based on the last
-    # updated variable
-    while current_datetime > last_updated:
-        last_updated += timedelta(minutes=5)
-        org.timed_triggers_last_check = last_updated
-        org.save()
-
-        for user in get_user_model().new_hires.all():
-
-            amount_days = user.workday
-            amount_days_before = user.days_before_starting
-            current_time = user.get_local_time(last_updated).time()
-
-            # Get conditions before/after they started
-            # Generally, this should be only one, but just in case, we can handle more
-            conditions = Condition.objects.none()
-            if amount_days == 0:
-                # Before starting
-                conditions = user.conditions.filter(
-                    condition_type=2, days=amount_days_before, time=current_time
-                )
-            elif user.get_local_time(last_updated).weekday() < 5:
-                # On workday x
-                conditions = user.conditions.filter(
-                    condition_type=0, days=amount_days, time=current_time
-                )
+    if current_datetime <= last_updated:
+        return
+
+    # Generally, this will only be the last 5 minutes. In the case of an outage, it
+    # will include everything that it needs to catch up on based on the last updated
+    # variable. Don't go back further than the cap, sending items that are days old
+    # is not helpful for anyone.
+    last_updated = max(
+        last_updated,
+        current_datetime - timedelta(hours=settings.TIMED_TRIGGERS_MAX_CATCH_UP_HOURS),
+    )
 
-            # Schedule conditions to be executed with new scheduled task, we do this to
-            # avoid long standing tasks. I.e. sending lots of emails might take more
-            # time.
-            for i in conditions:
+    # Schedule conditions to be executed with new scheduled task, we do this to
+    # avoid long standing tasks. I.e. sending lots of emails might take more
+    # time.
+    # Every batch is queued in its own transaction together with marking the
+    # schedules it queued as fired. If this task gets killed halfway, the next run
+    # picks up the remaining ones without queueing any condition twice.
+    while True:
+        with transaction.atomic():
+            due_conditions = get_due_timed_conditions(
+                last_updated,
+                current_datetime,
+                limit=settings.TIMED_TRIGGERS_BATCH_SIZE,
+            )
+            queued_schedules = []
+            for schedule in due_conditions:
+                schedule_id, condition_id, user_id, first_name, last_name = schedule
+                full_name = f"{first_name} {last_name}".strip()
                 async_task(
                     process_condition,
-                    i.id,
-                    user.id,
-                    task_name=f"Process condition: {i.id} for {user.full_name}",
+                    condition_id,
+                    user_id,
+                    task_name=f"Process condition: {condition_id} for {full_name}",
                 )
+                queued_schedules.append(schedule_id)
+            ConditionSchedule.objects.filter(id__in=queued_schedules).update(fired=True)
+
+        if len(due_conditions) < settings.TIMED_TRIGGERS_BATCH_SIZE:
+            break
+
+    # Schedules that are older than this will never be triggered anymore
+    ConditionSchedule.objects.filter(
+        fire_at__lte=current_datetime, fired=False
+    ).delete()
+
+    org.timed_triggers_last_check = current_datetime
+    org.save(update_fields=["timed_triggers_last_check"])
+
+
+def get_due_timed_conditions(start, end, limit=None):
+    """
+    Find all timed conditions (before and after start day) that should be triggered
+    after `start` up to (and including) `end`, based on the precalculated fire times.
+    Schedules that are locked by another (running) task are skipped.
+
+    :param start datetime: (aware) moment that was checked last
+    :param end datetime: (aware) moment up to which should be checked
+    :param limit int: max amount of items to return
+    :return list: (schedule_id, condition_id, user_id, first_name, last_name) tuples
+    """
+    due_conditions = (
+        ConditionSchedule.objects.due(start, end)
+        .select_for_update(skip_locked=True, of=("self",))
+        .order_by("fire_at", "user_id", "condition_id")
+        .values_list(
+            "id", "condition_id", "user_id", "user__first_name", "user__last_name"
+        )
+    )
+    if limit is not None:
+        due_conditions = due_conditions[:limit]
+    return list(due_conditions)
@@ -3,6 +3,7 @@ from datetime import timedelta
 from unittest.mock import Mock, patch
 
 import pytest
+from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.urls import reverse
 from django.utils import timezone
@@ -33,12 +34,19 @@ from admin.sequences.forms import (
 )
 from admin.sequences.models import (
     Condition,
+    ConditionSchedule,
     ExternalMessage,
     IntegrationConfig,
     Sequence,
+    get_condition_to_do_fingerprint,
 )
 from admin.sequences.emails import send_sequence_message
-from admin.sequences.tasks import timed_triggers, process_condition
+from admin.sequences.simulation import SequenceSimulation
+from admin.sequences.tasks import (
+    get_due_timed_conditions,
+    process_condition,
+    timed_triggers,
+)
 from admin.to_do.factories import ToDoFactory
 from admin.to_do.forms import ToDoForm
 from admin.to_do.models import ToDo
@@ -760,6 +768,257 @@ def test_sequence_trigger_task(
     assert new_hire1.badges.all().count() == 1
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "date",
+    [
+        "2021-01-08 08:00",  # Friday
+        "2021-01-09 08:00",  # Saturday
+        "2021-01-11 08:00",  # Monday
+        "2021-01-11 15:00",  # Monday, next day in Tokyo
+        "2021-01-12 01:00",  # Tuesday, previous day in Los Angeles
+    ],
+)
+def test_get_due_timed_conditions_matches_per_user_check(
+    date, new_hire_factory, condition_timed_factory
+):
+    # Fire times are calculated upfront, make sure they match with what we would
+    # get if we check every new hire at that exact moment
+    new_hires = [
+        new_hire_factory(start_day=datetime.date(2021, 1, 11) + timedelta(days=i))
+        for i in range(-9, 4)
+    ]
+    new_hires += [
+        new_hire_factory(
+            start_day=datetime.date(2021, 1, 11) + timedelta(days=i), timezone=tz
+        )
+        for i in range(-3, 3)
+        for tz in ["Asia/Tokyo", "America/Los_Angeles"]
+    ]
+
+    conditions = [
+        condition_timed_factory(condition_type=condition_type, days=days, time=time)
+        for condition_type in [0, 2]
+        for days in range(1, 8)
+        for time in ["08:00", "17:00", "00:00"]
+    ]
+    for new_hire in new_hires:
+        new_hire.conditions.add(*conditions)
+
+    freezer = freeze_time(date, tz_offset=0)
+    freezer.start()
+    slot = timezone.now()
+
+    # The way it used to be calculated: one user at a time
+    expected = []
+    for new_hire in get_user_model().new_hires.all():
+        local_slot = new_hire.get_local_time(slot)
+        if new_hire.workday == 0:
+            conditions = new_hire.conditions.filter(
+                condition_type=2,
+                days=new_hire.days_before_starting,
+                time=local_slot.time(),
+            )
+        elif local_slot.weekday() < 5:
+            conditions = new_hire.conditions.filter(
+                condition_type=0, days=new_hire.workday, time=local_slot.time()
+            )
+        else:
+            conditions = Condition.objects.none()
+        expected += [(condition.id, new_hire.id) for condition in conditions]
+
+    due = [
+        (condition_id, user_id)
+        for _, condition_id, user_id, _, _ in get_due_timed_conditions(
+            slot - timedelta(minutes=5), slot
+        )
+    ]
+    freezer.stop()
+
+    assert len(expected) > 0 or date.startswith("2021-01-09")
+    assert sorted(due) == sorted(expected)
+
+
+@pytest.mark.django_db
+def test_condition_schedule_stays_in_sync(
+    new_hire_factory, condition_timed_factory, sequence_factory
+):
+    # Tuesday
+    new_hire = new_hire_factory(start_day=datetime.date(2021, 1, 12))
+    sequence = sequence_factory()
+    condition_timed_factory(sequence=sequence, days=3, time="10:00")
+    condition_timed_factory(sequence=sequence, condition_type=2, days=2, time="09:00")
+
+    new_hire.add_sequences([sequence])
+
+    schedules = ConditionSchedule.objects.filter(user=new_hire)
+    assert sorted(schedules.values_list("fire_at", flat=True)) == [
+        datetime.datetime(2021, 1, 10, 9, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2021, 1, 14, 10, tzinfo=datetime.timezone.utc),
+    ]
+
+    # Moving the start day/timezone reschedules them
+    new_hire = get_user_model().objects.get(id=new_hire.id)
+    new_hire.start_day = datetime.date(2021, 1, 14)
+    new_hire.timezone = "Europe/Amsterdam"
+    new_hire.save()
+    assert sorted(schedules.values_list("fire_at", flat=True)) == [
+        datetime.datetime(2021, 1, 12, 8, tzinfo=datetime.timezone.utc),
+        # Skipping the weekend
+        datetime.datetime(2021, 1, 18, 9, tzinfo=datetime.timezone.utc),
+    ]
+
+    # Changing the condition itself reschedules it too
+    condition = new_hire.conditions.get(condition_type=0)
+    condition.days = 1
+    condition.save()
+    assert schedules.get(condition=condition).fire_at == datetime.datetime(
+        2021, 1, 14, 9, tzinfo=datetime.timezone.utc
+    )
+
+    # Removing the condition removes the schedule
+    new_hire.conditions.remove(condition)
+    assert schedules.count() == 1
+    new_hire.conditions.clear()
+    assert schedules.count() == 0
+
+    # Same for instances that weren't loaded from the database
+    other_new_hire = new_hire_factory(start_day=datetime.date(2021, 1, 12))
+    other_new_hire.add_sequences([sequence])
+    other_new_hire.start_day = datetime.date(2021, 1, 14)
+    other_new_hire.save()
+    assert sorted(
+        ConditionSchedule.objects.filter(user=other_new_hire).values_list(
+            "fire_at", flat=True
+        )
+    ) == [
+        datetime.datetime(2021, 1, 12, 9, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2021, 1, 18, 10, tzinfo=datetime.timezone.utc),
+    ]
+
+
+@pytest.mark.django_db
+def test_timed_triggers_only_triggers_due_conditions(
+    new_hire_factory, condition_timed_factory, to_do_factory
+):
+    org = Organization.object.get()
+    org.timed_triggers_last_check = datetime.datetime(
+        2021, 1, 12, 9, 55, tzinfo=datetime.timezone.utc
+    )
+    org.save()
+
+    new_hire = new_hire_factory(start_day=datetime.date(2021, 1, 12))
+    condition_now = condition_timed_factory(days=1, time="10:00")
+    condition_now.to_do.add(to_do_factory())
+    condition_later = condition_timed_factory(days=1, time="10:05")
+    condition_later.to_do.add(to_do_factory())
+    new_hire.conditions.add(condition_now, condition_later)
+
+    with freeze_time("2021-01-12 10:03", tz_offset=0):
+        timed_triggers()
+
+    assert new_hire.to_do.count() == 1
+    org.refresh_from_db()
+    assert org.timed_triggers_last_check == datetime.datetime(
+        2021, 1, 12, 10, tzinfo=datetime.timezone.utc
+    )
+
+    # Running it again in the same slot doesn't trigger anything
+    with freeze_time("2021-01-12 10:04", tz_offset=0):
+        timed_triggers()
+
+    assert new_hire.to_do.count() == 1
+
+
+@pytest.mark.django_db
+def test_timed_triggers_do_not_fire_again_after_moving_start_day(
+    new_hire_factory, condition_timed_factory, to_do_factory
+):
+    org = Organization.object.get()
+    org.timed_triggers_last_check = datetime.datetime(
+        2021, 1, 12, 9, 55, tzinfo=datetime.timezone.utc
+    )
+    org.save()
+
+    new_hire = new_hire_factory(start_day=datetime.date(2021, 1, 12))
+    condition_fired = condition_timed_factory(days=1, time="10:00")
+    condition_fired.to_do.add(to_do_factory())
+    condition_later = condition_timed_factory(days=1, time="11:00")
+    condition_later.to_do.add(to_do_factory())
+    new_hire.conditions.add(condition_fired, condition_later)
+
+    with freeze_time("2021-01-12 10:03", tz_offset=0):
+        timed_triggers()
+    assert new_hire.to_do.count() == 1
+
+    # Start day moves a day later, only the condition that didn't fire yet moves
+    new_hire = get_user_model().objects.get(id=new_hire.id)
+    new_hire.start_day = datetime.date(2021, 1, 13)
+    new_hire.save()
+    schedules = ConditionSchedule.objects.filter(user=new_hire)
+    assert schedules.get(condition=condition_fired).fire_at == datetime.datetime(
+        2021, 1, 12, 10, tzinfo=datetime.timezone.utc
+    )
+    assert schedules.get(condition=condition_later).fire_at == datetime.datetime(
+        2021, 1, 13, 11, tzinfo=datetime.timezone.utc
+    )
+
+    # Changing the condition that fired doesn't reschedule it either
+    condition_fired.time = "10:30"
+    condition_fired.save()
+    assert schedules.get(condition=condition_fired).fired
+
+    with freeze_time("2021-01-13 10:03", tz_offset=0):
+        timed_triggers()
+    with freeze_time("2021-01-13 11:03", tz_offset=0):
+        timed_triggers()
+
+    # Only the one that didn't fire yet got triggered
+    assert new_hire.to_do.count() == 2
+    assert new_hire.to_do.filter(id__in=condition_later.to_do.all()).exists()
+
+
+@pytest.mark.django_db
+def test_timed_triggers_catch_up_after_outage(
+    settings, new_hire_factory, condition_timed_factory, to_do_factory
+):
+    settings.TIMED_TRIGGERS_MAX_CATCH_UP_HOURS = 6
+    settings.TIMED_TRIGGERS_BATCH_SIZE = 2
+
+    org = Organization.object.get()
+    org.timed_triggers_last_check = datetime.datetime(
+        2021, 1, 12, 0, 0, tzinfo=datetime.timezone.utc
+    )
+    org.save()
+
+    new_hire = new_hire_factory(start_day=datetime.date(2021, 1, 12))
+    # Too long ago, outside of the catch up window
+    condition_skipped = condition_timed_factory(days=1, time="03:00")
+    condition_skipped.to_do.add(to_do_factory())
+    new_hire.conditions.add(condition_skipped)
+    for time in ["07:00", "08:00", "08:00", "11:00", "11:30"]:
+        condition = condition_timed_factory(days=1, time=time)
+        condition.to_do.add(to_do_factory())
+        new_hire.conditions.add(condition)
+
+    with freeze_time("2021-01-12 11:02", tz_offset=0):
+        timed_triggers()
+
+    # All conditions within the window got triggered, in multiple batches
+    assert new_hire.to_do.count() == 4
+    assert not new_hire.to_do.filter(id__in=condition_skipped.to_do.all()).exists()
+    # Outdated schedules are gone, triggered ones are kept as fired
+    assert list(
+        ConditionSchedule.objects.filter(fired=False).values_list("fire_at", flat=True)
+    ) == [datetime.datetime(2021, 1, 12, 11, 30, tzinfo=datetime.timezone.utc)]
+    assert ConditionSchedule.objects.filter(fired=True).count() == 4
+
+    org.refresh_from_db()
+    assert org.timed_triggers_last_check == datetime.datetime(
+        2021, 1, 12, 11, tzinfo=datetime.timezone.utc
+    )
+
+
 # MODEL TESTS
 
 
@@ -788,6 +1047,60 @@ def test_sequence_duplicate(sequence_factory, condition_to_do_factory, to_do_fac
     assert "duplicate" in Sequence.objects.last().name
 
 
+@pytest.mark.django_db
+def test_sequence_duplicate_copies_custom_items(
+    sequence_factory,
+    condition_to_do_factory,
+    condition_timed_factory,
+    to_do_factory,
+    resource_with_level_deep_chapters_factory,
+    pending_admin_task_factory,
+    django_assert_max_num_queries,
+):
+    sequence = sequence_factory()
+    condition1 = condition_to_do_factory(sequence=sequence)
+    condition2 = condition_timed_factory(sequence=sequence)
+    custom_trigger = to_do_factory(template=False)
+    condition1.condition_to_do.set([custom_trigger])
+    # Custom to do item used in both conditions
+    custom_to_do = to_do_factory(template=False)
+    template_to_do = to_do_factory()
+    condition1.to_do.add(custom_to_do, template_to_do)
+    condition2.to_do.add(custom_to_do)
+    resource = resource_with_level_deep_chapters_factory(template=False)
+    condition2.resources.add(resource)
+    condition2.admin_tasks.add(pending_admin_task_factory())
+
+    with django_assert_max_num_queries(40):
+        new_sequence = Sequence.objects.get(id=sequence.id).duplicate()
+
+    new_condition1 = new_sequence.conditions.get(condition_type=1)
+    new_condition2 = new_sequence.conditions.get(condition_type=0)
+
+    # Custom items are copied for every condition, templates are reused
+    assert template_to_do in new_condition1.to_do.all()
+    assert custom_to_do not in new_condition1.to_do.all()
+    assert new_condition1.to_do.get(template=False).name == custom_to_do.name
+    assert new_condition2.to_do.get().name == custom_to_do.name
+    assert new_condition1.to_do.get(template=False) != new_condition2.to_do.get()
+
+    new_trigger = new_condition1.condition_to_do.get()
+    assert new_trigger != custom_trigger
+    assert new_condition1.condition_to_do_fingerprint == (
+        get_condition_to_do_fingerprint([new_trigger.id])
+    )
+
+    new_resource = new_condition2.resources.get()
+    assert new_resource != resource
+    assert new_resource.chapters.count() == resource.chapters.count()
+    assert new_condition2.admin_tasks.get() != condition2.admin_tasks.get()
+
+    # The original ones are untouched
+    condition1.refresh_from_db()
+    assert condition1.sequence == sequence
+    assert set(condition1.to_do.all()) == {custom_to_do, template_to_do}
+
+
 @pytest.mark.django_db
 def test_sequence_assign_to_user(
     sequence_factory,
@@ -876,6 +1189,100 @@ def test_sequence_assign_to_user_merge_to_do_condition(
     assert new_hire.conditions.all().count() == 2
 
 
+@pytest.mark.django_db
+def test_sequence_assign_to_users_in_bulk(
+    sequence_factory,
+    new_hire_factory,
+    condition_to_do_factory,
+    condition_timed_factory,
+    to_do_factory,
+    resource_factory,
+    django_assert_max_num_queries,
+):
+    new_hires = new_hire_factory.create_batch(5)
+    sequence1 = sequence_factory()
+    sequence2 = sequence_factory()
+    # Unconditional items are directly processed for every user, leave them out
+    Condition.objects.filter(condition_type=3).delete()
+    trigger_to_do = to_do_factory()
+
+    condition1 = condition_timed_factory(sequence=sequence1, days=2)
+    condition1.to_do.add(to_do_factory())
+    condition2 = condition_to_do_factory(sequence=sequence1)
+    condition2.condition_to_do.set([trigger_to_do])
+    condition2.resources.add(resource_factory())
+    # Same trigger as the conditions in the first sequence, should be merged
+    condition3 = condition_timed_factory(sequence=sequence2, days=2)
+    condition3.to_do.add(to_do_factory())
+    condition4 = condition_to_do_factory(sequence=sequence2)
+    condition4.condition_to_do.set([trigger_to_do])
+    condition4.resources.add(resource_factory())
+    # Different amount of days, should be a new one
+    condition5 = condition_timed_factory(sequence=sequence2, days=3)
+    condition5.to_do.add(to_do_factory())
+
+    # One of them already has the first sequence
+    new_hires[0].add_sequences([sequence1])
+
+    # Fixed amount of queries, regardless of the amount of users
+    with django_assert_max_num_queries(30):
+        Sequence.objects.assign_to_users([sequence1, sequence2], new_hires)
+
+    for new_hire in new_hires:
+        assert new_hire.conditions.count() == 3
+        timed_condition = new_hire.conditions.get(condition_type=0, days=2)
+        assert timed_condition.to_do.count() == 2
+        to_do_condition = new_hire.conditions.get(condition_type=1)
+        assert list(to_do_condition.condition_to_do.all()) == [trigger_to_do]
+        assert to_do_condition.resources.count() == 2
+        assert new_hire.conditions.get(days=3).to_do.count() == 1
+        # Timed conditions got scheduled
+        assert new_hire.condition_schedules.count() == 2
+
+    # Every user has their own copy
+    assert Condition.objects.filter(sequence__isnull=True).count() == 15
+
+
+@pytest.mark.django_db
+def test_condition_to_do_fingerprint(condition_to_do_factory, to_do_factory):
+    to_do1 = to_do_factory()
+    to_do2 = to_do_factory()
+    condition1 = condition_to_do_factory()
+    condition1.condition_to_do.set([to_do1, to_do2])
+    condition2 = condition_to_do_factory()
+    condition2.condition_to_do.set([to_do2])
+
+    condition1.refresh_from_db()
+    condition2.refresh_from_db()
+    assert condition1.condition_to_do_fingerprint != ""
+    assert (
+        condition1.condition_to_do_fingerprint != condition2.condition_to_do_fingerprint
+    )
+
+    # Order doesn't matter, same items is the same fingerprint
+    condition2.condition_to_do.add(to_do1)
+    condition2.refresh_from_db()
+    assert (
+        condition1.condition_to_do_fingerprint == condition2.condition_to_do_fingerprint
+    )
+
+    # Changing it from the to do item side updates the condition as well
+    to_do1.condition_to_do.remove(condition2)
+    condition2.refresh_from_db()
+    assert condition2.condition_to_do_fingerprint == get_condition_to_do_fingerprint(
+        [to_do2.id]
+    )
+
+    to_do2.condition_to_do.clear()
+    condition2.refresh_from_db()
+    assert condition2.condition_to_do_fingerprint == ""
+
+    # Deleting the to do item removes it from the fingerprint
+    to_do1.delete()
+    condition1.refresh_from_db()
+    assert condition1.condition_to_do_fingerprint == ""
+
+
 @pytest.mark.django_db
 def test_sequence_assign_to_user_merge_time_condition(
     sequence_factory,
@@ -1140,6 +1547,132 @@ def test_execute_pending_admin_task(
     assert admin_task.new_hire == new_hire
 
 
+@pytest.mark.django_db
+def test_condition_process_condition(
+    condition_to_do_factory,
+    new_hire_factory,
+    to_do_factory,
+    resource_factory,
+    preboarding_factory,
+    badge_factory,
+    pending_admin_task_factory,
+    django_assert_max_num_queries,
+):
+    new_hire = new_hire_factory()
+    condition = condition_to_do_factory()
+    to_dos = to_do_factory.create_batch(5)
+    condition.to_do.add(*to_dos)
+    condition.resources.add(*resource_factory.create_batch(3))
+    condition.preboarding.add(preboarding_factory())
+    condition.badges.add(badge_factory())
+    # New hire already has one of the to do items
+    new_hire.to_do.add(to_dos[0])
+
+    # Amount of queries doesn't depend on the amount of items (4 are for the progress)
+    with django_assert_max_num_queries(24):
+        condition.process_condition(new_hire)
+
+    assert new_hire.to_do.count() == 5
+    assert new_hire.resources.count() == 3
+    assert new_hire.preboarding.count() == 1
+    assert new_hire.badges.count() == 1
+    assert (
+        Notification.objects.filter(
+            created_for=new_hire, notification_type="added_todo"
+        ).count()
+        == 5
+    )
+
+    # Nothing gets added when adding the items fails
+    other_new_hire = new_hire_factory()
+    with patch(
+        "admin.sequences.models.Notification.objects.bulk_create",
+        Mock(side_effect=Exception),
+    ):
+        with pytest.raises(Exception):
+            condition.process_condition(other_new_hire)
+
+    assert other_new_hire.to_do.count() == 0
+    other_new_hire.refresh_from_db()
+    assert other_new_hire.total_tasks == 0
+
+    # Admin tasks, messages and integrations run after the items have been added
+    condition.admin_tasks.add(pending_admin_task_factory())
+    with patch(
+        "admin.sequences.models.PendingAdminTask.execute", Mock(side_effect=Exception)
+    ):
+        with pytest.raises(Exception):
+            condition.process_condition(other_new_hire)
+
+    assert other_new_hire.to_do.count() == 5
+    assert Notification.objects.filter(
+        created_for=other_new_hire, notification_type="added_todo"
+    ).exists()
+
+
+@pytest.mark.django_db
+def test_sequence_simulation(
+    sequence_factory,
+    condition_timed_factory,
+    condition_to_do_factory,
+    to_do_factory,
+    django_assert_max_num_queries,
+):
+    sequence = sequence_factory()
+    # Before starting, already passed
+    condition_passed = condition_timed_factory(
+        sequence=sequence, condition_type=2, days=5, time="09:00"
+    )
+    condition_passed.to_do.add(to_do_factory())
+    condition_before = condition_timed_factory(
+        sequence=sequence, condition_type=2, days=1, time="09:00"
+    )
+    to_dos_before = to_do_factory.create_batch(2)
+    condition_before.to_do.add(*to_dos_before)
+    condition_after = condition_timed_factory(sequence=sequence, days=2, time="08:00")
+    condition_after.to_do.add(to_do_factory())
+    condition_first_day = condition_timed_factory(
+        sequence=sequence, days=1, time="10:00"
+    )
+    condition_to_do = condition_to_do_factory(sequence=sequence)
+    # Same item in another condition, only added once
+    condition_to_do.to_do.add(to_dos_before[0])
+    unconditional = sequence.conditions.get(condition_type=3)
+
+    with django_assert_max_num_queries(15):
+        simulation = SequenceSimulation.for_sequences(
+            [sequence],
+            # Friday
+            datetime.date(2022, 5, 13),
+            "Europe/Amsterdam",
+            now=datetime.datetime(2022, 5, 10, tzinfo=datetime.timezone.utc),
+        )
+        assert simulation.timeline == [
+            unconditional,
+            condition_passed,
+            condition_before,
+            condition_first_day,
+            condition_after,
+            condition_to_do,
+        ]
+        assert simulation.missed == [condition_passed]
+        assert simulation.upcoming == [
+            condition_before,
+            condition_first_day,
+            condition_after,
+            condition_to_do,
+        ]
+        # Missed items and duplicates are not counted
+        assert simulation.item_counts["to_do"] == 3
+
+    # Local time of the new hire, skipping the weekend
+    assert simulation.timeline[4].fire_at.isoformat() == "2022-05-16T08:00:00+02:00"
+    assert simulation.timeline[5].fire_at is None
+    # Nothing got created
+    assert not ConditionSchedule.objects.exists()
+    assert not Condition.objects.filter(sequence__isnull=True).exists()
+
+
 # TASKS
 
 
@@ -1227,3 +1760,68 @@ def test_send_slack_message_after_process_condition(
             },
         },
     ]
+
+
+@pytest.mark.django_db
+def test_process_condition_queries_per_item_type(
+    condition_to_do_factory,
+    new_hire_factory,
+    to_do_factory,
+    resource_factory,
+    badge_factory,
+    introduction_factory,
+    django_assert_max_num_queries,
+):
+    def get_queries(amount):
+        condition = condition_to_do_factory()
+        condition.to_do.add(*to_do_factory.create_batch(amount))
+        condition.resources.add(*resource_factory.create_batch(amount))
+        condition.badges.add(*badge_factory.create_batch(amount))
+        condition.introductions.add(*introduction_factory.create_batch(amount))
+        new_hire = new_hire_factory(slack_user_id="test")
+        # Make sure this is already cached
+        Organization.object.get_cached()
+
+        with patch("admin.sequences.tasks.Slack.send_message") as send_message:
+            with django_assert_max_num_queries(50) as captured:
+                process_condition(condition.id, new_hire.id)
+
+        # Two messages: one with the to do items and one with the rest
+        assert send_message.call_count == 2
+        assert len(send_message.call_args_list[0].kwargs["blocks"]) == 1 + amount
+        return len(captured)
+
+    # The amount of items doesn't matter
+    assert get_queries(3) == get_queries(6)
+
+
+@pytest.mark.django_db
+def test_process_condition_sends_update_email(
+    condition_to_do_factory,
+    new_hire_factory,
+    to_do_factory,
+    badge_factory,
+    mailoutbox,
+):
+    condition = condition_to_do_factory()
+    to_dos = to_do_factory.create_batch(2)
+    badge = badge_factory()
+    condition.to_do.add(*to_dos)
+    condition.badges.add(badge)
+    new_hire = new_hire_factory()
+
+    process_condition(condition.id, new_hire.id)
+
+    assert len(mailoutbox) == 1
+    assert mailoutbox[0].subject == "Here is an update!"
+    email = mailoutbox[0].alternatives[0][0]
+    assert "Todo items" in email
+    assert to_dos[0].name in email
+    assert to_dos[1].name in email
+    assert "Badge" in email
+    assert badge.name in email
+    assert "Resource" not in email
+    # Notifications won't be sent again
+    assert not Notification.objects.filter(
+        created_for=new_hire, notification_type="added_todo", notified_user=False
+    ).exists()
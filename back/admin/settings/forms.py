@@ -48,6 +48,7 @@ class OrganizationGeneralForm(forms.ModelForm):
                     Field("new_hire_email_reminders"),
                     Field("new_hire_email_overdue_reminders"),
                     Field("default_sequences"),
+                    Field("holidays"),
                     HTML("<h3 class='card-title mt-3'>" + _("Login options") + "</h3>"),
                     Field("credentials_login"),
                     css_class="col-6",
@@ -88,6 +89,7 @@ class OrganizationGeneralForm(forms.ModelForm):
             "new_hire_email_overdue_reminders",
             "credentials_login",
             "custom_email_template",
+            "holidays",
         ]
 
     def clean(self):
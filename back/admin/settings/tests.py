@@ -4,6 +4,7 @@ import pytest
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from slack_sdk.errors import SlackApiError
 
 from admin.integrations.models import Integration
 from organization.models import Notification, Organization
@@ -417,3 +418,33 @@ def test_slack_channels_update_view(client, admin_factory):
     assert "Newly added channels have been added." not in response.content.decode()
     assert SlackChannel.objects.all().count() == 3
     assert SlackChannel.objects.filter(name="general", is_private=False).exists()
+
+
+@pytest.mark.django_db
+@patch(
+    "slack_bot.utils.Slack.get_channels",
+    Mock(side_effect=SlackApiError("error", {"ok": False, "error": "invalid_auth"})),
+)
+def test_slack_channels_update_view_slack_error(client, admin_factory):
+    admin_user1 = admin_factory()
+    client.force_login(admin_user1)
+    Integration.objects.create(integration=0)
+    SlackChannel.objects.create(name="general", is_private=False)
+
+    url = reverse("settings:slack-account-update-channels")
+    response = client.get(url, follow=True)
+
+    assert "Could not get the channels from Slack" in response.content.decode()
+    assert SlackChannel.objects.filter(name="general").exists()
+
+
+@pytest.mark.django_db
+@patch("slack_bot.utils.Slack.get_channels", Mock(side_effect=KeyError("channels")))
+def test_slack_channels_update_view_other_error(client, admin_factory):
+    admin_user1 = admin_factory()
+    client.force_login(admin_user1)
+    Integration.objects.create(integration=0)
+
+    url = reverse("settings:slack-account-update-channels")
+    with pytest.raises(KeyError):
+        client.get(url)
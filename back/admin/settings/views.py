@@ -1,3 +1,5 @@
+from urllib.error import URLError
+
 import pyotp
 from django.conf import settings
 from django.contrib import messages
@@ -12,6 +14,7 @@ from django.views.generic import TemplateView
 from django.views.generic.base import RedirectView
 from django.views.generic.edit import CreateView, DeleteView, FormView, UpdateView
 from django.views.generic.list import ListView
+from slack_sdk.errors import SlackApiError
 
 from admin.integrations.models import Integration
 from organization.models import Notification, Organization, WelcomeMessage
@@ -300,7 +303,12 @@ class SlackChannelsUpdateView(LoginRequiredMixin, AdminPermMixin, RedirectView):
     pattern_name = "settings:integrations"
 
     def get(self, request, *args, **kwargs):
-        SlackChannel.objects.update_channels()
+        try:
+            SlackChannel.objects.update_channels()
+        except (SlackApiError, URLError):
+            messages.error(request, _("Could not get the channels from Slack"))
+            return super().get(request, *args, **kwargs)
+
         messages.success(
             request,
             _(
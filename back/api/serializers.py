@@ -1,3 +1,4 @@
+import pytz
 from rest_framework import serializers
 
 from admin.sequences.models import Sequence
@@ -43,3 +44,13 @@ class SequenceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Sequence
         fields = ["id", "name"]
+
+
+class SequencePreviewSerializer(serializers.Serializer):
+    sequences = serializers.PrimaryKeyRelatedField(
+        queryset=Sequence.objects.all(), many=True
+    )
+    start_day = serializers.DateField()
+    timezone = serializers.ChoiceField(
+        choices=pytz.common_timezones, required=False, allow_blank=True
+    )
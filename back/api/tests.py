@@ -213,3 +213,38 @@ def test_create_new_hire_with_buddy_and_manager(setup_rest, admin_factory):
     new_hire = User.objects.last()
     assert new_hire.buddy == admin1
     assert new_hire.manager == admin2
+
+
+@pytest.mark.django_db
+def test_sequence_preview_endpoint(
+    setup_rest, sequence_factory, condition_timed_factory, to_do_factory
+):
+    client = setup_rest
+
+    sequence = sequence_factory()
+    condition = condition_timed_factory(sequence=sequence, days=1, time="09:00")
+    condition.to_do.add(to_do_factory())
+
+    response = client.post(
+        reverse("api:sequences_preview"),
+        data={
+            "sequences": [sequence.id],
+            "start_day": "2099-01-05",
+            "timezone": "Europe/Amsterdam",
+        },
+        format="json",
+    )
+
+    assert response.status_code == 200
+    # Unconditional one first
+    assert response.json()["timeline"][0]["condition_type"] == 3
+    assert response.json()["timeline"][1] == {
+        "condition": condition.id,
+        "sequence": sequence.id,
+        "condition_type": 0,
+        "fire_at": "2099-01-05T09:00:00+01:00",
+        "missed": False,
+    }
+    assert response.json()["item_counts"]["to_do"] == 1
+    # Nothing got created
+    assert User.objects.count() == 1
@@ -7,4 +7,9 @@ urlpatterns = [
     path("newhires/", views.UserView.as_view(), name="newhires"),
     path("employees/", views.EmployeeView.as_view(), name="employees"),
     path("sequences/", views.SequenceView.as_view(), name="sequences"),
+    path(
+        "sequences/preview/",
+        views.SequencePreviewView.as_view(),
+        name="sequences_preview",
+    ),
 ]
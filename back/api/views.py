@@ -1,12 +1,19 @@
 from rest_framework import generics
+from rest_framework.response import Response
 from django_q.tasks import async_task
 
 from admin.sequences.models import Sequence
+from admin.sequences.simulation import SequenceSimulation
 from organization.models import Notification, Organization
 from slack_bot.tasks import link_slack_users
 from users.models import User
 
-from .serializers import EmployeeSerializer, SequenceSerializer, UserSerializer
+from .serializers import (
+    EmployeeSerializer,
+    SequencePreviewSerializer,
+    SequenceSerializer,
+    UserSerializer,
+)
 
 
 class UserView(generics.CreateAPIView):
@@ -63,9 +70,6 @@ class UserView(generics.CreateAPIView):
             created_for=new_hire,
         )
 
-        # Update user total todo items
-        new_hire.update_progress()
-
 
 class EmployeeView(generics.ListAPIView):
     """
@@ -83,3 +87,38 @@ class SequenceView(generics.ListAPIView):
 
     queryset = Sequence.objects.all().order_by("id")
     serializer_class = SequenceSerializer
+
+
+class SequencePreviewView(generics.GenericAPIView):
+    """
+    API endpoint that shows when the items of sequences would be triggered for a
+    new hire, without creating anything
+    """
+
+    serializer_class = SequencePreviewSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        simulation = SequenceSimulation.for_sequences(
+            serializer.validated_data["sequences"],
+            serializer.validated_data["start_day"],
+            serializer.validated_data.get("timezone")
+            or Organization.object.get().timezone,
+        )
+        return Response(
+            {
+                "timeline": [
+                    {
+                        "condition": condition.id,
+                        "sequence": condition.sequence_id,
+                        "condition_type": condition.condition_type,
+                        "fire_at": condition.fire_at,
+                        "missed": simulation.is_missed(condition),
+                    }
+                    for condition in simulation.timeline
+                ],
+                "item_counts": simulation.item_counts,
+            }
+        )
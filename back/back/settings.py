@@ -290,6 +290,43 @@ Q_CLUSTER = {
 if DEBUG and RUNNING_TESTS:
     Q_CLUSTER["sync"] = True
 
+# Timed triggers
+# After an outage, conditions that should have been triggered longer ago than this
+# will be skipped
+TIMED_TRIGGERS_MAX_CATCH_UP_HOURS = env.int(
+    "TIMED_TRIGGERS_MAX_CATCH_UP_HOURS", default=24
+)
+# Amount of conditions that get queued per transaction
+TIMED_TRIGGERS_BATCH_SIZE = env.int("TIMED_TRIGGERS_BATCH_SIZE", default=500)
+# A to do based condition is only queued once for the same user until it has been
+# processed. This is the max time it stays blocked, in case processing never finishes.
+PROCESS_CONDITION_IDEMPOTENCY_SECONDS = env.int(
+    "PROCESS_CONDITION_IDEMPOTENCY_SECONDS", default=600
+)
+
+# Amount of compiled templates (personalized texts) kept in memory per process
+TEMPLATE_CACHE_SIZE = env.int("TEMPLATE_CACHE_SIZE", default=1000)
+# Seconds that the organization settings are kept in memory per process
+ORGANIZATION_CACHE_SECONDS = env.int("ORGANIZATION_CACHE_SECONDS", default=60)
+# Seconds before the shared Slack client checks if the token has changed
+SLACK_CLIENT_CACHE_SECONDS = env.int("SLACK_CLIENT_CACHE_SECONDS", default=60)
+# Rate limits for messages sent through the Slack outbox, Slack allows about one
+# message per second in a channel. A dispatcher run sends a few messages at most and
+# then makes room for other tasks.
+SLACK_OUTBOX_MESSAGES_PER_RUN = env.int("SLACK_OUTBOX_MESSAGES_PER_RUN", default=5)
+SLACK_OUTBOX_MESSAGES_PER_SECOND_PER_CHANNEL = env.int(
+    "SLACK_OUTBOX_MESSAGES_PER_SECOND_PER_CHANNEL", default=1
+)
+SLACK_OUTBOX_BATCH_SIZE = env.int("SLACK_OUTBOX_BATCH_SIZE", default=100)
+# A dispatcher that crashed releases its lock after twice this amount of seconds
+SLACK_OUTBOX_RUN_SECONDS = env.int("SLACK_OUTBOX_RUN_SECONDS", default=50)
+# Failed messages are retried after 30, 60, 120, ... seconds
+SLACK_OUTBOX_MAX_ATTEMPTS = env.int("SLACK_OUTBOX_MAX_ATTEMPTS", default=5)
+SLACK_OUTBOX_RETRY_SECONDS = env.int("SLACK_OUTBOX_RETRY_SECONDS", default=30)
+# Hours between full refreshes of the local Slack user directory, in between it's
+# updated by the user_change and team_join events
+SLACK_DIRECTORY_SYNC_HOURS = env.int("SLACK_DIRECTORY_SYNC_HOURS", default=24)
+
 # AWS
 AWS_S3_ENDPOINT_URL = env(
     "AWS_S3_ENDPOINT_URL", default="https://s3.eu-west-1.amazonaws.com"
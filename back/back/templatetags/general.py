@@ -1,5 +1,4 @@
 import json
-from datetime import timedelta
 
 from django import template
 from django.utils import timezone
@@ -45,18 +44,6 @@ def personalize(text, user):
     return user.personalize(text)
 
 
-@register.filter(name="new_hire_trigger_date")
-def new_hire_trigger_date(condition, new_hire):
-    """
-    Shows the actual date that the conditio will trigger
-    """
-
-    if condition.condition_type == 2:
-        return new_hire.start_day - timedelta(days=condition.days)
-    else:
-        return new_hire.workday_to_datetime(condition.days)
-
-
 @register.simple_tag
 def show_start_card(conditions, idx, new_hire):
     """
@@ -72,10 +59,7 @@ def show_start_card(conditions, idx, new_hire):
     if current_date > start_day:
         return False
 
-    try:
-        prev_condition = conditions[idx - 1]
-    except Exception:
-        prev_condition = None
+    prev_condition = conditions[idx - 1] if idx > 0 else None
 
     if (prev_condition is None and current_condition.condition_type == 0) or (
         prev_condition is not None
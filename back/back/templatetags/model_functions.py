@@ -5,14 +5,12 @@ register = template.Library()
 
 
 @register.simple_tag
-def get_user_answer_by_chapter(resource_user, chapter, idx):
-    # Yes this is ugly and expensive. Yes, this needs to be rewritten
-    user_answer = resource_user.get_user_answer_by_chapter(chapter)
+def get_user_answer_by_chapter(answers_by_chapter, chapter, idx):
+    # `answers_by_chapter` holds the course answers of the resource user, loaded once
+    user_answer = answers_by_chapter.get(chapter.id)
     if user_answer is None:
         return _("N/A")
-    user_given_answer = resource_user.get_user_answer_by_chapter(chapter).answers[
-        f"item-{idx}"
-    ]
+    user_given_answer = user_answer.answers.get(f"item-{idx}")
     questions = chapter.content["blocks"]
     for question in questions:
         for option in question["items"]:
@@ -0,0 +1,35 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.template import Context, Template
+
+# Only text with one of these in it needs to go through the template engine
+TEMPLATE_TOKENS = ("{{", "{%", "{#")
+
+
+@lru_cache(maxsize=settings.TEMPLATE_CACHE_SIZE)
+def get_compiled_template(text):
+    """
+    Compile text into a template. Compiled templates don't hold any state of a
+    render, so the same one can be rendered with any context.
+    The most recently used ones are kept, so the same text (to do names, Slack
+    blocks, integration urls etc.) is only compiled once.
+
+    :param text str: the template source
+    :return Template: compiled template
+    """
+    return Template(text)
+
+
+def render_template(text, context):
+    """
+    Render text with the given context, using the cached compiled template.
+
+    :param text str: the template source
+    :param context dict: values that can be used in the text
+    :return str: rendered text
+    """
+    text = str(text)
+    if not any(token in text for token in TEMPLATE_TOKENS):
+        return text
+    return get_compiled_template(text).render(Context(context))
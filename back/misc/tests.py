@@ -1,5 +1,7 @@
 import pytest
 
+from misc.template_cache import get_compiled_template, render_template
+
 
 @pytest.mark.django_db
 def test_to_slack_block(new_hire_factory, to_do_factory):
@@ -20,3 +22,24 @@ def test_to_slack_block_questions(new_hire_factory, to_do_factory):
 
     assert to_do.to_slack_block(new_hire) == [{'type': 'input', 'block_id': 'item-0', 'element': {'type': 'radio_buttons', 'options': [{'text': {'type': 'plain_text', 'text': 'test', 'emoji': True}, 'value': 'temp-54be'}, {'text': {'type': 'plain_text', 'text': 'tesstt', 'emoji': True}, 'value': 'temp-4eb2'}, {'text': {'type': 'plain_text', 'text': 'testttttt', 'emoji': True}, 'value': 'temp-7300'}, {'text': {'type': 'plain_text', 'text': 'test2', 'emoji': True}, 'value': 'temp-215a'}], 'action_id': 'item-0'}, 'label': {'type': 'plain_text', 'text': 'TEst', 'emoji': True}}, {'type': 'input', 'block_id': 'item-1', 'element': {'type': 'radio_buttons', 'options': [{'text': {'type': 'plain_text', 'text': 'option1', 'emoji': True}, 'value': 'temp-6272'}, {'text': {'type': 'plain_text', 'text': 'option2', 'emoji': True}, 'value': 'temp-6e14'}], 'action_id': 'item-1'}, 'label': {'type': 'plain_text', 'text': 'Another question', 'emoji': True}}]  # noqa: E231, E501
     # fmt: on
+
+
+@pytest.mark.django_db
+def test_template_cache(new_hire_factory):
+    get_compiled_template.cache_clear()
+    new_hire = new_hire_factory(first_name="john")
+
+    # Text without template tags is returned as is
+    assert new_hire.personalize("Hello there") == "Hello there"
+    assert get_compiled_template.cache_info().misses == 0
+
+    # Compiled once, rendered for every call
+    assert new_hire.personalize("Hi {{ first_name }}") == "Hi john"
+    assert new_hire.personalize("Hi {{ first_name }}") == "Hi john"
+    assert new_hire.personalize("Hi {{ name }}", {"name": "jane"}) == "Hi jane"
+    assert render_template("Hi {% if a %}{{ a }}{% endif %}", {"a": "b"}) == "Hi b"
+
+    info = get_compiled_template.cache_info()
+    assert info.misses == 3
+    assert info.hits == 1
+    assert info.currsize == 3
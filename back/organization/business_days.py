@@ -0,0 +1,88 @@
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+
+class BusinessDayCalendar:
+    """
+    Workday arithmetic that skips weekends and the holidays of the organization.
+
+    Every date gets an index: the amount of business days before it, counted from
+    1 January of year 1 (a Monday). The weekends are calculated in closed form and the
+    holidays with a binary search, so nothing loops over the days in between.
+    """
+
+    def __init__(self, holidays=()):
+        # Holidays in weekends don't change anything
+        self.holidays = sorted(
+            {holiday for holiday in holidays if holiday.weekday() < 5}
+        )
+
+    @staticmethod
+    def is_weekend(day):
+        return day.weekday() in [5, 6]
+
+    def is_business_day(self, day):
+        if self.is_weekend(day):
+            return False
+        index = bisect_left(self.holidays, day)
+        return index == len(self.holidays) or self.holidays[index] != day
+
+    @staticmethod
+    def _weekdays_before(day):
+        weeks, days = divmod(day.toordinal() - 1, 7)
+        return weeks * 5 + min(days, 5)
+
+    @staticmethod
+    def _nth_weekday(index):
+        # Inverse of `_weekdays_before`: the weekday with `index` weekdays before it
+        weeks, days = divmod(index, 5)
+        return date.fromordinal(weeks * 7 + days + 1)
+
+    def business_days_before(self, day):
+        return self._weekdays_before(day) - bisect_left(self.holidays, day)
+
+    def nth_business_day(self, index):
+        """
+        The business day with exactly `index` business days before it. Every holiday
+        on or before the candidate day pushes it one weekday further, this only loops
+        when that pulls in more holidays.
+        """
+        amount_of_holidays = 0
+        while True:
+            day = self._nth_weekday(index + amount_of_holidays)
+            holidays_up_to_day = bisect_right(self.holidays, day)
+            if holidays_up_to_day == amount_of_holidays:
+                return day
+            amount_of_holidays = holidays_up_to_day
+
+    def workday(self, start_day, day):
+        """
+        Workday number of `day` for someone starting on `start_day`. The start day is
+        always workday 1 and days before it are workday 0.
+
+        :param start_day date: first day (workday 1)
+        :param day date: the day to get the workday for
+        :return int: the workday
+        """
+        if start_day > day:
+            return 0
+        next_day = timedelta(days=1)
+        return (
+            1
+            + self.business_days_before(day + next_day)
+            - self.business_days_before(start_day + next_day)
+        )
+
+    def workday_to_date(self, start_day, workday):
+        """
+        Date of a workday for someone starting on `start_day`. Inverse of `workday`.
+
+        :param start_day date: first day (workday 1)
+        :param workday int: the workday to get the date for
+        :return date: the date of that workday
+        """
+        if workday <= 1:
+            return start_day
+        return self.nth_business_day(
+            self.business_days_before(start_day + timedelta(days=1)) + workday - 2
+        )
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.14 on 2026-10-17 07:10
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("organization", "0023_alter_organization_timezone"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="organization",
+            name="holidays",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.DateField(),
+                blank=True,
+                default=list,
+                help_text=(
+                    "Days that are not counted as workdays. Separate dates with a "
+                    "comma: 2022-12-25,2022-12-26"
+                ),
+                size=None,
+                verbose_name="Holidays",
+            ),
+        ),
+    ]
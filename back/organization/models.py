@@ -1,7 +1,10 @@
+import time
 from datetime import datetime
+from functools import lru_cache
 
 import pytz
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import ArrayField
 from django.core.cache import cache
 from django.db import models
@@ -14,11 +17,52 @@ from django.utils.translation import gettext_lazy as _
 from misc.mixins import ContentMixin
 from misc.models import File
 
+from .business_days import BusinessDayCalendar
+
+
+# Organization that is shared within this process: (organization, expires at)
+_cached_organization = (None, 0)
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name):
+    """
+    Resolved tzinfo object of a timezone name, only looked up once per process.
+
+    :param name str: name of the timezone (i.e. Europe/Amsterdam)
+    :return tzinfo: the pytz timezone
+    """
+    return pytz.timezone(name)
+
+
+def clear_organization_cache():
+    global _cached_organization
+    _cached_organization = (None, 0)
+
 
 class ObjectManager(models.Manager):
     def get(self):
         return self.get_queryset().first()
 
+    def get_cached(self):
+        """
+        The organization, kept in memory for ORGANIZATION_CACHE_SECONDS. Saving the
+        organization clears it in the process that saved it, other processes pick
+        the change up when it expires.
+        Only use this to read settings. Use `get()` when it needs to be changed.
+
+        :return Organization: the organization
+        """
+        global _cached_organization
+        organization, expires_at = _cached_organization
+        if organization is None or expires_at < time.monotonic():
+            organization = self.get()
+            _cached_organization = (
+                organization,
+                time.monotonic() + settings.ORGANIZATION_CACHE_SECONDS,
+            )
+        return organization
+
 
 class Organization(models.Model):
     name = models.CharField(verbose_name=_("Name"), max_length=500)
@@ -135,10 +179,55 @@ class Organization(models.Model):
             "See documentation if you want to use your own."
         ),
     )
+    holidays = ArrayField(
+        models.DateField(),
+        verbose_name=_("Holidays"),
+        help_text=_(
+            "Days that are not counted as workdays. Separate dates with a comma: "
+            "2022-12-25,2022-12-26"
+        ),
+        default=list,
+        blank=True,
+    )
 
     object = ObjectManager()
     objects = models.Manager()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_timezone = instance.__dict__.get("timezone")
+        instance._loaded_holidays = instance.__dict__.get("holidays")
+        return instance
+
+    def save(self, *args, **kwargs):
+        from admin.sequences.models import ConditionSchedule
+
+        timezone_changed = (
+            getattr(self, "_loaded_timezone", self.timezone) != self.timezone
+        )
+        holidays_changed = sorted(
+            getattr(self, "_loaded_holidays", self.holidays)
+        ) != sorted(self.holidays)
+        super(Organization, self).save(*args, **kwargs)
+        self.__dict__.pop("business_days", None)
+        clear_organization_cache()
+
+        if holidays_changed:
+            # Workdays shift for everyone
+            ConditionSchedule.objects.rebuild()
+        elif timezone_changed:
+            # Users without their own timezone fall back on the org one
+            ConditionSchedule.objects.rebuild(
+                users=get_user_model().objects.filter(timezone="")
+            )
+        self._loaded_timezone = self.timezone
+        self._loaded_holidays = list(self.holidays)
+
+    @cached_property
+    def business_days(self):
+        return BusinessDayCalendar(self.holidays)
+
     @property
     def base_color_rgb(self):
         base_color = self.base_color.strip("#")
@@ -150,10 +239,14 @@ class Organization(models.Model):
         accent_color = self.accent_color.strip("#")
         return tuple(int(accent_color[i : i + 2], 16) for i in (0, 2, 4))  # noqa
 
+    @property
+    def tzinfo(self):
+        return get_timezone(self.timezone)
+
     @property
     def current_datetime(self):
         local_tz = pytz.timezone("UTC")
-        us_tz = pytz.timezone(self.timezone)
+        us_tz = self.tzinfo
         local = local_tz.localize(datetime.now())
         return us_tz.normalize(local.astimezone(us_tz))
 
@@ -203,6 +296,24 @@ class TemplateManager(models.Manager):
         return super().get_queryset().filter(template=True)
 
 
+class DuplicateManager(models.Manager):
+    def bulk_duplicate(self, items, change_name=False):
+        """
+        Bulk version of `duplicate()`, creates all copies with one insert. Same as
+        with `duplicate()`, the items themselves become the copies.
+
+        :param items list: items (of this model) that should be copied
+        :param change_name bool: add "(duplicate)" to the name of the copies
+        :return list: the copies, in the same order
+        """
+        for item in items:
+            item.pk = None
+            item._state.adding = True
+            if change_name:
+                item.name = _("%(name)s (duplicate)") % {"name": item.name}
+        return self.bulk_create(items)
+
+
 class BaseItem(ContentMixin, models.Model):
     name = models.CharField(verbose_name=_("Name"), max_length=240)
     tags = ArrayField(
@@ -212,7 +323,7 @@ class BaseItem(ContentMixin, models.Model):
     updated = models.DateTimeField(auto_now=True)
     template = models.BooleanField(default=True)
 
-    objects = models.Manager()
+    objects = DuplicateManager()
     templates = TemplateManager()
 
     class Meta:
@@ -1,11 +1,16 @@
+import datetime
 import json
+from datetime import timedelta
 
 import pytest
 from django.core.cache import cache
 from django.urls import reverse
+from freezegun import freeze_time
 
 from misc.models import File
+from users.models import ToDoUser, User
 
+from .business_days import BusinessDayCalendar
 from .models import Organization
 
 
@@ -173,3 +178,94 @@ def test_file_delete_as_new_hire(client, new_hire_factory, file_factory):
 
     assert File.objects.all().count() == 1
     assert response.status_code == 204
+
+
+@pytest.mark.django_db
+def test_business_day_calendar():
+    holidays = [
+        datetime.date(2022, 12, 26),
+        datetime.date(2022, 12, 27),
+        # In a weekend, doesn't matter
+        datetime.date(2022, 12, 31),
+        datetime.date(2023, 1, 2),
+    ]
+    calendar = BusinessDayCalendar(holidays)
+
+    assert not calendar.is_business_day(datetime.date(2022, 12, 24))
+    assert not calendar.is_business_day(datetime.date(2022, 12, 26))
+    assert calendar.is_business_day(datetime.date(2022, 12, 28))
+
+    # Compare with walking over every single day, for every weekday as start day
+    for start_day in [
+        datetime.date(2022, 12, 19) + timedelta(days=i) for i in range(7)
+    ]:
+        day = start_day
+        workday = 1
+        for _i in range(60):
+            assert calendar.workday(start_day, day) == workday
+            if day == start_day or calendar.is_business_day(day):
+                assert calendar.workday_to_date(start_day, workday) == day
+
+            day += timedelta(days=1)
+            if calendar.is_business_day(day):
+                workday += 1
+
+    # Days before the start day
+    assert (
+        calendar.workday(datetime.date(2022, 12, 21), datetime.date(2022, 12, 20)) == 0
+    )
+    # Friday, skipping the weekend, two holidays, the weekend and another holiday
+    assert calendar.workday_to_date(datetime.date(2022, 12, 23), 5) == datetime.date(
+        2023, 1, 3
+    )
+
+
+@pytest.mark.django_db
+def test_organization_holidays_shift_workdays(
+    new_hire_factory, to_do_user_factory, condition_timed_factory
+):
+    org = Organization.object.get()
+    # Starts on a Friday
+    new_hire = new_hire_factory(start_day=datetime.date(2022, 12, 23))
+    condition = condition_timed_factory(days=2, time="10:00")
+    new_hire.conditions.add(condition)
+    to_do_user = to_do_user_factory(user=new_hire, to_do__due_on_day=2)
+
+    assert new_hire.condition_schedules.get().fire_at.date() == datetime.date(
+        2022, 12, 26
+    )
+
+    org.holidays = [datetime.date(2022, 12, 26), datetime.date(2022, 12, 27)]
+    org.save()
+
+    # Schedules are moved to the first day after the holidays
+    assert new_hire.condition_schedules.get().fire_at.date() == datetime.date(
+        2022, 12, 28
+    )
+
+    with freeze_time("2022-12-27"):
+        new_hire = User.objects.get(id=new_hire.id)
+        assert new_hire.workday == 1
+        assert not ToDoUser.objects.due_today(new_hire).exists()
+
+    with freeze_time("2022-12-28"):
+        new_hire = User.objects.get(id=new_hire.id)
+        assert new_hire.workday == 2
+        assert ToDoUser.objects.due_today(new_hire).get() == to_do_user
+
+
+@pytest.mark.django_db
+def test_organization_cache(django_assert_num_queries, new_hire_factory):
+    org = Organization.object.get()
+    new_hire = new_hire_factory(timezone="")
+
+    Organization.object.get_cached()
+    with django_assert_num_queries(0):
+        assert Organization.object.get_cached().timezone == "UTC"
+        assert new_hire.get_local_time().tzinfo.zone == "UTC"
+
+    # Saving clears the cache
+    org.timezone = "Europe/Amsterdam"
+    org.save()
+    assert Organization.object.get_cached().timezone == "Europe/Amsterdam"
+    assert new_hire.get_local_time().tzinfo.zone == "Europe/Amsterdam"
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.14 on 2026-10-17 07:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    def add_schedule(apps, schema_editor):
+        from django_q.models import Schedule
+
+        Schedule.objects.create(
+            name="Send queued Slack messages",
+            func="slack_bot.tasks.dispatch_slack_outbox",
+            schedule_type=Schedule.CRON,
+            cron="* * * * *",
+        )
+
+    def remove_schedule(apps, schema_editor):
+        from django_q.models import Schedule
+
+        Schedule.objects.filter(func="slack_bot.tasks.dispatch_slack_outbox").delete()
+
+    dependencies = [
+        ("slack_bot", "0001_initial"),
+        ("django_q", "0014_schedule_cluster"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QueuedSlackMessage",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("channel", models.CharField(max_length=255)),
+                ("text", models.TextField(blank=True, default="")),
+                ("blocks", models.JSONField(default=list)),
+                (
+                    "send_after",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("failed", models.BooleanField(default=False)),
+                ("error", models.TextField(blank=True, default="")),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(add_schedule, remove_schedule),
+    ]
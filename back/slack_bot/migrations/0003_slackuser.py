@@ -0,0 +1,36 @@
+# Generated by Django 3.2.14 on 2026-10-17 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("slack_bot", "0002_queuedslackmessage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SlackUser",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("slack_id", models.CharField(max_length=100, unique=True)),
+                (
+                    "email",
+                    models.CharField(
+                        blank=True, db_index=True, default="", max_length=300
+                    ),
+                ),
+                ("tz", models.CharField(blank=True, default="", max_length=100)),
+                ("deleted", models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("slack_bot", "0003_slackuser"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="queuedslackmessage",
+            name="coalesce",
+            field=models.BooleanField(default=False),
+        ),
+    ]
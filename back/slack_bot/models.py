@@ -1,16 +1,65 @@
+import logging
+import time
+
 from django.db import models
+from django.utils import timezone
 
 from .utils import Slack
 
+logger = logging.getLogger(__name__)
+
 
 class SlackChannelManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset()
 
     def update_channels(self):
-        channels = Slack().get_channels()
-        for channel_name, is_private in channels:
-            self.get_or_create(name=channel_name, defaults={"is_private": is_private})
+        """
+        Sync the channels with Slack. Adds the new ones, updates the changed ones and
+        removes the ones that got archived, all with bulk queries.
+
+        :return dict: amount of added, updated, removed and total channels and the
+            seconds it took
+        """
+        start = time.monotonic()
+        channels = dict(Slack().get_channels())
+
+        existing = {}
+        for channel in self.get_queryset():
+            existing.setdefault(channel.name, []).append(channel)
+
+        new_channels = [
+            SlackChannel(name=name, is_private=is_private)
+            for name, is_private in channels.items()
+            if name not in existing
+        ]
+        changed_channels = []
+        removed_ids = []
+        for name, local_channels in existing.items():
+            for channel in local_channels:
+                if name not in channels:
+                    removed_ids.append(channel.id)
+                elif channel.is_private != channels[name]:
+                    channel.is_private = channels[name]
+                    changed_channels.append(channel)
+
+        # Never remove everything, there is at least one channel in a workspace
+        if not len(channels):
+            removed_ids = []
+
+        self.bulk_create(new_channels)
+        self.bulk_update(changed_channels, ["is_private"])
+        self.get_queryset().filter(id__in=removed_ids).delete()
+
+        stats = {
+            "added": len(new_channels),
+            "updated": len(changed_channels),
+            "removed": len(removed_ids),
+            "total": len(channels),
+            "seconds": round(time.monotonic() - start, 2),
+        }
+        logger.info("Synced Slack channels: %s", stats)
+        return stats
 
 
 class SlackChannel(models.Model):
@@ -21,3 +70,121 @@ class SlackChannel(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class QueuedSlackMessageManager(models.Manager):
+    def due(self):
+        return self.get_queryset().filter(failed=False, send_after__lte=timezone.now())
+
+
+class QueuedSlackMessage(models.Model):
+    # Outbox of messages that are sent by `slack_bot.tasks.dispatch_slack_outbox`.
+    # Items are removed once they have been sent.
+    channel = models.CharField(max_length=255)
+    text = models.TextField(default="", blank=True)
+    blocks = models.JSONField(default=list)
+    send_after = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.IntegerField(default=0)
+    failed = models.BooleanField(default=False)
+    error = models.TextField(default="", blank=True)
+    # Only plain messages can be combined with others. Messages with buttons are
+    # updated later on based on their blocks, so they have to be sent as they are.
+    coalesce = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = QueuedSlackMessageManager()
+
+
+class SlackUserManager(models.Manager):
+    def update_from_slack(self, members):
+        """
+        Add or update users in the directory.
+
+        :param members list: user objects from Slack (`users.list`, `users.info` or
+            the user of a `user_change`/`team_join` event)
+        :return int: amount of users that got added or changed
+        """
+        slack_users = {
+            member["id"]: self.model(
+                slack_id=member["id"],
+                email=(member.get("profile", {}).get("email") or "").lower(),
+                tz=member.get("tz") or "",
+                deleted=member.get("deleted", False),
+            )
+            for member in members
+        }
+        existing = self.get_queryset().in_bulk(
+            list(slack_users.keys()), field_name="slack_id"
+        )
+
+        new_users = []
+        changed_users = []
+        for slack_id, slack_user in slack_users.items():
+            current = existing.get(slack_id)
+            if current is None:
+                new_users.append(slack_user)
+            elif (current.email, current.tz, current.deleted) != (
+                slack_user.email,
+                slack_user.tz,
+                slack_user.deleted,
+            ):
+                current.email = slack_user.email
+                current.tz = slack_user.tz
+                current.deleted = slack_user.deleted
+                changed_users.append(current)
+
+        # An event might have added the same user in the meantime
+        self.bulk_create(new_users, ignore_conflicts=True)
+        self.bulk_update(changed_users, ["email", "tz", "deleted"])
+        return len(new_users) + len(changed_users)
+
+    def sync(self):
+        """
+        Refresh the whole directory, with one request per page of users.
+
+        :return int: amount of users that got added or changed
+        """
+        changed = 0
+        for members in Slack().get_user_pages():
+            changed += self.update_from_slack(members)
+        return changed
+
+    def find_id_by_email(self, email):
+        """
+        Slack user id of an email address. Asks Slack if it's not in the directory
+        (yet), i.e. when the user was just added.
+
+        :param email str: email address to look up
+        :return str: the Slack user id, or None if Slack doesn't know it either
+        """
+        slack_id = self.get_ids_by_email([email]).get(email.lower())
+        if slack_id is not None:
+            return slack_id
+
+        response = Slack().find_by_email(email=email.lower())
+        if not response:
+            return None
+        self.update_from_slack([response["user"]])
+        return response["user"]["id"]
+
+    def get_ids_by_email(self, emails):
+        """
+        :param emails list: email addresses to look up
+        :return dict: lowercased email as key and the Slack user id as value
+        """
+        return dict(
+            self.get_queryset()
+            .filter(email__in=[email.lower() for email in emails], deleted=False)
+            .values_list("email", "slack_id")
+        )
+
+
+class SlackUser(models.Model):
+    # Local copy of the users in the Slack workspace, so they can be found without
+    # asking Slack every time
+    slack_id = models.CharField(max_length=100, unique=True)
+    email = models.CharField(max_length=300, default="", blank=True, db_index=True)
+    tz = models.CharField(max_length=100, default="", blank=True)
+    deleted = models.BooleanField(default=False)
+
+    objects = SlackUserManager()
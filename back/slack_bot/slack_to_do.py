@@ -93,8 +93,20 @@ class SlackToDoManager:
         if remove_id is not None:
             ids.remove(str(remove_id))
 
-        items = ToDoUser.objects.filter(id__in=ids).order_by("id")
-        tasks = [SlackToDo(task, self.user).get_block() for task in items]
+        items = (
+            ToDoUser.objects.filter(id__in=ids).select_related("to_do").order_by("id")
+        )
+        return self.format_blocks(items, text=text)
+
+    def format_blocks(self, to_do_users, text=""):
+        """
+        Same as `get_blocks`, for to do items that are already loaded.
+
+        :param to_do_users list: `ToDoUser` items with their to do
+        :param text str: text above the items
+        :return list: the blocks
+        """
+        tasks = [SlackToDo(task, self.user).get_block() for task in to_do_users]
 
         if text == "" or len(tasks) == 0:
             text = (
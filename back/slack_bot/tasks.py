@@ -1,19 +1,37 @@
+import json
+from datetime import timedelta
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.utils import translation
+from django.core.cache import cache
+from django.db.models import Prefetch, Q
+from django.utils import timezone, translation
 from django.utils.formats import localize
 from django.utils.translation import gettext as _
+from django_q.tasks import async_task
+from slack_sdk.errors import SlackApiError
 
 from admin.integrations.models import Integration
-from organization.models import Organization, WelcomeMessage
+from organization.models import Notification, Organization, WelcomeMessage
+from slack_bot.models import QueuedSlackMessage, SlackUser
 from slack_bot.slack_intro import SlackIntro
 from slack_bot.slack_misc import get_new_hire_first_message_buttons
 from slack_bot.slack_resource import SlackResource
 from slack_bot.slack_to_do import SlackToDoManager
-from slack_bot.utils import Slack, actions, button, paragraph
+from slack_bot.utils import (
+    SLACK_OUTBOX_RUNNING_KEY,
+    SLACK_OUTBOX_STARTED_KEY,
+    Slack,
+    actions,
+    button,
+    paragraph,
+)
 from users.models import ResourceUser, ToDoUser
 
 
+SLACK_DIRECTORY_SYNCED_KEY = "slack_directory_synced"
+
+
 def link_slack_users(users=[]):
     # Drop if Slack is not enabled
     if (
@@ -22,17 +40,41 @@ def link_slack_users(users=[]):
     ):
         return
 
-    slack = Slack()
     org = Organization.object.get()
 
-    if len(users) == 0:
+    scheduled_run = len(users) == 0
+    if scheduled_run:
         users = get_user_model().new_hires.without_slack()
 
+    # Load the managers and buddies of all users at once for personalizing texts
+    users = get_user_model().objects.load_personalization_contexts(users)
+    if not len(users):
+        return
+
+    # The directory is kept up-to-date by Slack events, a full refresh is only
+    # needed once in a while
+    synced = False
+    if scheduled_run and cache.add(
+        SLACK_DIRECTORY_SYNCED_KEY, True, settings.SLACK_DIRECTORY_SYNC_HOURS * 3600
+    ):
+        try:
+            SlackUser.objects.sync()
+        except Exception:
+            cache.delete(SLACK_DIRECTORY_SYNCED_KEY)
+            raise
+        synced = True
+
+    slack_ids = SlackUser.objects.get_ids_by_email([user.email for user in users])
     for user in users:
-        response = slack.find_by_email(email=user.email.lower())
-        if response:
+        slack_id = slack_ids.get(user.email.lower())
+        if slack_id is None and not synced:
+            # Might not be in the directory yet (i.e. just added or the email got
+            # changed), ask Slack instead of waiting for the next full refresh
+            slack_id = SlackUser.objects.find_id_by_email(user.email)
+
+        if slack_id is not None:
             translation.activate(user.language)
-            user.slack_user_id = response["user"]["id"]
+            user.slack_user_id = slack_id
             user.save()
 
             # Personalized message for user (slack welcome message)
@@ -86,44 +128,69 @@ def update_new_hire():
     ):
         return
 
-    for user in get_user_model().new_hires.with_slack():
-        local_datetime = user.get_local_time()
-
-        if not (
-            local_datetime.hour == 8
-            and local_datetime.weekday() < 5
-            and local_datetime.date() >= user.start_day
-        ):
-            continue
-
+    # Only the new hires for whom it's 8 am now, with their open to do items and
+    # courses. There is no need to query anything else per new hire.
+    new_hires = get_user_model().objects.load_personalization_contexts(
+        get_user_model()
+        .new_hires.at_local_hour(8)
+        .exclude(slack_user_id="")
+        .prefetch_related(
+            Prefetch(
+                "to_do_new_hire",
+                queryset=ToDoUser.objects.filter(completed=False)
+                .select_related("to_do")
+                .order_by("id"),
+                to_attr="open_to_do_users",
+            ),
+            Prefetch(
+                "new_hire_resource",
+                queryset=ResourceUser.objects.filter(
+                    resource__course=True, completed_course=False
+                )
+                .select_related("resource")
+                .order_by("id"),
+                to_attr="open_courses",
+            ),
+        )
+    )
+    for user in new_hires:
         translation.activate(user.language)
 
-        overdue_items = ToDoUser.objects.overdue(user)
-        tasks = ToDoUser.objects.due_today(user) | overdue_items
-
-        courses_due = ResourceUser.objects.filter(
-            user=user, resource__on_day__lte=user.workday
-        )
-        # Filter out completed courses
+        courses_due = [
+            course
+            for course in user.open_courses
+            if course.resource.on_day <= user.workday
+        ]
         course_blocks = [
-            SlackResource(course, user).get_block()
-            for course in courses_due
-            if course.is_course
+            SlackResource(course, user).get_block() for course in courses_due
         ]
 
         if len(course_blocks):
             course_blocks.insert(
                 0, paragraph(_("Here are some courses that you need to complete"))
             )
-            Slack().send_message(
+            Slack().queue_message(
                 blocks=course_blocks,
                 text=_("Here are some courses that you need to complete"),
                 channel=user.slack_user_id,
             )
 
+        # Same as `ToDoUser.objects.overdue()` and `due_today()`
+        overdue_items = [
+            to_do_user
+            for to_do_user in user.open_to_do_users
+            if 0 < to_do_user.to_do.due_on_day < user.workday
+        ]
+        tasks = [
+            to_do_user
+            for to_do_user in user.open_to_do_users
+            if 0 < to_do_user.to_do.due_on_day < user.workday
+            or to_do_user.to_do.due_on_day == user.workday
+        ]
+
         # If any overdue tasks exist, then notify the user
-        if tasks.exists():
-            if overdue_items.exists():
+        if len(tasks):
+            if len(overdue_items):
                 text = _(
                     "Good morning! These are the tasks you need to complete. Some to "
                     "do items are overdue. Please complete those as soon as possible!"
@@ -133,11 +200,8 @@ def update_new_hire():
                     "Good morning! These are the tasks you need to complete today:"
                 )
 
-            blocks = SlackToDoManager(user).get_blocks(
-                tasks.values_list("id", flat=True),
-                text=text,
-            )
-            Slack().send_message(blocks=blocks, text=text, channel=user.slack_user_id)
+            blocks = SlackToDoManager(user).format_blocks(tasks, text=text)
+            Slack().queue_message(blocks=blocks, text=text, channel=user.slack_user_id)
 
 
 def first_day_reminder():
@@ -170,7 +234,7 @@ def first_day_reminder():
             if org.slack_default_channel is not None
             else "general"
         )
-        Slack().send_message(text=text, channel="#" + send_to)
+        Slack().queue_message(text=text, channel="#" + send_to, coalesce=True)
 
 
 def introduce_new_people():
@@ -204,7 +268,7 @@ def introduce_new_people():
 
     blocks.append(paragraph(text))
 
-    for new_hire in new_hires:
+    for new_hire in get_user_model().objects.load_personalization_contexts(new_hires):
         message = f"*{new_hire.full_name}*"
 
         # Add new hire introduction message
@@ -258,7 +322,167 @@ def introduce_new_people():
         if org.slack_default_channel is not None
         else "general"
     )
-    Slack().send_message(channel="#" + send_to, text=text, blocks=blocks)
+    Slack().queue_message(channel="#" + send_to, text=text, blocks=blocks)
 
     # Make sure they aren't introduced again
     new_hires.update(is_introduced_to_colleagues=True)
+
+
+def coalesce_slack_messages(messages):
+    """
+    Combine messages to the same channel, so they can be sent as one. Only messages
+    that were queued with `coalesce` are combined, others are sent on their own. The
+    order of the messages within a channel is kept.
+
+    :param messages list: `QueuedSlackMessage` items, in the order they were queued
+    :return list: (channel, [QueuedSlackMessage]) tuples
+    """
+    groups = []
+    last_group_by_channel = {}
+    for message in messages:
+        group = last_group_by_channel.get(message.channel)
+        block_count = len(message.blocks) or 1
+        # Slack allows 50 blocks per message at most
+        if not message.coalesce or group is None or group[2] + block_count > 50:
+            group = [message.channel, [], 0]
+            groups.append(group)
+            # Nothing can be added to a message that can't be combined
+            last_group_by_channel[message.channel] = group if message.coalesce else None
+        group[1].append(message)
+        group[2] += block_count
+    return [(channel, group_messages) for channel, group_messages, _count in groups]
+
+
+def send_queued_slack_messages(slack, channel, messages):
+    """
+    Send (coalesced) messages from the outbox as one message.
+
+    :param slack Slack: the client
+    :param channel str: channel (or user id) to send them to
+    :param messages list: `QueuedSlackMessage` items for this channel
+    :return int: seconds to wait when Slack rate limited us, otherwise None
+    """
+    if len(messages) == 1:
+        text, blocks = messages[0].text, messages[0].blocks
+    else:
+        # Messages without blocks only show their text, keep that visible
+        blocks = []
+        for message in messages:
+            blocks += message.blocks or [paragraph(message.text)]
+        text = "\n".join(dict.fromkeys(m.text for m in messages if m.text))
+
+    created_for = (
+        get_user_model()
+        .objects.filter(Q(slack_user_id=channel) | Q(slack_channel_id=channel))
+        .first()
+    )
+    try:
+        slack.post_message(channel, text=text, blocks=blocks)
+    except SlackApiError as e:
+        if e.response.status_code == 429:
+            return int(e.response.headers.get("Retry-After", 1))
+        error = e
+    except Exception as e:
+        error = e
+    else:
+        if created_for is not None:
+            Notification.objects.bulk_create(
+                [
+                    Notification(
+                        notification_type="sent_slack_message",
+                        extra_text=message.text,
+                        created_for=created_for,
+                        description=json.dumps(message.blocks),
+                    )
+                    for message in messages
+                ]
+            )
+        QueuedSlackMessage.objects.filter(id__in=[m.id for m in messages]).delete()
+        return None
+
+    for message in messages:
+        message.attempts += 1
+        message.error = str(error)
+        if message.attempts >= settings.SLACK_OUTBOX_MAX_ATTEMPTS:
+            message.failed = True
+            if created_for is not None:
+                Notification.objects.create(
+                    notification_type="failed_send_slack_message",
+                    extra_text=message.text,
+                    created_for=created_for,
+                    description=str(error),
+                )
+        else:
+            # Back off exponentially
+            message.send_after = timezone.now() + timedelta(
+                seconds=settings.SLACK_OUTBOX_RETRY_SECONDS
+                * 2 ** (message.attempts - 1)
+            )
+    QueuedSlackMessage.objects.bulk_update(
+        messages, ["attempts", "error", "failed", "send_after"]
+    )
+    return None
+
+
+def start_slack_outbox():
+    """
+    Queue a dispatcher for the outbox, unless one has been queued already.
+    """
+    if cache.add(SLACK_OUTBOX_STARTED_KEY, True, settings.SLACK_OUTBOX_RUN_SECONDS):
+        async_task(dispatch_slack_outbox, task_name="Send queued Slack messages")
+
+
+def dispatch_slack_outbox():
+    """
+    Send the messages in the outbox (`Slack().queue_message()`). Runs every minute
+    and whenever a message gets queued. Only one dispatcher runs at a time and it
+    never waits, so it doesn't hold up the other tasks: a run sends at most
+    SLACK_OUTBOX_MESSAGES_PER_RUN messages and queues another run if more are due.
+    Messages that have to wait (rate limits and retries) are postponed and sent by a
+    later run.
+    """
+    # Allow a new dispatcher to be started for messages queued from now on
+    cache.delete(SLACK_OUTBOX_STARTED_KEY)
+    if not cache.add(
+        SLACK_OUTBOX_RUNNING_KEY, True, settings.SLACK_OUTBOX_RUN_SECONDS * 2
+    ):
+        return
+
+    try:
+        _dispatch_slack_outbox()
+    finally:
+        cache.delete(SLACK_OUTBOX_RUNNING_KEY)
+
+    # Continue in a new task, so other tasks can go in between
+    if QueuedSlackMessage.objects.due().exists():
+        start_slack_outbox()
+
+
+def _dispatch_slack_outbox():
+    slack = Slack()
+    messages = QueuedSlackMessage.objects.due().order_by("id")[
+        : settings.SLACK_OUTBOX_BATCH_SIZE
+    ]
+    channel_wait = timedelta(
+        seconds=1 / settings.SLACK_OUTBOX_MESSAGES_PER_SECOND_PER_CHANNEL
+    )
+    sent_to_channels = set()
+    for channel, channel_messages in coalesce_slack_messages(messages):
+        if channel in sent_to_channels:
+            # Already got a message in this run, send the rest in a later run
+            QueuedSlackMessage.objects.filter(
+                id__in=[m.id for m in channel_messages]
+            ).update(send_after=timezone.now() + channel_wait)
+            continue
+        if len(sent_to_channels) >= settings.SLACK_OUTBOX_MESSAGES_PER_RUN:
+            return
+        sent_to_channels.add(channel)
+
+        retry_after = send_queued_slack_messages(slack, channel, channel_messages)
+        if retry_after is not None:
+            # Rate limited, nothing can be sent until then
+            resume_at = timezone.now() + timedelta(seconds=retry_after)
+            QueuedSlackMessage.objects.filter(
+                failed=False, send_after__lt=resume_at
+            ).update(send_after=resume_at)
+            return
@@ -5,11 +5,15 @@ from unittest.mock import Mock, patch
 import pytest
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.utils import timezone
 from django.utils.formats import localize
 from freezegun import freeze_time
+from slack_sdk.errors import SlackApiError
 
 from organization.models import Organization, WelcomeMessage
+from slack_bot.models import QueuedSlackMessage, SlackChannel, SlackUser
 from slack_bot.tasks import (
+    dispatch_slack_outbox,
     first_day_reminder,
     introduce_new_people,
     link_slack_users,
@@ -34,6 +38,13 @@ from slack_bot.views import (
     slack_show_to_do_items,
     slack_show_to_do_items_based_on_message,
     slack_show_welcome_dialog,
+    slack_update_slack_user,
+)
+from slack_bot.utils import (
+    SLACK_OUTBOX_RUNNING_KEY,
+    Slack,
+    clear_slack_client,
+    paragraph,
 )
 from users.factories import ResourceUserFactory
 
@@ -1802,11 +1813,9 @@ def test_complete_admin_task(admin_factory, admin_task_factory):
 
 # TEST TASKS
 @pytest.mark.django_db
-@patch(
-    "slack_bot.utils.Slack.find_by_email", Mock(return_value={"user": {"id": "slackx"}})
-)
 def test_link_slack_users_slack_not_enabled(new_hire_factory, integration_factory):
     new_hire = new_hire_factory()
+    SlackUser.objects.create(slack_id="slackx", email=new_hire.email)
 
     # Gets blocked imidiately for not having Slack enabled
     link_slack_users()
@@ -1824,7 +1833,6 @@ def test_link_slack_users_slack_not_enabled(new_hire_factory, integration_factor
 
 
 @pytest.mark.django_db
-@patch("slack_bot.utils.Slack.find_by_email", Mock(return_value=False))
 def test_link_slack_users_not_found(new_hire_factory, integration_factory):
     # Enable Slack
     integration_factory(integration=0)
@@ -1838,9 +1846,6 @@ def test_link_slack_users_not_found(new_hire_factory, integration_factory):
 
 
 @pytest.mark.django_db
-@patch(
-    "slack_bot.utils.Slack.find_by_email", Mock(return_value={"user": {"id": "slackx"}})
-)
 def test_link_slack_users_send_welcome_message_without_to_dos(
     new_hire_factory, integration_factory, introduction_factory
 ):
@@ -1848,6 +1853,7 @@ def test_link_slack_users_send_welcome_message_without_to_dos(
     integration_factory(integration=0)
 
     new_hire = new_hire_factory()
+    SlackUser.objects.create(slack_id="slackx", email=new_hire.email)
     # Test personalizing message
     wm = WelcomeMessage.objects.get(language=new_hire.language, message_type=3)
     wm.message += " {{first_name}}"
@@ -1904,9 +1910,6 @@ def test_link_slack_users_send_welcome_message_without_to_dos(
 
 
 @pytest.mark.django_db
-@patch(
-    "slack_bot.utils.Slack.find_by_email", Mock(return_value={"user": {"id": "slackx"}})
-)
 def test_link_slack_users_send_welcome_message_with_to_dos(
     new_hire_factory, integration_factory, introduction_factory, to_do_user_factory
 ):
@@ -1914,6 +1917,7 @@ def test_link_slack_users_send_welcome_message_with_to_dos(
     integration_factory(integration=0)
 
     new_hire = new_hire_factory()
+    SlackUser.objects.create(slack_id="slackx", email=new_hire.email)
     # Test personalizing message
     wm = WelcomeMessage.objects.get(language=new_hire.language, message_type=3)
     wm.message += " {{first_name}}"
@@ -1956,9 +1960,6 @@ def test_link_slack_users_send_welcome_message_with_to_dos(
 
 
 @pytest.mark.django_db
-@patch(
-    "slack_bot.utils.Slack.find_by_email", Mock(return_value={"user": {"id": "slackx"}})
-)
 def test_link_slack_users_only_send_once(new_hire_factory, integration_factory):
     # Enable Slack
     integration_factory(integration=0)
@@ -2345,3 +2346,411 @@ def test_introduce_new_hire(new_hire_factory, integration_factory):
             ],
         },
     ]
+
+
+@pytest.mark.django_db
+def test_shared_slack_client(settings, integration_factory, django_assert_num_queries):
+    settings.FAKE_SLACK_API = False
+    clear_slack_client()
+    integration = integration_factory(integration=0, token="xoxb-first")
+
+    client = Slack().client
+    assert client.token == "xoxb-first"
+
+    # Reused, without checking the token again
+    with django_assert_num_queries(0):
+        assert Slack().client is client
+
+    # Saving the integration picks up the new token
+    integration.token = "xoxb-second"
+    integration.save()
+    assert Slack().client is not client
+    assert Slack().client.token == "xoxb-second"
+
+    # Socket mode uses the bot token, without opening a connection to send messages
+    settings.SLACK_USE_SOCKET = True
+    settings.SLACK_BOT_TOKEN = "xoxb-bot"
+    clear_slack_client()
+    with patch("slack_bolt.adapter.socket_mode.SocketModeHandler.connect") as connect:
+        assert Slack().client.token == "xoxb-bot"
+    connect.assert_not_called()
+
+    clear_slack_client()
+
+
+def send_all_queued_slack_messages():
+    # Messages that are postponed for the rate limits are sent by later runs, don't
+    # wait for those
+    for _run in range(10):
+        if not QueuedSlackMessage.objects.filter(failed=False).exists():
+            return
+        QueuedSlackMessage.objects.update(send_after=timezone.now())
+        dispatch_slack_outbox()
+
+
+@pytest.mark.django_db
+def test_slack_outbox_coalesces_messages(new_hire_factory):
+    new_hire = new_hire_factory(slack_user_id="slackx")
+    # Pretend a dispatcher is running, so it doesn't send them straight away
+    cache.set(SLACK_OUTBOX_RUNNING_KEY, True)
+
+    Slack().queue_message(
+        text="first", channel="slackx", blocks=[paragraph("1")], coalesce=True
+    )
+    Slack().queue_message(text="other", channel="slacky", coalesce=True)
+    Slack().queue_message(text="second", channel="slackx", coalesce=True)
+    # Messages with buttons are always sent on their own
+    Slack().queue_message(text="buttons", channel="slackx", blocks=[paragraph("2")])
+    Slack().queue_message(text="third", channel="slackx", coalesce=True)
+    assert QueuedSlackMessage.objects.count() == 5
+
+    cache.delete(SLACK_OUTBOX_RUNNING_KEY)
+    with patch("slack_bot.utils.Slack.post_message") as post_message:
+        dispatch_slack_outbox()
+        # One message per channel per run
+        assert post_message.call_count == 2
+        send_all_queued_slack_messages()
+
+    assert post_message.call_count == 4
+    assert [call.args[0] for call in post_message.call_args_list] == [
+        "slackx",
+        "slacky",
+        "slackx",
+        "slackx",
+    ]
+    post_message.assert_any_call(
+        "slackx", text="first\nsecond", blocks=[paragraph("1"), paragraph("second")]
+    )
+    post_message.assert_any_call("slacky", text="other", blocks=[])
+    post_message.assert_any_call("slackx", text="buttons", blocks=[paragraph("2")])
+    post_message.assert_any_call("slackx", text="third", blocks=[])
+    assert not QueuedSlackMessage.objects.exists()
+    assert (
+        new_hire.notification_receivers.filter(
+            notification_type="sent_slack_message"
+        ).count()
+        == 4
+    )
+
+
+@pytest.mark.django_db
+def test_slack_outbox_complete_to_do_from_reminder(
+    new_hire_factory,
+    integration_factory,
+    to_do_user_factory,
+    resource_user_factory,
+):
+    integration_factory(integration=0)
+    with freeze_time("2022-05-13 08:00:00"):
+        new_hire = new_hire_factory(
+            start_day=datetime.now().date() - timedelta(days=2),
+            slack_user_id="slackx",
+            slack_channel_id="slackx",
+        )
+        # Must be completed on the website
+        to_do_user1 = to_do_user_factory(
+            user=new_hire,
+            to_do__due_on_day=3,
+            to_do__content={
+                "time": 0,
+                "blocks": [
+                    {
+                        "data": {"text": "Please upload this!", "type": "upload"},
+                        "type": "form",
+                    }
+                ],
+            },
+        )
+        to_do_user2 = to_do_user_factory(user=new_hire, to_do__due_on_day=3)
+        resource_user_factory(user=new_hire, resource__course=True, resource__on_day=1)
+
+        cache.set(SLACK_OUTBOX_RUNNING_KEY, True)
+        update_new_hire()
+        cache.delete(SLACK_OUTBOX_RUNNING_KEY)
+
+    with patch("slack_bot.utils.Slack.post_message") as post_message:
+        send_all_queued_slack_messages()
+
+    # The courses and the to do items are sent separately
+    assert post_message.call_count == 2
+    to_do_message = post_message.call_args_list[1].kwargs
+    assert [block.get("block_id") for block in to_do_message["blocks"]][1:] == [
+        str(to_do_user1.id),
+        str(to_do_user2.id),
+    ]
+
+    to_do_user1.form = {"test": "test"}
+    to_do_user1.save()
+
+    # Slack adds a block id to blocks that don't have one
+    slack_open_todo_dialog(
+        {"action_id": f"dialog:to_do:{to_do_user1.id}"},
+        {
+            "user": {"id": "slackx"},
+            "trigger_id": 0,
+            "container": {"message_ts": 1},
+            "message": {
+                "text": to_do_message["text"],
+                "blocks": [
+                    {"block_id": "Ab1", **block} for block in to_do_message["blocks"]
+                ],
+            },
+        },
+    )
+
+    to_do_user1.refresh_from_db()
+    assert to_do_user1.completed
+    # Only the other to do item is left
+    blocks = cache.get("slack_blocks")
+    assert [block.get("block_id") for block in blocks][1:] == [str(to_do_user2.id)]
+    assert blocks[0] == paragraph(to_do_message["text"])
+
+
+@pytest.mark.django_db
+def test_slack_outbox_retries(settings, new_hire_factory):
+    settings.SLACK_OUTBOX_MAX_ATTEMPTS = 2
+    new_hire = new_hire_factory(slack_user_id="slackx")
+    cache.set(SLACK_OUTBOX_RUNNING_KEY, True)
+    Slack().queue_message(text="hi", channel="slackx")
+    cache.delete(SLACK_OUTBOX_RUNNING_KEY)
+
+    # Rate limited: postponed without counting as an attempt
+    rate_limited = SlackApiError(
+        "ratelimited", Mock(status_code=429, headers={"Retry-After": "30"})
+    )
+    with patch("slack_bot.utils.Slack.post_message", Mock(side_effect=rate_limited)):
+        dispatch_slack_outbox()
+    message = QueuedSlackMessage.objects.get()
+    assert message.attempts == 0
+    assert message.send_after > timezone.now() + timedelta(seconds=25)
+
+    # Fails, tried again later
+    QueuedSlackMessage.objects.update(send_after=timezone.now())
+    with patch(
+        "slack_bot.utils.Slack.post_message", Mock(side_effect=Exception("down"))
+    ):
+        dispatch_slack_outbox()
+    message.refresh_from_db()
+    assert message.attempts == 1
+    assert not message.failed
+    assert message.send_after > timezone.now()
+
+    # Gives up after the max amount of attempts
+    QueuedSlackMessage.objects.update(send_after=timezone.now())
+    with patch(
+        "slack_bot.utils.Slack.post_message", Mock(side_effect=Exception("down"))
+    ):
+        dispatch_slack_outbox()
+    message.refresh_from_db()
+    assert message.failed
+    assert new_hire.notification_receivers.filter(
+        notification_type="failed_send_slack_message"
+    ).exists()
+
+
+@pytest.mark.django_db
+def test_slack_outbox_does_not_wait(settings, new_hire_factory):
+    settings.SLACK_OUTBOX_MESSAGES_PER_RUN = 2
+    new_hire_factory(slack_user_id="slackx")
+    cache.set(SLACK_OUTBOX_RUNNING_KEY, True)
+    for channel in ["slackx", "slackx", "slacky", "slackz", "slacka"]:
+        Slack().queue_message(text=channel, channel=channel)
+    Slack().queue_message(text="later", channel="slackb")
+    cache.delete(SLACK_OUTBOX_RUNNING_KEY)
+    QueuedSlackMessage.objects.filter(channel="slackb").update(
+        send_after=timezone.now() + timedelta(seconds=30)
+    )
+
+    with patch("slack_bot.utils.Slack.post_message") as post_message:
+        with patch("slack_bot.tasks.async_task") as async_task:
+            with patch("time.sleep") as sleep:
+                dispatch_slack_outbox()
+
+    # Sends as many as allowed in one run and leaves the rest for the next one
+    assert [call.args[0] for call in post_message.call_args_list] == [
+        "slackx",
+        "slacky",
+    ]
+    assert not sleep.called
+    async_task.assert_called_once()
+    # The other message to the same channel has to wait for the rate limit
+    assert QueuedSlackMessage.objects.get(channel="slackx").send_after > (
+        timezone.now()
+    )
+    assert QueuedSlackMessage.objects.due().count() == 2
+
+    # Nothing else is started when only postponed messages are left
+    QueuedSlackMessage.objects.filter(channel__in=["slackz", "slacka"]).delete()
+    with patch("slack_bot.utils.Slack.post_message") as post_message:
+        with patch("slack_bot.tasks.async_task") as async_task:
+            dispatch_slack_outbox()
+    assert not post_message.called
+    assert not async_task.called
+
+
+@pytest.mark.django_db
+@freeze_time("2022-05-13 08:00:00")
+def test_update_new_hire_only_queries_due_new_hires(
+    new_hire_factory,
+    integration_factory,
+    to_do_user_factory,
+    resource_user_factory,
+    django_assert_num_queries,
+):
+    integration_factory(integration=0)
+    new_hire = new_hire_factory(
+        start_day=datetime.now().date() - timedelta(days=2), slack_user_id="slackx"
+    )
+    to_do_user_factory(user=new_hire, to_do__due_on_day=3)
+    resource_user_factory(user=new_hire, resource__course=True, resource__on_day=1)
+    # It's 10 am for them, so they are never loaded
+    for i in range(3):
+        to_do_user_factory(
+            user__timezone="Europe/Amsterdam",
+            user__slack_user_id=f"slack{i}",
+            to_do__due_on_day=3,
+        )
+
+    # The Slack integration, organization, new hires, to do items and courses
+    with patch("slack_bot.utils.Slack.queue_message") as queue_message:
+        with django_assert_num_queries(5):
+            update_new_hire()
+
+    # The courses and the to do items
+    assert queue_message.call_count == 2
+    assert all(
+        call.kwargs["channel"] == "slackx" for call in queue_message.call_args_list
+    )
+
+
+@pytest.mark.django_db
+def test_slack_user_directory(settings):
+    settings.FAKE_SLACK_API = False
+    client = Mock()
+    client.users_list.side_effect = [
+        {
+            "members": [
+                {"id": "U1", "profile": {"email": "John@example.com"}, "tz": "UTC"},
+                {"id": "USLACKBOT", "profile": {}, "deleted": False},
+            ],
+            "response_metadata": {"next_cursor": "next"},
+        },
+        {
+            "members": [{"id": "U2", "profile": {"email": "jane@example.com"}}],
+            "response_metadata": {"next_cursor": ""},
+        },
+    ]
+
+    # One request per page
+    with patch("slack_bot.utils.get_slack_client", Mock(return_value=client)):
+        assert SlackUser.objects.sync() == 3
+    assert client.users_list.call_count == 2
+    assert client.users_list.call_args.kwargs["cursor"] == "next"
+
+    assert SlackUser.objects.get_ids_by_email(
+        ["john@example.com", "JANE@example.com", "unknown@example.com"]
+    ) == {"john@example.com": "U1", "jane@example.com": "U2"}
+
+    # Kept up-to-date through events
+    slack_update_slack_user(
+        {"user": {"id": "U1", "profile": {"email": "john@example.com"}, "tz": "UTC"}}
+    )
+    slack_update_slack_user(
+        {
+            "user": {
+                "id": "U2",
+                "deleted": True,
+                "profile": {"email": "jane@example.com"},
+            }
+        }
+    )
+    assert SlackUser.objects.count() == 3
+    assert SlackUser.objects.get_ids_by_email(["jane@example.com"]) == {}
+
+
+@pytest.mark.django_db
+def test_link_slack_users_syncs_directory_once(new_hire_factory, integration_factory):
+    integration_factory(integration=0)
+    new_hire1 = new_hire_factory()
+
+    get_user_pages = Mock(
+        return_value=[[{"id": "slackx", "profile": {"email": new_hire1.email}}]]
+    )
+    with patch("slack_bot.utils.Slack.get_user_pages", get_user_pages):
+        link_slack_users()
+
+        new_hire1.refresh_from_db()
+        assert new_hire1.slack_user_id == "slackx"
+
+        # Next runs use the directory and only ask Slack for unknown emails
+        new_hire2 = new_hire_factory()
+        SlackUser.objects.create(slack_id="slacky", email=new_hire2.email)
+        new_hire3 = new_hire_factory()
+        find_by_email = Mock(return_value={"user": {"id": "slackz"}})
+        with patch("slack_bot.utils.Slack.find_by_email", find_by_email):
+            link_slack_users()
+
+    new_hire2.refresh_from_db()
+    assert new_hire2.slack_user_id == "slacky"
+    new_hire3.refresh_from_db()
+    assert new_hire3.slack_user_id == "slackz"
+    find_by_email.assert_called_once_with(email=new_hire3.email.lower())
+    get_user_pages.assert_called_once()
+
+
+@pytest.mark.django_db
+@patch(
+    "slack_bot.utils.Slack.find_by_email", Mock(return_value={"user": {"id": "slackx"}})
+)
+def test_link_slack_users_new_hire_not_in_directory(
+    new_hire_factory, integration_factory
+):
+    integration_factory(integration=0)
+    new_hire = new_hire_factory()
+
+    # Asks Slack directly when linking a new hire that was just created
+    link_slack_users([new_hire])
+
+    new_hire.refresh_from_db()
+    assert new_hire.slack_user_id == "slackx"
+    assert SlackUser.objects.filter(slack_id="slackx").exists()
+
+
+@pytest.mark.django_db
+def test_update_slack_channels(settings, django_assert_max_num_queries):
+    SlackChannel.objects.all().delete()
+    SlackChannel.objects.create(name="general", is_private=False)
+    SlackChannel.objects.create(name="secret", is_private=False)
+    SlackChannel.objects.create(name="archived", is_private=False)
+
+    settings.FAKE_SLACK_API = False
+    client = Mock()
+    client.conversations_list.side_effect = [
+        {
+            "channels": [
+                {"name": "general", "is_private": False},
+                {"name": "secret", "is_private": True},
+            ],
+            "response_metadata": {"next_cursor": "next"},
+        },
+        {
+            "channels": [{"name": "new", "is_private": False}],
+            "response_metadata": {"next_cursor": ""},
+        },
+    ]
+
+    # Loading, adding, updating and removing (including unsetting references)
+    with patch("slack_bot.utils.get_slack_client", Mock(return_value=client)):
+        with django_assert_max_num_queries(8):
+            stats = SlackChannel.objects.update_channels()
+
+    assert client.conversations_list.call_count == 2
+    assert stats["added"] == 1
+    assert stats["updated"] == 1
+    assert stats["removed"] == 1
+    assert stats["total"] == 3
+    assert set(SlackChannel.objects.values_list("name", "is_private")) == {
+        ("general", False),
+        ("secret", True),
+        ("new", False),
+    }
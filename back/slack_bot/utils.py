@@ -1,8 +1,8 @@
 import json
+import threading
+import time
 
 import slack_sdk
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-from slack_bolt import App as SlackBoltApp
 from django.conf import settings
 from django.core.cache import cache
 from django.db.models import Q
@@ -10,42 +10,120 @@ from django.db.models import Q
 from admin.integrations.models import Integration
 from organization.models import Notification
 
+SLACK_OUTBOX_STARTED_KEY = "slack_outbox_dispatcher_started"
+SLACK_OUTBOX_RUNNING_KEY = "slack_outbox_dispatcher_running"
+
+# Client, token and the moment the token should be checked again
+_shared_client = (None, None, 0)
+_shared_client_lock = threading.Lock()
+
+
+def _get_slack_token():
+    if settings.SLACK_USE_SOCKET:
+        # The socket mode connection is only needed for receiving events, sending
+        # goes through the web API with the bot token
+        if settings.SLACK_BOT_TOKEN != "":
+            return settings.SLACK_BOT_TOKEN
+
+        raise Exception("Access token not available")
+
+    return Integration.objects.get(integration=0).token
+
+
+def get_slack_client():
+    """
+    Web client that is shared by all threads of this process. It's created on first
+    use and the token is checked again every SLACK_CLIENT_CACHE_SECONDS. A new
+    client is only created when the token has changed. Saving the Slack integration
+    clears it in the process that saved it.
+
+    :return WebClient: the client
+    """
+    global _shared_client
+    client, token, expires_at = _shared_client
+    if client is not None and expires_at >= time.monotonic():
+        return client
+
+    with _shared_client_lock:
+        # Another thread might have refreshed it while waiting for the lock
+        client, token, expires_at = _shared_client
+        if client is not None and expires_at >= time.monotonic():
+            return client
+
+        new_token = _get_slack_token()
+        if client is None or new_token != token:
+            client = slack_sdk.WebClient(token=new_token)
+        _shared_client = (
+            client,
+            new_token,
+            time.monotonic() + settings.SLACK_CLIENT_CACHE_SECONDS,
+        )
+        return client
+
+
+def clear_slack_client():
+    global _shared_client
+    with _shared_client_lock:
+        _shared_client = (None, None, 0)
+
 
 class Slack:
     def __init__(self):
         if not settings.FAKE_SLACK_API:
-            if not settings.SLACK_USE_SOCKET:
-                team = Integration.objects.get(integration=0)
-                self.client = slack_sdk.WebClient(token=team.token)
-            else:
-                if settings.SLACK_BOT_TOKEN != "":
-                    app = SlackBoltApp(token=settings.SLACK_BOT_TOKEN)
-                    handler = SocketModeHandler(app, settings.SLACK_APP_TOKEN)
-                    handler.connect()
-                    self.client = app.client
-                    return
-
-                raise Exception("Access token not available")
+            self.client = get_slack_client()
 
-    def get_channels(self):
-        try:
-            response = self.client.api_call(
-                "conversations.list",
-                data={
-                    "exclude_archived": True,
-                    "types": "public_channel,private_channel",
-                },
+    def get_channel_pages(self):
+        """
+        All channels that are not archived, one page at a time.
+
+        :return generator: a list of Slack channel objects per page
+        """
+        if settings.FAKE_SLACK_API:
+            return
+
+        cursor = None
+        while True:
+            response = self.client.conversations_list(
+                exclude_archived=True,
+                types="public_channel,private_channel",
+                limit=200,
+                cursor=cursor,
             )
-        except Exception:
-            return []
-        return [[x["name"], x["is_private"]] for x in response["channels"]]
+            yield response["channels"]
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                return
+
+    def get_channels(self):
+        # Raises on errors, an empty list would look like all channels got archived
+        return [
+            [channel["name"], channel["is_private"]]
+            for channels in self.get_channel_pages()
+            for channel in channels
+        ]
+
+    def get_user_pages(self):
+        """
+        All users of the workspace (also the deleted ones), one page at a time.
+
+        :return generator: a list of Slack user objects per page
+        """
+        if settings.FAKE_SLACK_API:
+            return
+
+        cursor = None
+        while True:
+            response = self.client.users_list(limit=200, cursor=cursor)
+            yield response["members"]
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                return
 
     def get_all_users(self):
         try:
-            response = self.client.api_call("users.list")
+            return [user for members in self.get_user_pages() for user in members]
         except Exception:
             return []
-        return response["members"]
 
     def find_by_email(self, email):
         try:
@@ -107,6 +185,16 @@ class Slack:
             channel=channel, user=user, text=text, blocks=blocks
         )
 
+    def post_message(self, channel, text="", blocks=[]):
+        # Raises on errors, use `send_message` to have those stored as notifications
+        if settings.FAKE_SLACK_API:
+            cache.set("slack_channel", channel)
+            cache.set("slack_blocks", blocks)
+            cache.set("slack_text", text)
+            return {"channel": "slacky"}
+
+        return self.client.chat_postMessage(channel=channel, text=text, blocks=blocks)
+
     def send_message(self, blocks=[], channel="", text=""):
         from users.models import User
 
@@ -115,19 +203,14 @@ class Slack:
             return False
 
         if settings.FAKE_SLACK_API:
-            cache.set("slack_channel", channel)
-            cache.set("slack_blocks", blocks)
-            cache.set("slack_text", text)
-            return {"channel": "slacky"}
+            return self.post_message(channel, text=text, blocks=blocks)
 
         response = None
         users = User.objects.filter(
             Q(slack_user_id=channel) | Q(slack_channel_id=channel)
         )
         try:
-            response = self.client.chat_postMessage(
-                channel=channel, text=text, blocks=blocks
-            )
+            response = self.post_message(channel, text=text, blocks=blocks)
             if users.exists():
                 Notification.objects.create(
                     notification_type="sent_slack_message",
@@ -146,6 +229,29 @@ class Slack:
 
         return response
 
+    def queue_message(self, blocks=[], channel="", text="", coalesce=False):
+        """
+        Same as `send_message`, but the message is put in the outbox and sent in the
+        background. That keeps to the rate limits of Slack, and retries the message
+        when it fails. Use this when the response isn't needed.
+
+        :param coalesce bool: allow combining it with other messages to the same
+            channel. Never use this for messages that get updated later on.
+        :return bool: False if the message got dropped
+        """
+        from .models import QueuedSlackMessage
+        from .tasks import start_slack_outbox
+
+        # if there is no channel, then drop
+        if channel == "":
+            return False
+
+        QueuedSlackMessage.objects.create(
+            channel=channel, text=text, blocks=blocks, coalesce=coalesce
+        )
+        start_slack_outbox()
+        return True
+
     def open_modal(self, trigger_id, view):
         if settings.FAKE_SLACK_API:
             cache.set("slack_trigger_id", trigger_id)
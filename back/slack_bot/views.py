@@ -17,6 +17,7 @@ from admin.sequences.models import Sequence
 from organization.models import Organization
 from users.models import NewHireWelcomeMessage, ResourceUser, ToDoUser
 
+from .models import SlackUser
 from .slack_misc import get_new_hire_approve_sequence_options
 from .slack_resource import SlackResource, SlackResourceCategory
 from .slack_to_do import SlackToDo, SlackToDoManager
@@ -259,9 +260,21 @@ def slack_catch_all_message_search_resources(message):
     )
 
 
+@exception_handler
+@app.event("user_change")
+def update_slack_user(event):
+    slack_update_slack_user(event)
+
+
+def slack_update_slack_user(event):
+    # Keep the local copy of the Slack users up-to-date
+    SlackUser.objects.update_from_slack([event["user"]])
+
+
 @exception_handler
 @app.event("team_join")
 def create_new_hire_or_ask_perm(event):
+    slack_update_slack_user(event)
     slack_create_new_hire_or_ask_perm(event)
 
 
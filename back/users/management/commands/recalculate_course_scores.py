@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from users.models import ResourceUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Grade all given course answers again and store the scores. Needed once for "
+        "answers that were given before the scores were stored."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500, help="Amount of items per query"
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        resource_user_ids = list(
+            ResourceUser.objects.filter(answers__isnull=False)
+            .distinct()
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+        changed = 0
+        # Batched by hand, as `iterator()` ignores prefetching
+        for start in range(0, len(resource_user_ids), batch_size):
+            batch = resource_user_ids[start:][:batch_size]
+            resource_users = ResourceUser.objects.filter(id__in=batch).prefetch_related(
+                "answers__chapter"
+            )
+
+            to_update = []
+            for resource_user in resource_users:
+                score = resource_user.get_score()
+                if score != (
+                    resource_user.amount_of_questions,
+                    resource_user.amount_of_correct_answers,
+                ):
+                    (
+                        resource_user.amount_of_questions,
+                        resource_user.amount_of_correct_answers,
+                    ) = score
+                    to_update.append(resource_user)
+
+            ResourceUser.objects.bulk_update(
+                to_update, ["amount_of_questions", "amount_of_correct_answers"]
+            )
+            changed += len(to_update)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Updated the scores of {changed} course items")
+        )
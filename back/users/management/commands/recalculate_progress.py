@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the completed and total tasks of users from scratch. Only needed to "
+        "repair the counters, they are kept up-to-date when items change."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, nargs="*", help="Ids of the users to recalculate"
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options["user"]:
+            users = users.filter(id__in=options["user"])
+
+        changed = get_user_model().objects.recalculate_progress(users)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recalculated {users.count()} users, {changed} had incorrect counters"
+            )
+        )
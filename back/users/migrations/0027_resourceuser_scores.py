@@ -0,0 +1,59 @@
+# Generated by Django 3.2.14 on 2026-10-17 07:37
+
+from django.db import migrations, models
+
+
+def grade_course_answers(apps, schema_editor):
+    # Same as `CourseAnswer.get_score`, copied so this keeps working
+    ResourceUser = apps.get_model("users", "ResourceUser")
+    scores = {}
+    for resource_user_id, answers, content in (
+        ResourceUser.answers.through.objects.values_list(
+            "resourceuser_id", "courseanswer__answers", "courseanswer__chapter__content"
+        )
+        .order_by("resourceuser_id")
+        .iterator()
+    ):
+        questions = content["blocks"]
+        score = scores.setdefault(resource_user_id, [0, 0])
+        score[0] += len(questions)
+        score[1] += sum(
+            1
+            for idx, question in enumerate(questions)
+            if answers.get(f"item-{idx}") == question.get("answer")
+        )
+
+    resource_users = [
+        ResourceUser(
+            id=resource_user_id,
+            amount_of_questions=questions,
+            amount_of_correct_answers=correct,
+        )
+        for resource_user_id, (questions, correct) in scores.items()
+    ]
+    ResourceUser.objects.bulk_update(
+        resource_users,
+        ["amount_of_questions", "amount_of_correct_answers"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0026_alter_user_timezone"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="resourceuser",
+            name="amount_of_correct_answers",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="resourceuser",
+            name="amount_of_questions",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(grade_course_answers, migrations.RunPython.noop),
+    ]
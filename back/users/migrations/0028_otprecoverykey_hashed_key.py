@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.utils.crypto import salted_hmac
+
+
+def hash_recovery_keys(apps, schema_editor):
+    # Same as `users.models.hash_otp_recovery_key`, copied so this keeps working
+    OTPRecoveryKey = apps.get_model("users", "OTPRecoveryKey")
+    recovery_keys = list(OTPRecoveryKey.objects.all())
+    for recovery_key in recovery_keys:
+        recovery_key.hashed_key = salted_hmac(
+            "users.OTPRecoveryKey", str(recovery_key.key), algorithm="sha256"
+        ).hexdigest()
+    OTPRecoveryKey.objects.bulk_update(recovery_keys, ["hashed_key"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0027_resourceuser_scores"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="otprecoverykey",
+            name="hashed_key",
+            field=models.CharField(db_index=True, default="", max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(hash_recovery_keys, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="otprecoverykey",
+            name="key",
+        ),
+    ]
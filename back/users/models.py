@@ -1,14 +1,17 @@
 import uuid
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import datetime
 
 import pyotp
 import pytz
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
-from django.db import models
-from django.template import Context, Template
-from django.utils.crypto import get_random_string
+from django.db import IntegrityError, models, transaction
+from django.db.models import DEFERRED, Count, F, Q, Value
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils.crypto import get_random_string, salted_hmac
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 from fernet_fields import EncryptedTextField
@@ -17,14 +20,30 @@ from admin.appointments.models import Appointment
 from admin.badges.models import Badge
 from admin.introductions.models import Introduction
 from admin.preboarding.models import Preboarding
-from admin.resources.models import CourseAnswer, Resource
-from admin.sequences.models import Condition
+from admin.resources.models import Chapter, CourseAnswer, Resource
+from admin.sequences.models import Condition, ConditionSchedule, Sequence
 from admin.to_do.models import ToDo
 from misc.models import File
+from misc.template_cache import render_template
 from slack_bot.utils import Slack, paragraph
 
 from .utils import CompletedFormCheck
 
+# Counters that are kept up-to-date with `User.objects.track_progress()`
+PROGRESS_FIELDS = ["total_tasks", "completed_tasks"]
+
+
+def generate_unique_url():
+    # 24 random characters (over 140 bits), so it doesn't need to be checked upfront.
+    # The unique constraint catches the (practically impossible) collision.
+    return get_random_string(length=24)
+
+
+def hash_otp_recovery_key(key):
+    # Keyed with the secret key, so leaked hashes can't be brute forced on their own
+    return salted_hmac("users.OTPRecoveryKey", str(key), algorithm="sha256").hexdigest()
+
+
 ROLE_CHOICES = (
     (0, _("New Hire")),
     (1, _("Administrator")),
@@ -50,6 +69,249 @@ class CustomUserManager(BaseUserManager):
         # Make validation case sensitive
         return self.get(**{self.model.USERNAME_FIELD + "__iexact": email})
 
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Create users in bulk, with the values `User.save()` sets for new users.
+        A `unique_url` or `totp_secret` that has been set already is kept.
+        """
+        objs = list(objs)
+        generated_url_users = []
+        for user in objs:
+            user.email = user.email.lower()
+            if not user.totp_secret:
+                user.totp_secret = pyotp.random_base32()
+            if not user.unique_url:
+                user.unique_url = generate_unique_url()
+                generated_url_users.append(user)
+
+        for user in objs:
+            user.set_loaded_values()
+
+        try:
+            with transaction.atomic():
+                return super().bulk_create(objs, *args, **kwargs)
+        except IntegrityError:
+            taken_urls = set(
+                self.get_queryset()
+                .filter(
+                    unique_url__in=[user.unique_url for user in generated_url_users]
+                )
+                .values_list("unique_url", flat=True)
+            )
+            if not len(taken_urls):
+                raise
+            for user in generated_url_users:
+                if user.unique_url in taken_urls:
+                    user.unique_url = generate_unique_url()
+            return super().bulk_create(objs, *args, **kwargs)
+
+    def load_personalization_contexts(self, users):
+        """
+        Build the personalization context for a batch of users at once, instead of
+        loading the manager and buddy for every user separately.
+
+        :param users queryset|list: users that will get texts personalized
+        :return list: the same users, with the context cached on them
+        """
+        if isinstance(users, models.QuerySet):
+            users = list(users.select_related("manager", "buddy"))
+            for user in users:
+                user.personalization_context
+            return users
+
+        users = list(users)
+        related_user_ids = {user.manager_id for user in users} | {
+            user.buddy_id for user in users
+        }
+        related_user_ids.discard(None)
+        related_users = (
+            self.get_queryset().in_bulk(related_user_ids)
+            if len(related_user_ids)
+            else {}
+        )
+        for user in users:
+            user.__dict__["personalization_context"] = user.get_personalization_context(
+                manager=related_users.get(user.manager_id),
+                buddy=related_users.get(user.buddy_id),
+            )
+        return users
+
+    def get_local_times(self, users, now=None):
+        """
+        Local datetime of many users at once. Every timezone is only resolved and
+        converted once, instead of once per user.
+
+        :param users queryset|list: users to get the local time for
+        :param now datetime: (aware) moment to convert, defaults to now
+        :return dict: user id as key and their local datetime as value
+        """
+        from organization.models import Organization, get_timezone
+
+        if now is None:
+            now = datetime.now(pytz.utc)
+        if isinstance(users, models.QuerySet):
+            users = users.values_list("id", "timezone")
+        else:
+            users = [(user.id, user.timezone) for user in users]
+
+        org_timezone = Organization.object.get_cached().timezone
+        local_times_by_timezone = {}
+        local_times = {}
+        for user_id, timezone_name in users:
+            timezone_name = timezone_name or org_timezone
+            if timezone_name not in local_times_by_timezone:
+                local_tz = get_timezone(timezone_name)
+                local_times_by_timezone[timezone_name] = local_tz.normalize(
+                    now.astimezone(local_tz)
+                )
+            local_times[user_id] = local_times_by_timezone[timezone_name]
+        return local_times
+
+    def get_progress(self, user_ids, to_do_ids=None, resource_ids=None):
+        """
+        Count the items that count towards the progress of users: the to do items and
+        courses they have or will get through their conditions. Optionally only
+        counting the given items, to get the difference a change makes.
+
+        :param user_ids list: ids of the users to count for
+        :param to_do_ids list: only count these to do items, None counts all
+        :param resource_ids list: only count these resources, None counts all
+        :return dict: user id as key and [total, completed] as value
+        """
+        UserConditions = self.model.conditions.through
+        progress = {user_id: [0, 0] for user_id in user_ids}
+
+        # Filter in one go, so the values below use the same join
+        to_do_filter = {"condition__to_do__isnull": False}
+        course_filter = {"condition__resources__course": True}
+        to_do_users = ToDoUser.objects.filter(user_id__in=user_ids)
+        course_users = ResourceUser.objects.filter(
+            user_id__in=user_ids, resource__course=True
+        )
+        if to_do_ids is not None:
+            to_do_filter = {"condition__to_do__in": to_do_ids}
+            to_do_users = to_do_users.filter(to_do_id__in=to_do_ids)
+        if resource_ids is not None:
+            course_filter["condition__resources__in"] = resource_ids
+            course_users = course_users.filter(resource_id__in=resource_ids)
+
+        # (user, item, completed) rows of items they will get and items they have
+        item_queries = []
+        if to_do_ids is None or len(to_do_ids):
+            item_queries.append(
+                UserConditions.objects.filter(user_id__in=user_ids, **to_do_filter)
+                .annotate(completed=Value(False))
+                .values_list("user_id", "condition__to_do", "completed")
+                .union(
+                    to_do_users.values_list("user_id", "to_do_id", "completed"),
+                    all=True,
+                )
+            )
+        if resource_ids is None or len(resource_ids):
+            item_queries.append(
+                UserConditions.objects.filter(user_id__in=user_ids, **course_filter)
+                .annotate(completed=Value(False))
+                .values_list("user_id", "condition__resources", "completed")
+                .union(
+                    course_users.values_list(
+                        "user_id", "resource_id", "completed_course"
+                    ),
+                    all=True,
+                )
+            )
+
+        for item_query in item_queries:
+            # Items can be in both, only count them once
+            items = set()
+            for user_id, item_id, completed in item_query:
+                items.add((user_id, item_id))
+                progress[user_id][1] += completed
+            for user_id, _item_id in items:
+                progress[user_id][0] += 1
+
+        return progress
+
+    def add_progress(self, user_ids, total=0, completed=0):
+        # Relative update, so concurrent changes don't overwrite each other
+        if total == 0 and completed == 0:
+            return
+        self.get_queryset().filter(id__in=user_ids).update(
+            total_tasks=F("total_tasks") + total,
+            completed_tasks=F("completed_tasks") + completed,
+        )
+
+    def add_progress_changes(self, before, after):
+        """
+        Add the difference between two `get_progress()` results to the counters.
+
+        :param before dict: progress before the change
+        :param after dict: progress after the change, for the same users
+        """
+        # Users with the same change get updated together
+        deltas = {}
+        for user_id in before:
+            delta = (
+                after[user_id][0] - before[user_id][0],
+                after[user_id][1] - before[user_id][1],
+            )
+            deltas.setdefault(delta, []).append(user_id)
+        for (total, completed), delta_user_ids in deltas.items():
+            self.add_progress(delta_user_ids, total=total, completed=completed)
+
+    @contextmanager
+    def track_progress(self, users, to_do_ids=None, resource_ids=None):
+        """
+        Keep the progress counters of users up-to-date while items are added to or
+        removed from them. Only the given items are counted before and after the
+        change, the difference is added to the counters.
+
+            with User.objects.track_progress([new_hire], to_do_ids=[to_do.id]):
+                new_hire.to_do.add(to_do)
+
+        :param users list: users that will be changed
+        :param to_do_ids list: to do items that might be added/removed/completed
+        :param resource_ids list: resources that might be added/removed/completed
+        """
+        users = list(users)
+        user_ids = [user.id for user in users]
+        to_do_ids = [] if to_do_ids is None else list(to_do_ids)
+        resource_ids = [] if resource_ids is None else list(resource_ids)
+
+        before = self.get_progress(user_ids, to_do_ids, resource_ids)
+        yield
+        after = self.get_progress(user_ids, to_do_ids, resource_ids)
+        self.add_progress_changes(before, after)
+
+        # Keep the instances in line with the database
+        for user in users:
+            user.total_tasks += after[user.id][0] - before[user.id][0]
+            user.completed_tasks += after[user.id][1] - before[user.id][1]
+            user.set_loaded_values(PROGRESS_FIELDS)
+            user.__dict__.pop("progress", None)
+
+    def recalculate_progress(self, users=None):
+        """
+        Count the progress of users from scratch. The counters are kept up-to-date
+        when items change, this is only needed to repair them.
+
+        :param users queryset: users to recalculate, defaults to all
+        :return int: amount of users that had incorrect counters
+        """
+        if users is None:
+            users = self.get_queryset()
+        users = list(users.values_list("id", "total_tasks", "completed_tasks"))
+        progress = self.get_progress([user_id for user_id, _total, _completed in users])
+
+        changed = 0
+        for user_id, total, completed in users:
+            if progress[user_id] != [total, completed]:
+                self.get_queryset().filter(id=user_id).update(
+                    total_tasks=progress[user_id][0],
+                    completed_tasks=progress[user_id][1],
+                )
+                changed += 1
+        return changed
+
 
 class ManagerManager(models.Manager):
     def get_queryset(self):
@@ -79,6 +341,42 @@ class NewHireManager(models.Manager):
             is_introduced_to_colleagues=False, start_day__gte=datetime.now().date()
         )
 
+    def at_local_hour(self, hour, now=None):
+        """
+        New hires for whom it's `hour` o'clock right now, on a weekday on or after
+        their start day. The timezones are checked instead of every new hire, so this
+        is a single query.
+
+        :param hour int: the local hour (0-23)
+        :param now datetime: (aware) moment to check, defaults to now
+        :return queryset: the matching new hires
+        """
+        from organization.models import Organization, get_timezone
+
+        if now is None:
+            now = datetime.now(pytz.utc)
+        org_timezone = Organization.object.get_cached().timezone
+
+        timezones_by_local_date = {}
+        for timezone_name in set(pytz.common_timezones) | {org_timezone}:
+            local_tz = get_timezone(timezone_name)
+            local_time = local_tz.normalize(now.astimezone(local_tz))
+            if local_time.hour == hour and local_time.weekday() < 5:
+                timezones_by_local_date.setdefault(local_time.date(), []).append(
+                    timezone_name
+                )
+
+        if not len(timezones_by_local_date):
+            return self.get_queryset().none()
+
+        query = Q()
+        for local_date, timezone_names in timezones_by_local_date.items():
+            if org_timezone in timezone_names:
+                # Users without a timezone use the one of the organization
+                timezone_names.append("")
+            query |= Q(timezone__in=timezone_names, start_day__lte=local_date)
+        return self.get_queryset().filter(query)
+
 
 class AdminManager(models.Manager):
     def get_queryset(self):
@@ -225,27 +523,11 @@ class User(AbstractBaseUser):
         return False
 
     def update_progress(self):
-        all_to_do_ids = list(
-            self.conditions.values_list("to_do__id", flat=True)
-        ) + list(self.to_do.values_list("id", flat=True))
-        all_course_ids = list(
-            self.conditions.filter(resources__course=True).values_list(
-                "resources__id", flat=True
-            )
-        ) + list(self.resources.filter(course=True).values_list("id", flat=True))
-
-        # remove duplicates
-        all_to_do_ids = list(dict.fromkeys(all_to_do_ids))
-        all_course_ids = list(dict.fromkeys(all_course_ids))
-
-        completed_to_dos = ToDoUser.objects.filter(user=self, completed=True).count()
-        completed_courses = ResourceUser.objects.filter(
-            resource__course=True, user=self, completed_course=True
-        ).count()
-
-        self.total_tasks = len(all_to_do_ids + all_course_ids)
-        self.completed_tasks = completed_to_dos + completed_courses
-        self.save()
+        # Full recount, the counters are normally updated with every change
+        User.objects.recalculate_progress(User.objects.filter(id=self.id))
+        self.refresh_from_db(fields=PROGRESS_FIELDS)
+        self.set_loaded_values(PROGRESS_FIELDS)
+        self.__dict__.pop("progress", None)
 
     def has_perm(self, perm, obj=None):
         return self.is_staff
@@ -253,67 +535,113 @@ class User(AbstractBaseUser):
     def has_module_perms(self, app_label):
         return self.is_superuser
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep track of the original values, so we know when the timed conditions
+        # need to be rescheduled
+        instance._loaded_values = dict(
+            zip(field_names, [value for value in values if value is not DEFERRED])
+        )
+        return instance
+
+    def set_loaded_values(self, fields=None):
+        # Instances that were created (not loaded) start tracking once they are saved
+        if fields is None:
+            fields = ["start_day", "timezone", *PROGRESS_FIELDS]
+        if not hasattr(self, "_loaded_values"):
+            self._loaded_values = {}
+        deferred_fields = self.get_deferred_fields()
+        self._loaded_values.update(
+            {
+                field: getattr(self, field)
+                for field in fields
+                if field not in deferred_fields
+            }
+        )
+
+    @property
+    def schedule_changed(self):
+        # Fields that weren't loaded (deferred) are skipped, so they don't get loaded
+        loaded_values = getattr(self, "_loaded_values", {})
+        return any(
+            field in loaded_values and loaded_values[field] != getattr(self, field)
+            for field in ["start_day", "timezone"]
+        )
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Progress is only changed with relative updates, don't overwrite it with
+        # values that might be outdated by now. Only save it when it got changed.
+        loaded_values = getattr(self, "_loaded_values", {})
+        values = [
+            (field, model, value)
+            for field, model, value in values
+            if field.name not in PROGRESS_FIELDS
+            or field.name not in loaded_values
+            or loaded_values[field.name] != value
+        ]
+        return super()._do_update(
+            base_qs, using, pk_val, values, update_fields, forced_update
+        )
+
     def save(self, *args, **kwargs):
         self.email = self.email.lower()
+        schedule_changed = self.schedule_changed
         if not self.pk:
             self.totp_secret = pyotp.random_base32()
-            while True:
-                unique_string = get_random_string(length=8)
-                if not User.objects.filter(unique_url=unique_string).exists():
-                    break
-            self.unique_url = unique_string
-        super(User, self).save(*args, **kwargs)
+            self.unique_url = generate_unique_url()
+            try:
+                with transaction.atomic():
+                    super(User, self).save(*args, **kwargs)
+            except IntegrityError:
+                if not User.objects.filter(unique_url=self.unique_url).exists():
+                    raise
+                # Try again with another one, if the url was taken after all
+                self.unique_url = generate_unique_url()
+                super(User, self).save(*args, **kwargs)
+        else:
+            super(User, self).save(*args, **kwargs)
+        self.clear_personalization_context()
+
+        if schedule_changed:
+            ConditionSchedule.objects.rebuild(users=[self])
+        self.set_loaded_values()
 
     def add_sequences(self, sequences):
-        for sequence in sequences:
-            sequence.assign_to_user(self)
+        Sequence.objects.assign_to_users(sequences, [self])
 
     @cached_property
-    def workday(self):
-        start_day = self.start_day
-        local_day = self.get_local_time().date()
-
-        if start_day > local_day:
-            return 0
+    def business_days(self):
+        from organization.models import Organization
 
-        amount_of_workdays = 1
-        while local_day != start_day:
-            start_day += timedelta(days=1)
-            if start_day.weekday() not in [5, 6]:
-                amount_of_workdays += 1
+        return Organization.object.get_cached().business_days
 
-        return amount_of_workdays
+    @cached_property
+    def workday(self):
+        return self.business_days.workday(self.start_day, self.get_local_time().date())
 
     def workday_to_datetime(self, workdays):
-        start_day = self.start_day
-
-        start = 1
-        while start != workdays:
-            start_day += timedelta(days=1)
-            if start_day.weekday() not in [5, 6]:
-                start += 1
-        return start_day
+        return self.business_days.workday_to_date(self.start_day, workdays)
 
     @cached_property
     def days_before_starting(self):
         # not counting workdays here
-        if self.start_day <= self.get_local_time().date():
-            return 0
-        return (self.start_day - self.get_local_time().date()).days
+        return max((self.start_day - self.get_local_time().date()).days, 0)
 
-    def get_local_time(self, date=None):
-        from organization.models import Organization
+    @property
+    def tzinfo(self):
+        from organization.models import Organization, get_timezone
 
+        if self.timezone == "":
+            return Organization.object.get_cached().tzinfo
+        return get_timezone(self.timezone)
+
+    def get_local_time(self, date=None):
         if date is not None:
             date = date.replace(tzinfo=None)
 
-        local_tz = pytz.timezone("UTC")
-        org = Organization.object.get()
-        us_tz = (
-            pytz.timezone(org.timezone)
-            if self.timezone == ""
-            else pytz.timezone(self.timezone)
-        )
+        local_tz = pytz.utc
+        us_tz = self.tzinfo
         local = (
             local_tz.localize(datetime.now())
             if date is None
@@ -321,47 +649,68 @@ class User(AbstractBaseUser):
         )
         return us_tz.normalize(local.astimezone(us_tz))
 
-    def personalize(self, text, extra_values={}):
-        t = Template(text)
-        manager = ""
-        manager_email = ""
-        buddy = ""
-        buddy_email = ""
-        if self.manager is not None:
-            manager = self.manager.full_name
-            manager_email = self.manager.email
-        if self.buddy is not None:
-            buddy = self.buddy.full_name
-            buddy_email = self.buddy.email
-        new_hire_context = {
-            "manager": manager,
-            "buddy": buddy,
+    def get_personalization_context(self, manager=None, buddy=None):
+        """
+        Values that can be used in texts for this user.
+
+        :param manager User: the manager of this user (if any)
+        :param buddy User: the buddy of this user (if any)
+        :return dict: context to render texts with
+        """
+        return {
+            "manager": manager.full_name if manager is not None else "",
+            "buddy": buddy.full_name if buddy is not None else "",
             "position": self.position,
             "last_name": self.last_name,
             "first_name": self.first_name,
             "email": self.email,
             "start": self.start_day,
-            "buddy_email": buddy_email,
-            "manager_email": manager_email,
+            "buddy_email": buddy.email if buddy is not None else "",
+            "manager_email": manager.email if manager is not None else "",
         }
-        text = t.render(Context(new_hire_context | extra_values))
-        return text
+
+    @cached_property
+    def personalization_context(self):
+        # Built once and reused for every text that gets personalized. Use
+        # `User.objects.load_personalization_contexts()` to build it for many users.
+        return self.get_personalization_context(self.manager, self.buddy)
+
+    def clear_personalization_context(self):
+        self.__dict__.pop("personalization_context", None)
+
+    def personalize(self, text, extra_values={}):
+        return render_template(text, self.personalization_context | extra_values)
 
     def reset_otp_recovery_keys(self):
+        """
+        Replace the recovery keys of the user with 10 new ones. Only the hashes are
+        stored, so this is the only moment the keys themselves are available.
+
+        :return list: the new keys
+        """
         self.user_otp.all().delete()
-        newItems = [OTPRecoveryKey(user=self) for x in range(10)]
-        OTPRecoveryKey.objects.bulk_create(newItems)
-        return self.user_otp.all().values_list("key", flat=True)
+        keys = [str(uuid.uuid4()) for x in range(10)]
+        OTPRecoveryKey.objects.bulk_create(
+            [
+                OTPRecoveryKey(user=self, hashed_key=hash_otp_recovery_key(key))
+                for key in keys
+            ]
+        )
+        return keys
 
     def check_otp_recovery_key(self, totp_input):
-        otp_recovery_key = None
-        for i in OTPRecoveryKey.objects.filter(is_used=False, user=self):
-            if i.key == totp_input:
-                otp_recovery_key = i
-                break
-        if otp_recovery_key is not None:
-            otp_recovery_key.is_used = True
-            otp_recovery_key.save()
+        otp_recovery_key = OTPRecoveryKey.objects.filter(
+            user=self, hashed_key=hash_otp_recovery_key(totp_input), is_used=False
+        ).first()
+        if otp_recovery_key is None:
+            return None
+
+        # Conditional update, so a key can't be used twice at the same time
+        if not OTPRecoveryKey.objects.filter(
+            id=otp_recovery_key.id, is_used=False
+        ).update(is_used=True):
+            return None
+        otp_recovery_key.is_used = True
         return otp_recovery_key
 
     @property
@@ -376,6 +725,27 @@ class User(AbstractBaseUser):
         return "%s" % self.full_name
 
 
+@receiver(m2m_changed, sender=User.conditions.through)
+def update_condition_schedules(sender, instance, action, reverse, pk_set, **kwargs):
+    # Keep the fire times of timed conditions in sync with the user conditions
+    if reverse:
+        users, conditions = pk_set, [instance]
+    else:
+        users, conditions = [instance], pk_set
+
+    if action == "post_add":
+        ConditionSchedule.objects.rebuild(users=users, conditions=conditions)
+    elif action == "post_remove":
+        ConditionSchedule.objects.filter(
+            user__in=users, condition__in=conditions
+        ).delete()
+    elif action == "post_clear":
+        if reverse:
+            ConditionSchedule.objects.filter(condition=instance).delete()
+        else:
+            ConditionSchedule.objects.filter(user=instance).delete()
+
+
 class ToDoUserManager(models.Manager):
     def all_to_do(self, user):
         return super().get_queryset().filter(user=user, completed=False)
@@ -412,13 +782,40 @@ class ToDoUser(CompletedFormCheck, models.Model):
         return self.to_do.name
 
     def mark_completed(self):
-        from admin.sequences.tasks import process_condition
+        from admin.sequences.tasks import queue_process_condition
 
+        # Only count it once, also when it's completed twice at the same time
+        newly_completed = ToDoUser.objects.filter(id=self.id, completed=False).update(
+            completed=True
+        )
         self.completed = True
         self.save()
-
-        # Get conditions with this to do item as (part of the) condition
-        conditions = self.user.conditions.filter(condition_to_do=self.to_do)
+        if not newly_completed:
+            return
+        get_user_model().objects.add_progress([self.user_id], completed=1)
+
+        # Get conditions with this to do item as (part of the) condition, of which
+        # all to do items have been added to the new hire and are completed. If
+        # not, then we know it should not be triggered yet. One query for all of them.
+        ConditionToDo = Condition.condition_to_do.through
+        completed_to_dos = ToDoUser.objects.filter(
+            user_id=self.user_id, completed=True
+        ).values("to_do")
+        conditions = (
+            self.user.conditions.filter(
+                id__in=ConditionToDo.objects.filter(todo_id=self.to_do_id).values(
+                    "condition"
+                )
+            )
+            .annotate(
+                amount_to_do=Count("condition_to_do"),
+                amount_completed=Count(
+                    "condition_to_do", filter=Q(condition_to_do__in=completed_to_dos)
+                ),
+            )
+            .filter(amount_to_do=F("amount_completed"))
+            .values_list("id", flat=True)
+        )
 
         # Send answers back to slack channel?
         if self.to_do.send_back:
@@ -443,23 +840,13 @@ class ToDoUser(CompletedFormCheck, models.Model):
                 channel=self.to_do.slack_channel.name,
             )
 
-        for condition in conditions:
-
-            condition_to_do_ids = condition.condition_to_do.values_list("id", flat=True)
-
-            # Check if all to do items already have been added to new hire and are
-            # completed. If not, then we know it should not be triggered yet
-            to_do_user = ToDoUser.objects.filter(
-                to_do__in=condition_to_do_ids, user=self.user, completed=True
+        for condition_id in conditions:
+            # Processed in the background, so the new hire doesn't have to wait.
+            # Send notification only if user has a slack account
+            queue_process_condition(
+                condition_id, self.user_id, self.user.has_slack_account
             )
 
-            # If the amount matches, then we should process it
-            if to_do_user.count() == len(condition_to_do_ids):
-                # Send notification only if user has a slack account
-                process_condition(
-                    condition.id, self.user.id, self.user.has_slack_account
-                )
-
 
 class PreboardingUser(CompletedFormCheck, models.Model):
     user = models.ForeignKey(
@@ -493,38 +880,65 @@ class ResourceUser(models.Model):
     answers = models.ManyToManyField(CourseAnswer)
     reminded = models.DateTimeField(null=True)
     completed_course = models.BooleanField(default=False)
+    # Scores of the given answers, graded once when the answers get added
+    amount_of_questions = models.IntegerField(default=0)
+    amount_of_correct_answers = models.IntegerField(default=0)
 
     def add_step(self):
-        self.step += 1
-        self.save()
+        """
+        Move on to the next chapter of the course, skipping folders. Completes the
+        course when passing the last chapter.
+
+        :return Chapter: the next chapter, or None if the course has been completed
+        """
+        # Only the order and type of the chapters are needed to find the next one
+        chapters = list(
+            Chapter.objects.filter(resource_id=self.resource_id).values_list(
+                "order", "type"
+            )
+        )
+        chapter_types = dict(chapters)
+        amount_of_chapters = len(chapters)
 
-        # Check if we are already past the max amount of steps
-        # Avoid race conditions
-        chapters = self.resource.chapters
-        if self.step > chapters.count():
+        # Already past the max amount of steps
+        if self.step >= amount_of_chapters:
             return None
 
+        # Skip over any folders
+        # This is safe, as a folder can never be the last type
+        next_step = self.step + 1
+        while next_step < amount_of_chapters and chapter_types.get(next_step) == 1:
+            next_step += 1
+
         # Check if that's the last one and wrap up if so
-        if self.step == chapters.count():
+        completes_course = next_step >= amount_of_chapters
+        update_values = {"step": next_step}
+        if completes_course:
+            update_values["completed_course"] = True
+
+        # Only moves on from the step we are on. Avoids race conditions (i.e.
+        # clicking "next" twice) skipping a chapter.
+        moved = ResourceUser.objects.filter(id=self.id, step=self.step).update(
+            **update_values
+        )
+        if not moved:
+            # Someone else already moved on, continue from there
+            self.refresh_from_db(fields=["step", "completed_course"])
+            if self.step >= amount_of_chapters:
+                return None
+            return Chapter.objects.get(resource_id=self.resource_id, order=self.step)
+
+        was_completed = self.completed_course
+        self.step = next_step
+        if completes_course:
             self.completed_course = True
-            self.save()
-
             # Up one for completed stat in user
-            self.user.completed_tasks += 1
-            self.user.save()
+            if not was_completed and self.resource.course:
+                get_user_model().objects.add_progress([self.user_id], completed=1)
             return None
 
-        # Skip over any folders
-        # This is safe, as a folder can never be the last type
-        while (
-            chapters.filter(order=self.step).exists()
-            and chapters.get(order=self.step).type == 1
-        ):
-            self.step += 1
-            self.save()
-
         # Return next chapter
-        return chapters.get(order=self.step)
+        return Chapter.objects.get(resource_id=self.resource_id, order=next_step)
 
     @property
     def object_name(self):
@@ -543,24 +957,58 @@ class ResourceUser(models.Model):
         # used to determine if item should show up as course or as article
         return self.resource.course and not self.completed_course
 
+    def add_score(self, course_answers):
+        """
+        Grade course answers and add them to the stored score.
+
+        :param course_answers list: `CourseAnswer` items with their chapter
+        """
+        amount_of_questions = 0
+        amount_of_correct_answers = 0
+        for course_answer in course_answers:
+            questions, correct_answers = course_answer.get_score()
+            amount_of_questions += questions
+            amount_of_correct_answers += correct_answers
+
+        # Relative update, answers of other chapters might be added at the same time
+        ResourceUser.objects.filter(id=self.id).update(
+            amount_of_questions=F("amount_of_questions") + amount_of_questions,
+            amount_of_correct_answers=F("amount_of_correct_answers")
+            + amount_of_correct_answers,
+        )
+        self.amount_of_questions += amount_of_questions
+        self.amount_of_correct_answers += amount_of_correct_answers
+
+    def get_score(self):
+        """
+        Grade all given answers from scratch. Use `prefetch_related("answers__chapter")`
+        to avoid queries when doing this for multiple items.
+
+        :return tuple: amount of questions, amount of correct answers
+        """
+        amount_of_questions = 0
+        amount_of_correct_answers = 0
+        for course_answer in self.answers.all():
+            questions, correct_answers = course_answer.get_score()
+            amount_of_questions += questions
+            amount_of_correct_answers += correct_answers
+        return amount_of_questions, amount_of_correct_answers
+
+    def update_score(self):
+        self.amount_of_questions, self.amount_of_correct_answers = self.get_score()
+        self.save(update_fields=["amount_of_questions", "amount_of_correct_answers"])
+
     @property
     def get_rating(self):
-        if not self.answers.exists():
+        if not self.amount_of_questions:
             return "n/a"
 
-        amount_of_questions = 0
-        amount_of_correct_answers = 0
-        for question_page in self.answers.all():
-            amount_of_questions += len(question_page.chapter.content["blocks"])
-            for idx, answer in enumerate(question_page.chapter.content["blocks"]):
-                if question_page.answers[f"item-{idx}"] == answer["answer"]:
-                    amount_of_correct_answers += 1
         return _(
             "%(amount_of_correct_answers)s correct answers out of "
             "%(amount_of_questions)s questions"
         ) % {
-            "amount_of_correct_answers": amount_of_correct_answers,
-            "amount_of_questions": amount_of_questions,
+            "amount_of_correct_answers": self.amount_of_correct_answers,
+            "amount_of_questions": self.amount_of_questions,
         }
 
     def get_user_answer_by_chapter(self, chapter):
@@ -569,6 +1017,86 @@ class ResourceUser(models.Model):
         return self.answers.get(chapter=chapter)
 
 
+@receiver(m2m_changed, sender=ResourceUser.answers.through)
+def update_course_score(sender, instance, action, reverse, pk_set, **kwargs):
+    # Grade answers once when they get added, so showing the rating doesn't have to
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+
+    if reverse:
+        if pk_set is not None:
+            for resource_user in ResourceUser.objects.filter(id__in=pk_set):
+                resource_user.update_score()
+    elif action == "post_add":
+        instance.add_score(
+            CourseAnswer.objects.filter(id__in=pk_set).select_related("chapter")
+        )
+    else:
+        instance.update_score()
+
+
+@receiver(pre_delete, sender=ToDo)
+@receiver(pre_delete, sender=Resource)
+@receiver(pre_delete, sender=Condition)
+def count_progress_before_delete(sender, instance, **kwargs):
+    # The items of the users are removed along with it, so their counters have to
+    # go down. Count what it adds to their progress now, and update them once it's
+    # gone.
+    UserConditions = User.conditions.through
+    if sender is Condition:
+        to_do_ids = list(instance.to_do.values_list("id", flat=True))
+        resource_ids = list(
+            instance.resources.filter(course=True).values_list("id", flat=True)
+        )
+        user_ids = set(
+            UserConditions.objects.filter(condition=instance).values_list(
+                "user_id", flat=True
+            )
+        )
+    elif sender is ToDo:
+        to_do_ids, resource_ids = [instance.id], []
+        user_ids = set(
+            ToDoUser.objects.filter(to_do=instance).values_list("user_id", flat=True)
+        ) | set(
+            UserConditions.objects.filter(condition__to_do=instance).values_list(
+                "user_id", flat=True
+            )
+        )
+    else:
+        if not instance.course:
+            return
+        to_do_ids, resource_ids = [], [instance.id]
+        user_ids = set(
+            ResourceUser.objects.filter(resource=instance).values_list(
+                "user_id", flat=True
+            )
+        ) | set(
+            UserConditions.objects.filter(condition__resources=instance).values_list(
+                "user_id", flat=True
+            )
+        )
+
+    if not len(user_ids) or not len(to_do_ids + resource_ids):
+        return
+    instance._progress_before_delete = (
+        list(user_ids),
+        to_do_ids,
+        resource_ids,
+        User.objects.get_progress(list(user_ids), to_do_ids, resource_ids),
+    )
+
+
+@receiver(post_delete, sender=ToDo)
+@receiver(post_delete, sender=Resource)
+@receiver(post_delete, sender=Condition)
+def update_progress_after_delete(sender, instance, **kwargs):
+    if not hasattr(instance, "_progress_before_delete"):
+        return
+    user_ids, to_do_ids, resource_ids, before = instance._progress_before_delete
+    after = User.objects.get_progress(user_ids, to_do_ids, resource_ids)
+    User.objects.add_progress_changes(before, after)
+
+
 class NewHireWelcomeMessage(models.Model):
     # messages placed through the slack bot
     new_hire = models.ForeignKey(
@@ -584,5 +1112,6 @@ class OTPRecoveryKey(models.Model):
     user = models.ForeignKey(
         get_user_model(), related_name="user_otp", on_delete=models.CASCADE
     )
-    key = EncryptedTextField(default=uuid.uuid4)
+    # Only a hash of the key is stored, so it can be looked up directly
+    hashed_key = models.CharField(max_length=64, db_index=True)
     is_used = models.BooleanField(default=False)
@@ -20,8 +20,10 @@ def hourly_check_for_new_hire_send_credentials():
     if not org.new_hire_email:
         return
 
-    for new_hire in get_user_model().new_hires.all():
-        new_hire_datetime = new_hire.get_local_time()
+    new_hires = list(get_user_model().new_hires.all())
+    local_times = get_user_model().objects.get_local_times(new_hires)
+    for new_hire in new_hires:
+        new_hire_datetime = local_times[new_hire.id]
         if (
             new_hire_datetime.date() == new_hire.start_day
             and new_hire_datetime.hour == 8
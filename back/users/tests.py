@@ -1,12 +1,24 @@
 import datetime
+from io import StringIO
+from unittest.mock import Mock, patch
 
 import pytest
+import pytz
+from django.core.management import call_command
+from django.db import IntegrityError
 from freezegun import freeze_time
 
 from organization.models import Organization
 from users.tasks import hourly_check_for_new_hire_send_credentials
 
-from .models import OTPRecoveryKey, User
+from .models import (
+    CourseAnswer,
+    OTPRecoveryKey,
+    ResourceUser,
+    ToDoUser,
+    User,
+    hash_otp_recovery_key,
+)
 
 
 @pytest.mark.django_db
@@ -61,6 +73,32 @@ def test_workday(date, workday, new_hire_factory):
     freezer.stop()
 
 
+@pytest.mark.django_db
+@freeze_time("2022-05-13 07:30:00")
+def test_get_local_times(new_hire_factory, django_assert_max_num_queries):
+    new_hires = [
+        new_hire_factory(timezone="Europe/Amsterdam"),
+        new_hire_factory(timezone="America/New_York"),
+        new_hire_factory(timezone=""),
+    ]
+
+    with django_assert_max_num_queries(2):
+        local_times = User.objects.get_local_times(
+            User.objects.filter(id__in=[new_hire.id for new_hire in new_hires])
+        )
+
+    assert local_times == {
+        new_hire.id: new_hire.get_local_time() for new_hire in new_hires
+    }
+    assert local_times[new_hires[0].id].hour == 9
+    assert local_times[new_hires[1].id].hour == 3
+    # Falls back on the timezone of the organization
+    assert local_times[new_hires[2].id].hour == 7
+
+    # Works with a list of users too
+    assert User.objects.get_local_times(new_hires) == local_times
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize(
     "first_name, last_name, initials, full_name",
@@ -86,20 +124,78 @@ def test_unique_user_props(new_hire_factory):
 
 
 @pytest.mark.django_db
-def test_generating_and_validating_otp_keys(new_hire_factory):
+def test_unique_url_collision(new_hire_factory):
+    user1 = new_hire_factory()
+
+    # No check upfront, the database catches it and it tries again
+    with patch(
+        "users.models.generate_unique_url",
+        Mock(side_effect=[user1.unique_url, "new_unique_url"]),
+    ):
+        user2 = new_hire_factory()
+    assert user2.unique_url == "new_unique_url"
+
+    # Other errors are not swallowed
+    with pytest.raises(IntegrityError):
+        User.objects.create(email=user1.email, first_name="", last_name="")
+
+
+@pytest.mark.django_db
+def test_bulk_create_users():
+    users = User.objects.bulk_create(
+        [
+            User(email=f"JOHN{i}@example.com", first_name="John", last_name=str(i))
+            for i in range(3)
+        ]
+    )
+
+    assert User.objects.filter(email__startswith="john").count() == 3
+    assert len({user.unique_url for user in users}) == 3
+    assert all(len(user.totp_secret) for user in users)
+
+    # Urls that are taken get a new one
+    with patch(
+        "users.models.generate_unique_url",
+        Mock(side_effect=[users[0].unique_url, "unique_url_1", "unique_url_2"]),
+    ):
+        new_users = User.objects.bulk_create(
+            [User(email="jane@example.com", first_name="Jane", last_name="")]
+        )
+    assert new_users[0].unique_url == "unique_url_1"
+
+    # Values that have been set already are kept
+    User.objects.bulk_create(
+        [
+            User(
+                email="jack@example.com",
+                first_name="Jack",
+                last_name="",
+                unique_url="jacks_url",
+                totp_secret="JACKSSECRET",
+            )
+        ]
+    )
+    jack = User.objects.get(email="jack@example.com")
+    assert jack.unique_url == "jacks_url"
+    assert jack.totp_secret == "JACKSSECRET"
+
+
+@pytest.mark.django_db
+def test_generating_and_validating_otp_keys(
+    new_hire_factory, django_assert_num_queries
+):
     user1 = new_hire_factory()
     user2 = new_hire_factory()
 
     user1_new_keys = user1.reset_otp_recovery_keys()
     user2_new_keys = user2.reset_otp_recovery_keys()
 
-    # We cannot search through an encrypted field, so we have to loop through it
-    recovery_key = None
-    for item in OTPRecoveryKey.objects.all():
-        if item.key == user1_new_keys[0]:
-            recovery_key = item
+    # Only the hashes are stored
+    assert not OTPRecoveryKey.objects.filter(hashed_key=user1_new_keys[0]).exists()
+    recovery_key = OTPRecoveryKey.objects.get(
+        hashed_key=hash_otp_recovery_key(user1_new_keys[0])
+    )
 
-    assert recovery_key is not None
     # Generate new keys and check that there are 10 items available and returned
     assert len(user1_new_keys) == 10
     assert OTPRecoveryKey.objects.count() == 20
@@ -120,6 +216,10 @@ def test_generating_and_validating_otp_keys(new_hire_factory):
     # Key cannot be reused
     assert user1.check_otp_recovery_key(user1_new_keys[0]) is None
 
+    # Looked up directly (no need to go through all keys) and marked as used
+    with django_assert_num_queries(2):
+        assert user1.check_otp_recovery_key(user1_new_keys[1]) is not None
+
 
 @pytest.mark.django_db
 @pytest.mark.parametrize(
@@ -167,6 +267,46 @@ def test_personalize(manager_factory, new_hire_factory):
     assert new_hire.personalize(text_without_spaces) == expected_output
 
 
+@pytest.mark.django_db
+def test_personalization_context(
+    manager_factory, new_hire_factory, django_assert_num_queries
+):
+    manager = manager_factory(first_name="jane", last_name="smith")
+    buddy = manager_factory(first_name="peter", last_name="jones")
+    new_hire_factory.create_batch(3, manager=manager, buddy=buddy)
+    new_hire_factory.create_batch(2)
+
+    text = "Your manager is {{ manager }} and your buddy is {{ buddy }}"
+
+    # One query for all users, regardless of the amount of texts
+    with django_assert_num_queries(1):
+        new_hires = User.objects.load_personalization_contexts(
+            User.new_hires.all().order_by("id")
+        )
+        for new_hire in new_hires:
+            new_hire.personalize(text)
+            new_hire.personalize("{{ manager_email }}")
+
+    assert new_hires[0].personalize(text) == (
+        "Your manager is jane smith and your buddy is peter jones"
+    )
+    assert new_hires[4].personalize(text) == "Your manager is  and your buddy is "
+
+    # Already loaded users only need one query for the managers and buddies
+    new_hires = list(User.new_hires.all().order_by("id"))
+    with django_assert_num_queries(1):
+        User.objects.load_personalization_contexts(new_hires)
+        for new_hire in new_hires:
+            new_hire.personalize(text)
+
+    assert new_hires[1].personalize("{{ buddy_email }}") == buddy.email
+
+    # Saving the user clears the context
+    new_hires[0].manager = buddy
+    new_hires[0].save()
+    assert new_hires[0].personalize("{{ manager }}") == "peter jones"
+
+
 @pytest.mark.django_db
 def test_new_hire_manager(new_hire_factory):
     new_hire_factory(
@@ -245,3 +385,337 @@ def test_daily_check_for_new_hire_send_credentials_task(
     # No new email as it's 9 am and not 8 am
     assert len(mailoutbox) == 1
     freezer.stop()
+
+
+@pytest.mark.django_db
+def test_mark_completed_triggers_condition(
+    new_hire_factory, condition_to_do_factory, to_do_factory, to_do_user_factory
+):
+    new_hire = new_hire_factory()
+    trigger1 = to_do_factory()
+    trigger2 = to_do_factory()
+    to_do = to_do_factory()
+    condition = condition_to_do_factory()
+    condition.condition_to_do.set([trigger1, trigger2])
+    condition.to_do.add(to_do)
+    new_hire.conditions.add(condition)
+
+    to_do_user1 = to_do_user_factory(user=new_hire, to_do=trigger1)
+    to_do_user2 = to_do_user_factory(user=new_hire, to_do=trigger2)
+
+    # Not all trigger items are completed yet
+    to_do_user1.mark_completed()
+    assert not new_hire.to_do.filter(id=to_do.id).exists()
+
+    to_do_user2.mark_completed()
+    assert new_hire.to_do.filter(id=to_do.id).exists()
+
+
+@pytest.mark.django_db
+def test_mark_completed_queues_condition_once(
+    new_hire_factory,
+    condition_to_do_factory,
+    to_do_factory,
+    to_do_user_factory,
+    django_assert_max_num_queries,
+):
+    new_hire = new_hire_factory()
+    trigger = to_do_factory()
+    conditions = condition_to_do_factory.create_batch(3)
+    for condition in conditions:
+        condition.condition_to_do.set([trigger])
+    # Needs another to do item that hasn't been completed yet
+    other_condition = condition_to_do_factory()
+    other_condition.condition_to_do.set([trigger, to_do_factory()])
+    new_hire.conditions.add(*conditions, other_condition)
+    to_do_user = to_do_user_factory(user=new_hire, to_do=trigger)
+
+    with patch("admin.sequences.tasks.async_task") as async_task:
+        # One query for finding the conditions, the rest is the idempotency key of
+        # every condition that gets queued (5 each)
+        with django_assert_max_num_queries(4 + 3 * 5):
+            to_do_user.mark_completed()
+        assert sorted(call.args[1] for call in async_task.call_args_list) == sorted(
+            condition.id for condition in conditions
+        )
+
+        # Double click
+        to_do_user.mark_completed()
+        ToDoUser.objects.get(id=to_do_user.id).mark_completed()
+        assert async_task.call_count == 3
+
+        # Reopened and completed again before it has been processed doesn't trigger
+        # it again
+        ToDoUser.objects.filter(id=to_do_user.id).update(completed=False)
+        ToDoUser.objects.get(id=to_do_user.id).mark_completed()
+        assert async_task.call_count == 3
+
+        # Once processed, it can be triggered again
+        for call in async_task.call_args_list:
+            call.args[0](*call.args[1:])
+        ToDoUser.objects.filter(id=to_do_user.id).update(completed=False)
+        ToDoUser.objects.get(id=to_do_user.id).mark_completed()
+        assert async_task.call_count == 6
+
+
+@pytest.mark.django_db
+def test_progress_counters(
+    new_hire_factory,
+    sequence_factory,
+    condition_timed_factory,
+    to_do_factory,
+    resource_factory,
+):
+    new_hire = new_hire_factory()
+    to_dos = to_do_factory.create_batch(3)
+    course = resource_factory(course=True)
+    resource = resource_factory(course=False)
+
+    sequence = sequence_factory()
+    # One item right away, the others later
+    unconditional = sequence.conditions.get(condition_type=3)
+    unconditional.to_do.add(to_dos[0])
+    condition = condition_timed_factory(sequence=sequence)
+    condition.to_do.add(*to_dos)
+    condition.resources.add(course, resource)
+
+    new_hire.add_sequences([sequence])
+
+    # Items in the condition that hasn't been triggered count as well, but only once
+    new_hire.refresh_from_db()
+    assert new_hire.total_tasks == 4
+    assert new_hire.completed_tasks == 0
+
+    # Outdated instances don't overwrite the counters
+    outdated_new_hire = User.objects.get(id=new_hire.id)
+    ToDoUser.objects.get(user=new_hire, to_do=to_dos[0]).mark_completed()
+    outdated_new_hire.first_name = "John"
+    outdated_new_hire.save()
+
+    new_hire.refresh_from_db()
+    assert new_hire.total_tasks == 4
+    assert new_hire.completed_tasks == 1
+    assert new_hire.first_name == "John"
+
+    # Completing twice only counts once
+    ToDoUser.objects.get(user=new_hire, to_do=to_dos[0]).mark_completed()
+    new_hire.refresh_from_db()
+    assert new_hire.completed_tasks == 1
+
+    # Reopening and removing items
+    with User.objects.track_progress([new_hire], to_do_ids=[to_dos[0].id]):
+        ToDoUser.objects.filter(user=new_hire, to_do=to_dos[0]).update(completed=False)
+    assert new_hire.completed_tasks == 0
+    with User.objects.track_progress([new_hire], to_do_ids=[to_dos[0].id]):
+        new_hire.to_do.remove(to_dos[0])
+    # Still counted, as it's part of the other condition
+    assert new_hire.total_tasks == 4
+
+    new_hire.refresh_from_db()
+    assert User.objects.recalculate_progress() == 0
+    assert [new_hire.total_tasks, new_hire.completed_tasks] == [4, 0]
+
+
+@pytest.mark.django_db
+def test_progress_counters_on_delete(
+    new_hire_factory,
+    sequence_factory,
+    condition_timed_factory,
+    to_do_factory,
+    resource_factory,
+):
+    new_hire = new_hire_factory()
+    to_dos = to_do_factory.create_batch(3)
+    course = resource_factory(course=True)
+
+    sequence = sequence_factory()
+    unconditional = sequence.conditions.get(condition_type=3)
+    unconditional.to_do.add(to_dos[0])
+    condition = condition_timed_factory(sequence=sequence)
+    condition.to_do.add(*to_dos)
+    condition.resources.add(course)
+
+    new_hire.add_sequences([sequence])
+    ToDoUser.objects.get(user=new_hire, to_do=to_dos[0]).mark_completed()
+    new_hire.refresh_from_db()
+    assert [new_hire.total_tasks, new_hire.completed_tasks] == [4, 1]
+
+    # Deleting the templates removes them from the new hire
+    to_dos[0].delete()
+    new_hire.refresh_from_db()
+    assert [new_hire.total_tasks, new_hire.completed_tasks] == [3, 0]
+
+    course.delete()
+    new_hire.refresh_from_db()
+    assert [new_hire.total_tasks, new_hire.completed_tasks] == [2, 0]
+
+    # The sequence isn't linked to the new hire
+    sequence.delete()
+    new_hire.refresh_from_db()
+    assert [new_hire.total_tasks, new_hire.completed_tasks] == [2, 0]
+
+    new_hire.conditions.get().delete()
+    new_hire.refresh_from_db()
+    assert [new_hire.total_tasks, new_hire.completed_tasks] == [0, 0]
+    assert User.objects.recalculate_progress() == 0
+
+
+@pytest.mark.django_db
+def test_progress_counters_on_save(new_hire_factory, django_assert_num_queries):
+    new_hire = new_hire_factory()
+    User.objects.add_progress([new_hire.id], total=2)
+
+    # Outdated counters are left alone, changed ones are saved
+    new_hire.first_name = "John"
+    new_hire.save()
+    new_hire.refresh_from_db()
+    assert new_hire.total_tasks == 2
+    new_hire.total_tasks = 5
+    new_hire.save()
+    new_hire.refresh_from_db()
+    assert new_hire.total_tasks == 5
+
+    # Fields that weren't loaded aren't loaded to save it
+    new_hire = User.objects.only("email", "first_name").get(id=new_hire.id)
+    new_hire.first_name = "Jane"
+    with django_assert_num_queries(1):
+        new_hire.save()
+    new_hire.refresh_from_db()
+    assert [new_hire.first_name, new_hire.total_tasks] == ["Jane", 5]
+
+
+@pytest.mark.django_db
+def test_progress_counters_on_condition_change(
+    new_hire_factory, condition_timed_factory, to_do_factory, badge_factory
+):
+    new_hire = new_hire_factory()
+    condition = condition_timed_factory()
+    new_hire.conditions.add(condition)
+    to_do = to_do_factory()
+
+    condition.add_item(to_do)
+    condition.add_item(badge_factory())
+    new_hire.refresh_from_db()
+    assert new_hire.total_tasks == 1
+
+    condition.remove_item(to_do)
+    new_hire.refresh_from_db()
+    assert new_hire.total_tasks == 0
+    assert User.objects.recalculate_progress() == 0
+
+
+@pytest.mark.django_db
+def test_recalculate_progress_command(new_hire_factory, to_do_user_factory):
+    new_hire = new_hire_factory()
+    to_do_user_factory(user=new_hire, completed=True)
+    to_do_user_factory(user=new_hire)
+
+    call_command("recalculate_progress", "--user", new_hire.id, stdout=StringIO())
+
+    new_hire.refresh_from_db()
+    assert new_hire.total_tasks == 2
+    assert new_hire.completed_tasks == 1
+
+    # Nothing changes when running it again
+    assert User.objects.recalculate_progress() == 0
+
+
+@pytest.mark.django_db
+def test_resource_user_add_step(
+    resource_user_factory, resource_factory, chapter_factory, django_assert_num_queries
+):
+    resource = resource_factory(course=True)
+    resource.chapters.all().delete()
+    chapter_factory(resource=resource, type=0, order=0)
+    chapter_factory(resource=resource, type=1, order=1)
+    chapter_factory(resource=resource, type=1, order=2)
+    last_chapter = chapter_factory(resource=resource, type=2, order=3)
+    resource_user = resource_user_factory(resource=resource)
+    new_hire = resource_user.user
+
+    # Folders are skipped: the chapters, the update and the next chapter
+    with django_assert_num_queries(3):
+        assert resource_user.add_step() == last_chapter
+    assert resource_user.step == 3
+
+    # Clicking twice on the same page doesn't skip a chapter
+    outdated_resource_user = ResourceUser.objects.get(id=resource_user.id)
+    outdated_resource_user.step = 0
+    assert outdated_resource_user.add_step() == last_chapter
+
+    assert resource_user.add_step() is None
+    resource_user.refresh_from_db()
+    assert resource_user.step == 4
+    assert resource_user.completed_course
+
+    # Nothing happens once completed
+    assert resource_user.add_step() is None
+    new_hire.refresh_from_db()
+    assert new_hire.completed_tasks == 1
+
+
+@pytest.mark.django_db
+def test_resource_user_course_score(resource_user_factory, chapter_factory):
+    resource_user = resource_user_factory()
+    chapter = chapter_factory(resource=resource_user.resource, type=2)
+    chapter.content = {
+        "time": 0,
+        "blocks": [
+            {"id": "1", "type": "question", "items": [], "answer": "1"},
+            {"id": "2", "type": "question", "items": [], "answer": "3"},
+        ],
+    }
+    chapter.save()
+
+    # Graded when the answers get added
+    resource_user.answers.add(
+        CourseAnswer.objects.create(
+            chapter=chapter, answers={"item-0": "1", "item-1": "4"}
+        )
+    )
+    resource_user.refresh_from_db()
+    assert resource_user.amount_of_questions == 2
+    assert resource_user.amount_of_correct_answers == 1
+    assert resource_user.get_rating == "1 correct answers out of 2 questions"
+
+    # Backfill recalculates them from scratch
+    ResourceUser.objects.update(amount_of_questions=0, amount_of_correct_answers=0)
+    out = StringIO()
+    call_command("recalculate_course_scores", stdout=out)
+    assert "Updated the scores of 1 course items" in out.getvalue()
+
+    resource_user.refresh_from_db()
+    assert resource_user.amount_of_questions == 2
+    assert resource_user.amount_of_correct_answers == 1
+
+    resource_user.answers.clear()
+    resource_user.refresh_from_db()
+    assert resource_user.get_rating == "n/a"
+
+
+@pytest.mark.django_db
+@freeze_time("2022-05-13 08:00:00")
+def test_new_hires_at_local_hour(new_hire_factory, django_assert_num_queries):
+    # Friday, 8 am in UTC (the timezone of the organization)
+    today = datetime.date(2022, 5, 13)
+    without_timezone = new_hire_factory(start_day=today)
+    same_time = new_hire_factory(start_day=today, timezone="Atlantic/Reykjavik")
+    # 10 am
+    new_hire_factory(start_day=today, timezone="Europe/Amsterdam")
+    # Not started yet
+    new_hire_factory(start_day=today + datetime.timedelta(days=1))
+    # 10 pm, 8 am is on Saturday
+    kiritimati = new_hire_factory(
+        start_day=today - datetime.timedelta(days=7), timezone="Pacific/Kiritimati"
+    )
+
+    Organization.object.get_cached()
+    with django_assert_num_queries(1):
+        new_hires = list(User.new_hires.at_local_hour(8))
+    assert set(new_hires) == {without_timezone, same_time}
+
+    # Only on weekdays
+    thursday_evening = datetime.datetime(2022, 5, 12, 18, tzinfo=pytz.utc)
+    assert list(User.new_hires.at_local_hour(8, now=thursday_evening)) == [kiritimati]
+    friday_evening = datetime.datetime(2022, 5, 13, 18, tzinfo=pytz.utc)
+    assert not User.new_hires.at_local_hour(8, now=friday_evening).exists()